@@ -4,6 +4,7 @@ import os
 import shutil
 from datetime import datetime
 from fabric_tracker_tk import db
+from fabric_tracker_tk.latency import timed
 
 # Always use the same persistent backup directory as db.py
 BACKUP_DIR = db.BACKUP_PATH
@@ -20,6 +21,8 @@ class BackupRestoreFrame(ttk.Frame):
             return
         self.build_ui()
         self.refresh_backup_list()
+        self.refresh_fy_list()
+        self.refresh_maintenance()
 
     def build_ui(self):
         ttk.Label(self, text="Backup & Restore Database", font=("Arial", 14, "bold")).pack(pady=10)
@@ -37,17 +40,51 @@ class BackupRestoreFrame(ttk.Frame):
         ttk.Button(self, text="Restore from Selected Backup", command=self.restore_db).pack(pady=10)
 
         # Backup List
-        self.backup_list = ttk.Treeview(self, columns=("file", "date"), show="headings", height=8)
+        self.backup_list = ttk.Treeview(self, columns=("file", "date", "check"), show="headings", height=8)
         self.backup_list.heading("file", text="Backup File")
         self.backup_list.heading("date", text="Created At")
+        self.backup_list.heading("check", text="Verified")
         self.backup_list.column("file", width=300)
         self.backup_list.column("date", width=150)
+        self.backup_list.column("check", width=300)
         self.backup_list.pack(fill="x", padx=10, pady=5)
+        self.check_label = ttk.Label(self, text="", foreground="gray")
+        self.check_label.pack(anchor="w", padx=10)
+        self._check_poll = None
+
+        # Year-end close: finished work of closed years moves to archive files
+        fy_frame = ttk.LabelFrame(self, text="Financial Year Archive")
+        fy_frame.pack(fill="x", padx=10, pady=10)
+        ttk.Label(fy_frame, text="FY starting April:").pack(side="left", padx=5, pady=5)
+        self.fy_var = tk.StringVar()
+        self.fy_combo = ttk.Combobox(fy_frame, textvariable=self.fy_var, state="readonly", width=8)
+        self.fy_combo.pack(side="left", padx=5)
+        ttk.Button(fy_frame, text="Close Financial Year...", command=self.close_financial_year).pack(side="left", padx=5)
+        self.closed_label = ttk.Label(fy_frame, text="", foreground="gray")
+        self.closed_label.pack(side="left", padx=10)
+
+        # Planner statistics and free space; the idle scheduler runs the same steps
+        maint_frame = ttk.LabelFrame(self, text="Database Maintenance")
+        maint_frame.pack(fill="x", padx=10, pady=5)
+        maint_top = ttk.Frame(maint_frame)
+        maint_top.pack(fill="x")
+        ttk.Button(maint_top, text="Run Maintenance Now", command=self.run_maintenance).pack(side="left", padx=5, pady=5)
+        ttk.Button(maint_top, text="Refresh", command=self.refresh_maintenance).pack(side="left", padx=5)
+        self.stats_label = ttk.Label(maint_top, text="", foreground="gray")
+        self.stats_label.pack(side="left", padx=10)
+        cols = ("at", "action", "detail", "ms", "size", "free")
+        self.maint_list = ttk.Treeview(maint_frame, columns=cols, show="headings", height=5)
+        for c, h, w in zip(cols, ["When", "Action", "Details", "Time (ms)", "File size (MB)", "Free pages"],
+                           [140, 120, 330, 80, 140, 120]):
+            self.maint_list.heading(c, text=h)
+            self.maint_list.column(c, width=w, anchor="e" if c == "ms" else "w")
+        self.maint_list.pack(fill="x", padx=5, pady=5)
 
         # Status Label
         self.status_label = ttk.Label(self, text="", foreground="blue")
         self.status_label.pack(pady=5)
 
+    @timed
     def refresh_backup_list(self):
         for r in self.backup_list.get_children():
             self.backup_list.delete(r)
@@ -59,11 +96,138 @@ class BackupRestoreFrame(ttk.Frame):
             for f in files:
                 path = os.path.join(BACKUP_DIR, f)
                 created = datetime.fromtimestamp(os.path.getctime(path)).strftime("%Y-%m-%d %H:%M:%S")
-                self.backup_list.insert("", "end", values=(f, created))
+                self.backup_list.insert("", "end", iid=f, values=(f, created, ""))
         except FileNotFoundError:
             self.status_label.config(text="Backup directory not found.", foreground="red")
         except Exception as e:
             self.status_label.config(text=f"Failed to refresh backup list: {e}", foreground="red")
+        self.refresh_checks()
+
+    def refresh_checks(self):
+        """Show verification results; checks finish on a background thread, so poll until they have."""
+        if self._check_poll:
+            self.after_cancel(self._check_poll)
+            self._check_poll = None
+        pending = False
+        for f in self.backup_list.get_children():
+            result = db.integrity_result(os.path.join(BACKUP_DIR, f))
+            pending = pending or result == "pending"
+            self.backup_list.set(f, "check", self._check_text(result))
+        db_result = db.integrity_result()
+        pending = pending or db_result in (None, "pending")  # The startup check is queued shortly after launch
+        self.check_label.config(text=f"Database check: {self._check_text(db_result) or 'not run yet'}")
+        if pending:
+            self._check_poll = self.after(1000, self.refresh_checks)
+
+    @staticmethod
+    def _check_text(result):
+        if result is None:
+            return ""
+        if result == "pending":
+            return "Checking..."
+        when = result["at"].replace("T", " ")
+        if result["ok"]:
+            return f"OK  ·  {result['pages']:,} pages in {result['ms'] / 1000:,.1f} s  ·  {when}"
+        return f"FAILED  ·  {result['errors'][0]}  ·  {when}"
+
+    @timed
+    def refresh_fy_list(self):
+        """Offer the ended financial years after the last closed one."""
+        try:
+            closings = db.list_fy_closings()
+        except Exception as e:
+            self.status_label.config(text=f"Failed to read closed years: {e}", foreground="red")
+            return
+        now = datetime.now()
+        last_ended = now.year - 1 if now.month >= 4 else now.year - 2
+        first = int(closings[-1]["start_date"][:4]) + 1 if closings else last_ended - 5
+        years = [str(y) for y in range(first, last_ended + 1)]
+        self.fy_combo["values"] = years
+        self.fy_var.set(years[0] if years else "")
+        if closings:
+            self.closed_label.config(text="Closed: " + ", ".join(c["fy"] for c in closings))
+        else:
+            self.closed_label.config(text="No financial year closed yet.")
+
+    @timed
+    def close_financial_year(self):
+        if not self.fy_var.get():
+            messagebox.showinfo("Close Financial Year", "There is no ended financial year left to close.")
+            return
+        year = int(self.fy_var.get())
+        fy = db.fy_label(year)
+        confirm = messagebox.askyesno(
+            "Confirm Year-End Close",
+            f"Close FY {fy}?\n\n"
+            "Finished batches up to the year end, with their purchases and dyeing returns, move to "
+            f"{db.ARCHIVE_FILE_PREFIX}{fy}.db and stay available to reports. Entries dated in the "
+            "closed year can no longer be added, edited or deleted.\n\n"
+            "A backup is taken first. Continue?"
+        )
+        if not confirm:
+            return
+        self.config(cursor="watch")
+        self.update_idletasks()
+        try:
+            db.backup_db()
+            result = db.close_financial_year(year)
+        except ValueError as e:
+            messagebox.showerror("Close Financial Year", str(e))
+            return
+        except Exception as e:
+            self.status_label.config(text=f"Year-end close failed: {e}", foreground="red")
+            return
+        finally:
+            self.config(cursor="")
+        counts = result["counts"]
+        self.status_label.config(
+            text=f"FY {fy} closed: {counts['batches']} batches, {counts['purchases']} purchases and "
+                 f"{counts['dyeing_outputs']} dyeing returns archived. Database "
+                 f"{result['size_before'] / 1e6:,.1f} MB -> {result['size_after'] / 1e6:,.1f} MB.",
+            foreground="green")
+        self.refresh_backup_list()
+        self.refresh_fy_list()
+        self.refresh_maintenance()
+        if hasattr(self.controller, "update_all_statuses"):
+            self.controller.update_all_statuses()
+
+    @timed
+    def refresh_maintenance(self):
+        """Show current file stats and the logged maintenance runs with before/after figures."""
+        try:
+            stats = db.db_file_stats()
+        except Exception as e:
+            self.stats_label.config(text=f"Failed to read database stats: {e}")
+            return
+        analyzed = stats["analyzed_at"].replace("T", " ") if stats["analyzed_at"] else "never"
+        self.stats_label.config(
+            text=f"{stats['size'] / 1e6:,.1f} MB  ·  {stats['free_pages']:,} free page(s) "
+                 f"({stats['free_bytes'] / 1e6:,.1f} MB)  ·  auto-vacuum {stats['auto_vacuum']}  ·  "
+                 f"last ANALYZE {analyzed}")
+        for r in self.maint_list.get_children():
+            self.maint_list.delete(r)
+        for entry in db.maintenance_log():
+            before, after = entry["before"], entry["after"]
+            self.maint_list.insert("", "end", values=(
+                entry["at"].replace("T", " "), entry["action"], entry["detail"], f"{entry['ms']:,.0f}",
+                f"{before['size'] / 1e6:,.1f} -> {after['size'] / 1e6:,.1f}",
+                f"{before['free_pages']:,} -> {after['free_pages']:,}"))
+
+    @timed
+    def run_maintenance(self):
+        self.config(cursor="watch")
+        self.update_idletasks()
+        try:
+            analyzed, freed = db.run_maintenance()
+        except Exception as e:
+            self.status_label.config(text=f"Maintenance failed: {e}", foreground="red")
+            return
+        finally:
+            self.config(cursor="")
+        self.status_label.config(
+            text=f"Maintenance done: {len(analyzed)} table(s) analyzed, {freed:,} free page(s) released.",
+            foreground="green")
+        self.refresh_maintenance()
 
     def backup_db_auto(self):
         """Use db.backup_db() so both auto-backup paths stay in sync."""
@@ -108,12 +272,18 @@ class BackupRestoreFrame(ttk.Frame):
             if not confirm:
                 return
 
-            db_path = db.get_db_path()
-            with open(restore_path, "rb") as src, open(db_path, "wb") as dst:
-                shutil.copyfileobj(src, dst)
+            self.config(cursor="watch")
+            self.update_idletasks()
+            try:
+                db.restore_backup(restore_path)  # Verifies the backup first
+            finally:
+                self.config(cursor="")
             self.status_label.config(
                 text="Database restored successfully. Please restart the app to apply changes.",
                 foreground="green"
             )
+        except ValueError as e:
+            messagebox.showerror("Restore Refused", str(e))
+            self.refresh_checks()
         except Exception as e:
             self.status_label.config(text=f"Restore failed: {e}", foreground="red")
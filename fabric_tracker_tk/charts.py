@@ -0,0 +1,166 @@
+# Dashboard charts, drawn with matplotlib's Agg backend on a worker thread.
+# matplotlib is imported on first render so it adds nothing to startup unless
+# the Dashboard is shown. Tk 8.6 decodes the PNG bytes natively.
+import io
+import queue
+import threading
+from fabric_tracker_tk import db
+
+CHART_CACHE_SIZE = 12  # Rendered PNGs kept in memory
+CHART_SIZE = (5.2, 3.0)  # Inches
+CHART_DPI = 80
+STATUS_ORDER = db.STATUSES
+STATUS_COLOURS = ["#9aa5b1", "#4a90d9", "#e0a030", "#3aa76d"]
+FIRM_COLOURS = {db.FIRMS[0]: "#4a90d9", db.FIRMS[1]: "#e0a030"}
+
+CHARTS = {
+    "status": "Status Distribution",
+    "monthly_kg": "Monthly Kg by Firm",
+    "shortage": "Dyeing Shortage Trend",
+}
+
+def _new_figure():
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+    return fig, fig.add_subplot(111)
+
+def _to_png(fig):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    FigureCanvasAgg(fig)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+def _empty(ax, text="No data available"):
+    ax.text(0.5, 0.5, text, ha="center", va="center", color="gray")
+    ax.set_axis_off()
+
+def render_status(from_date, to_date, fabricator):
+    counts = db.batch_status_counts(from_date, to_date, fabricator)
+    fig, ax = _new_figure()
+    values = [counts.get(s, (0, 0))[0] for s in STATUS_ORDER]
+    if not any(values):
+        _empty(ax)
+    else:
+        bars = ax.bar(STATUS_ORDER, values, color=STATUS_COLOURS)
+        ax.bar_label(bars, fontsize=8)
+        ax.set_ylabel("Batches")
+        ax.set_title("Batches by status", fontsize=10)
+    return _to_png(fig)
+
+def render_monthly_kg(from_date, to_date, fabricator, months=12):
+    rows = db.purchase_totals(from_date, to_date, delivered_to=fabricator,
+                              group_by=("firm_name", "month"))
+    all_months = sorted({r["month"] for r in rows if r["month"]})
+    if not (from_date or to_date):
+        all_months = all_months[-months:]  # Unfiltered: most recent months only
+    fig, ax = _new_figure()
+    if not all_months:
+        _empty(ax)
+        return _to_png(fig)
+    index = {m: i for i, m in enumerate(all_months)}
+    firms = sorted({r["firm_name"] for r in rows if r["month"] in index})
+    width = 0.8 / max(len(firms), 1)
+    peak = 0.0
+    for n, firm in enumerate(firms):
+        kg = [0.0] * len(all_months)
+        for r in rows:
+            if r["firm_name"] == firm and r["month"] in index:
+                kg[index[r["month"]]] = r["qty_kg"]
+        xs = [i + (n - (len(firms) - 1) / 2) * width for i in range(len(all_months))]
+        ax.bar(xs, kg, width=width, label=firm or "(no firm)", color=FIRM_COLOURS.get(firm))
+        peak = max(peak, max(kg))
+    ax.set_xticks(range(len(all_months)))
+    ax.set_xticklabels(all_months, rotation=45, ha="right", fontsize=7)
+    ax.set_ylabel("Kg")
+    ax.set_title("Yarn purchased per month", fontsize=10)
+    ax.set_ylim(0, peak * 1.25 or 1)  # Headroom for the legend
+    ax.legend(fontsize=7, loc="upper center", ncol=len(firms))
+    return _to_png(fig)
+
+def render_shortage(from_date, to_date, fabricator, months=12):
+    rows = db.dyeing_shortage_by_month(from_date, to_date, fabricator)
+    if not (from_date or to_date):
+        rows = rows[-months:]
+    fig, ax = _new_figure()
+    if not rows:
+        _empty(ax)
+        return _to_png(fig)
+    labels = [r["month"] for r in rows]
+    pct = [(1 - r["returned_kg"] / r["sent_kg"]) * 100 if r["sent_kg"] else 0 for r in rows]
+    ax.plot(range(len(labels)), pct, marker="o", color="#c0392b")
+    ax.axhline(0, color="gray", linewidth=0.8)
+    ax.set_xticks(range(len(labels)))
+    ax.set_xticklabels(labels, rotation=45, ha="right", fontsize=7)
+    ax.set_ylabel("Shortage %")
+    ax.set_title("Dyeing shortage (kg sent vs returned)", fontsize=10)
+    return _to_png(fig)
+
+RENDERERS = {"status": render_status, "monthly_kg": render_monthly_kg, "shortage": render_shortage}
+
+class ChartRenderer:
+    """
+    Renders charts on one daemon thread and caches the PNG bytes. request()
+    returns cached bytes immediately or queues a render; finished renders are
+    collected on the Tk thread with poll().
+    """
+    def __init__(self):
+        self._cache = {}  # key -> png bytes; insertion order = LRU order
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._done = queue.Queue()
+        self._pending = set()
+        self._worker = None
+
+    def key(self, chart, filters):
+        return (chart, tuple(filters), db.get_data_version())
+
+    def cached(self, key):
+        with self._lock:
+            png = self._cache.pop(key, None)
+            if png is not None:
+                self._cache[key] = png
+            return png
+
+    def request(self, chart, filters):
+        """Return (key, png or None). A None png means a render was queued."""
+        key = self.key(chart, filters)
+        png = self.cached(key)
+        if png is not None:
+            return key, png
+        with self._lock:
+            if key not in self._pending:
+                self._pending.add(key)
+                self._jobs.put(key)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="chart-render", daemon=True)
+                self._worker.start()
+        return key, None
+
+    def _run(self):
+        while True:
+            key = self._jobs.get()
+            chart, filters, _version = key
+            try:
+                png, error = RENDERERS[chart](*filters), None
+            except Exception as e:  # ImportError when matplotlib is missing, or a query error
+                png, error = None, e
+            with self._lock:
+                self._pending.discard(key)
+                if png is not None:
+                    self._cache[key] = png
+                    while len(self._cache) > CHART_CACHE_SIZE:
+                        self._cache.pop(next(iter(self._cache)))
+            self._done.put((key, png, error))
+
+    def poll(self):
+        """Return finished (key, png, error) tuples without blocking."""
+        done = []
+        while True:
+            try:
+                done.append(self._done.get_nowait())
+            except queue.Empty:
+                return done
+
+renderer = ChartRenderer()
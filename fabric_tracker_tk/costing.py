@@ -0,0 +1,152 @@
+# Batch costing engine: yarn, knitting and dyeing cost for every batch from
+# three grouped queries, combined in one vectorised NumPy pass. Processing
+# cost uses each unit's rate card (db.get_rate_cards), so nothing is tied to
+# particular unit names.
+import numpy as np
+from fabric_tracker_tk import db
+
+COSTING_COLUMNS = ("batch", "firm", "first_date", "yarn_kg", "yarn_cost", "knit_kg", "knit_cost",
+                   "dyed_kg", "dye_cost", "net_cost", "cost_per_kg")
+
+class BatchCosting:
+    """Costing for a set of batches, one NumPy array per numeric column."""
+    def __init__(self, batch, firm, first_date, yarn_kg, yarn_cost, knit_kg, knit_cost, dyed_kg, dye_cost):
+        self.batch = np.asarray(batch, dtype=object)
+        self.firm = np.asarray(firm, dtype=object)
+        self.first_date = np.asarray(first_date, dtype=object)
+        self.yarn_kg, self.yarn_cost = yarn_kg, yarn_cost
+        self.knit_kg, self.knit_cost = knit_kg, knit_cost
+        self.dyed_kg, self.dye_cost = dyed_kg, dye_cost
+        self.net_cost = yarn_cost + knit_cost + dye_cost
+        # Cost is spread over the furthest-processed weight: dyed, else knitted, else yarn
+        output_kg = np.where(dyed_kg > 0, dyed_kg, np.where(knit_kg > 0, knit_kg, yarn_kg))
+        self.cost_per_kg = np.divide(self.net_cost, output_kg,
+                                     out=np.zeros_like(self.net_cost), where=output_kg > 0)
+
+    def __len__(self):
+        return len(self.batch)
+
+    def select(self, mask):
+        """Return a new BatchCosting restricted to a boolean mask or index array."""
+        return BatchCosting(self.batch[mask], self.firm[mask], self.first_date[mask],
+                            self.yarn_kg[mask], self.yarn_cost[mask], self.knit_kg[mask],
+                            self.knit_cost[mask], self.dyed_kg[mask], self.dye_cost[mask])
+
+    def filter(self, firm=None, from_date=None, to_date=None):
+        """Batches for a firm and/or whose first purchase falls in a date range."""
+        mask = np.ones(len(self), dtype=bool)
+        if firm is not None:
+            mask &= self.firm == firm
+        if from_date or to_date:
+            dates = self.first_date.astype(str)
+            has_date = self.first_date != ""
+            if from_date:
+                mask &= has_date & (dates >= from_date)
+            if to_date:
+                mask &= has_date & (dates <= to_date)
+        return self.select(mask)
+
+    def sorted_by(self, column, descending=False):
+        values = getattr(self, column)
+        if values.dtype == object:
+            values = values.astype(str)
+        order = np.argsort(values, kind="stable")
+        if descending:
+            order = order[::-1]
+        return self.select(order)
+
+    def rows(self):
+        """Yield one tuple per batch in COSTING_COLUMNS order."""
+        cols = [getattr(self, c).tolist() for c in COSTING_COLUMNS]
+        for i in range(len(self)):
+            yield tuple(c[i] for c in cols)
+
+    def totals(self):
+        return {c: float(getattr(self, c).sum()) for c in
+                ("yarn_kg", "yarn_cost", "knit_kg", "knit_cost", "dyed_kg", "dye_cost", "net_cost")}
+
+def load_costing(from_date=None, to_date=None):
+    """
+    Cost every batch known from batches or purchases, plus archived batches
+    with rows dated between from_date and to_date when either is given.
+    """
+    rates = db.get_rate_cards()
+    with db.get_connection() as conn:
+        if from_date or to_date:
+            db.attach_archives(conn, from_date, to_date)
+        yarn = conn.execute("""
+            SELECT batch_id, SUM(COALESCE(qty_kg, 0)) AS kg,
+                   SUM(COALESCE(qty_kg, 0) * COALESCE(price_per_unit, 0)) AS cost,
+                   MIN(date) AS first_date
+            FROM purchases
+            WHERE batch_id IS NOT NULL AND batch_id != ''
+            GROUP BY batch_id
+        """).fetchall()
+        knitted = conn.execute("""
+            SELECT p.batch_id, s.id AS unit_id, SUM(COALESCE(p.qty_kg, 0)) AS kg
+            FROM purchases p
+            JOIN suppliers s ON s.name = p.delivered_to AND s.type = 'knitting_unit'
+            WHERE p.batch_id IS NOT NULL AND p.batch_id != ''
+            GROUP BY p.batch_id, s.id
+        """).fetchall()
+        dyed = conn.execute("""
+            SELECT b.batch_ref AS batch_id, d.dyeing_unit_id AS unit_id,
+                   SUM(COALESCE(d.returned_qty_kg, 0)) AS kg
+            FROM dyeing_outputs d
+            JOIN lots l ON l.id = d.lot_id
+            JOIN batches b ON b.id = l.batch_id
+            GROUP BY b.batch_ref, d.dyeing_unit_id
+        """).fetchall()
+        firms = dict(conn.execute("SELECT batch_ref, COALESCE(firm_name, '') FROM batches").fetchall())
+
+    refs = sorted(set(firms) | {r["batch_id"] for r in yarn} | {r["batch_id"] for r in dyed})
+    index = {ref: i for i, ref in enumerate(refs)}
+    n = len(refs)
+
+    yarn_kg = np.zeros(n)
+    yarn_cost = np.zeros(n)
+    first_date = [""] * n
+    if yarn:
+        idx = np.fromiter((index[r["batch_id"]] for r in yarn), dtype=np.int64, count=len(yarn))
+        yarn_kg[idx] = np.fromiter((r["kg"] for r in yarn), dtype=float, count=len(yarn))
+        yarn_cost[idx] = np.fromiter((r["cost"] for r in yarn), dtype=float, count=len(yarn))
+        for r in yarn:
+            first_date[index[r["batch_id"]]] = r["first_date"] or ""
+
+    def processed(rows):
+        """Per-batch (kg, cost) with each row priced at its unit's rate."""
+        if not rows:
+            return np.zeros(n), np.zeros(n)
+        idx = np.fromiter((index[r["batch_id"]] for r in rows), dtype=np.int64, count=len(rows))
+        kg = np.fromiter((r["kg"] for r in rows), dtype=float, count=len(rows))
+        rate = np.fromiter((rates.get(r["unit_id"], (None, None, 0.0))[2] for r in rows),
+                           dtype=float, count=len(rows))
+        return (np.bincount(idx, weights=kg, minlength=n),
+                np.bincount(idx, weights=kg * rate, minlength=n))
+
+    knit_kg, knit_cost = processed(knitted)
+    dyed_kg, dye_cost = processed(dyed)
+    firm = [firms.get(ref, "") for ref in refs]
+    return BatchCosting(refs, firm, first_date, yarn_kg, yarn_cost, knit_kg, knit_cost, dyed_kg, dye_cost)
+
+_costing_cache = None  # (data_version, archived years included, BatchCosting)
+
+def get_costing(from_date=None, to_date=None):
+    """load_costing(), reused until the database changes or other archives are needed."""
+    global _costing_cache
+    version = db.get_data_version()
+    archives = tuple(db.archives_for(from_date, to_date)) if from_date or to_date else ()
+    if _costing_cache and _costing_cache[:2] == (version, archives):
+        return _costing_cache[2]
+    costing = load_costing(from_date, to_date) if archives else load_costing()
+    _costing_cache = (version, archives, costing)
+    return costing
+
+def batch_cost(batch_ref):
+    """Costing of one batch as a dict keyed by COSTING_COLUMNS, or None."""
+    costing = get_costing()
+    hits = np.nonzero(costing.batch == batch_ref)[0]
+    if not len(hits):
+        return None
+    row = next(costing.select(hits[:1]).rows())
+    return dict(zip(COSTING_COLUMNS, row))
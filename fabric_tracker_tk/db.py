@@ -1,8 +1,18 @@
 import sqlite3
 import os
+import functools
+import json
+import re
 import sys
 import shutil
-from datetime import datetime
+import threading
+import time
+import queue
+import logging
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from datetime import datetime, timedelta
 
 APP_NAME = "FabricTracker"
 DB_NAME = "fabric_tracker.db"
@@ -11,6 +21,9 @@ MAX_BACKUPS = 5  # keep only latest 5 backups
 DEFAULT_NAMES = ["Shiv Fabrics", "Oswal Finishing Mills"]
 FIRMS = ["S.P. Knitting Works", "R K Bhushan Hosiery"]
 COST_RATES = {"knitting": 5.0, "dyeing": 10.0}  # Configurable rates in $/kg
+USAGE_HALF_LIFE_DAYS = 30.0  # Autocomplete usage score halves every 30 days
+QUERY_CACHE_SIZE = 256       # Cached read results kept (LRU)
+QUERY_CACHE_MAX_ROWS = 5000  # Larger results are returned but not cached
 
 # Define persistent database path
 if os.name == 'nt':  # Windows
@@ -32,7 +45,7 @@ def get_db_path():
     return DB_PATH
 
 def backup_db():
-    """Create a timestamped backup and prune old ones."""
+    """Create a timestamped backup, queue it for verification and prune old ones."""
     if not os.path.exists(BACKUP_PATH):
         os.makedirs(BACKUP_PATH)
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -40,6 +53,7 @@ def backup_db():
     if os.path.exists(get_db_path()):
         with open(get_db_path(), "rb") as src, open(dest, "wb") as dst:
             shutil.copyfileobj(src, dst)
+        queue_integrity_check(dest, "backup")
     backups = sorted([f for f in os.listdir(BACKUP_PATH) if f.startswith("fabric_backup_")])
     while len(backups) > MAX_BACKUPS:
         old_backup = backups.pop(0)
@@ -50,13 +64,197 @@ def backup_db():
     return dest
 
 def restore_backup(path):
-    if os.path.exists(path):
-        with open(path, "rb") as src, open(get_db_path(), "wb") as dst:
-            shutil.copyfileobj(src, dst)
+    """Replace the database with a backup; raises ValueError if the backup fails quick_check."""
+    result = check_file(path, "restore")
+    if not result["ok"]:
+        raise ValueError("Backup failed verification and was not restored:\n" + "\n".join(result["errors"][:5]))
+    with open(path, "rb") as src, open(get_db_path(), "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    clear_query_cache()
+
+# ----------------------------
+# Integrity Checks
+# ----------------------------
+# PRAGMA quick_check reads every page and record of a file but skips the
+# index-versus-table cross checks of integrity_check, so it costs one pass
+# over the file. Checks run on a daemon thread over read-only connections:
+# the database once after startup and each backup as backup_db writes it.
+# The thread only holds a shared lock, so a save made meanwhile waits at most
+# for the check to finish (well inside the connection timeout).
+#
+# Backup results are saved to INTEGRITY_RESULTS_FILE with the file's size and
+# mtime, and reloaded on the next start while the file is unchanged. A backup
+# left without a result, like the one written as the app closes (the checker
+# thread dies with the process), is checked after the next startup
+# (queue_unchecked_backups). restore_backup re-checks its file before copying it.
+INTEGRITY_MAX_ERRORS = 20  # quick_check stops after reporting this many problems
+INTEGRITY_LOG_SIZE = 50
+INTEGRITY_RESULTS_FILE = os.path.join(BASE_DIR, "integrity_checks.json")
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def _load_integrity_results():
+    """Saved backup results whose files are unchanged since they were checked."""
+    try:
+        with open(INTEGRITY_RESULTS_FILE, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # The database changes with every save and is re-checked on each start
+    return {path: r for path, r in saved.items()
+            if r.get("kind") != "database" and r.get("stamp") and r["stamp"] == _file_stamp(path)}
+
+def _save_integrity_results():
+    """Write the results of files still on disk; call with _integrity_lock held."""
+    kept = {path: r for path, r in _integrity_results.items() if os.path.exists(path)}
+    tmp = INTEGRITY_RESULTS_FILE + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(kept, f, indent=1)
+        os.replace(tmp, INTEGRITY_RESULTS_FILE)
+    except OSError as e:
+        print(f"[DB] Could not save integrity results: {e}", file=sys.stderr)
+
+_integrity_results = _load_integrity_results()  # path -> latest result
+_integrity_log = deque(sorted(_integrity_results.values(), key=lambda r: r["at"], reverse=True),
+                       maxlen=INTEGRITY_LOG_SIZE)  # Newest first
+_integrity_pending = set()
+_integrity_lock = threading.Lock()
+_integrity_queue = queue.Queue()
+_integrity_thread = None
+
+def check_file(path, kind="database"):
+    """
+    Run PRAGMA quick_check on a database file through a read-only connection.
+    Returns {'path', 'kind', 'ok', 'errors', 'pages', 'ms', 'at', 'stamp'}; a file that
+    cannot be opened or is not a database counts as failed.
+    """
+    started = time.perf_counter()
+    pages = 0
+    stamp = _file_stamp(path)
+    try:
+        conn = sqlite3.connect(Path(os.path.abspath(path)).as_uri() + "?mode=ro", uri=True, timeout=10)
+        try:
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            rows = conn.execute(f"PRAGMA quick_check({INTEGRITY_MAX_ERRORS})").fetchall()
+            # Problems come one per row, the first prefixed with a "*** in database main ***" line
+            errors = [line for r in rows for line in r[0].splitlines() if line != "ok" and not line.startswith("***")]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        errors = [str(e)]
+    result = {"path": path, "kind": kind, "ok": not errors, "errors": errors, "pages": pages,
+              "ms": (time.perf_counter() - started) * 1000, "at": datetime.now().isoformat(timespec="seconds"),
+              "stamp": stamp}
+    with _integrity_lock:
+        _integrity_results[path] = result
+        _integrity_log.appendleft(result)
+        _save_integrity_results()
+    if errors:
+        print(f"[DB] Integrity check of {kind} {path} FAILED in {result['ms']:.0f} ms: {'; '.join(errors[:3])}",
+              file=sys.stderr)
+    else:
+        print(f"[DB] Integrity check of {kind} {os.path.basename(path)} ok: {pages:,} page(s) in {result['ms']:.0f} ms.")
+    return result
+
+def _integrity_worker():
+    while True:
+        path, kind = _integrity_queue.get()
+        try:
+            if os.path.exists(path):  # Pruned backups may vanish while queued
+                check_file(path, kind)
+        except Exception as e:
+            print(f"[DB] Integrity check of {path} failed to run: {e}", file=sys.stderr)
+        finally:
+            with _integrity_lock:
+                _integrity_pending.discard(path)
+
+def queue_integrity_check(path=None, kind="database"):
+    """Check a file (default: the database) on the background checker thread."""
+    global _integrity_thread
+    path = path or get_db_path()
+    with _integrity_lock:
+        if path in _integrity_pending:
+            return
+        _integrity_pending.add(path)
+        if _integrity_thread is None:
+            _integrity_thread = threading.Thread(target=_integrity_worker, name="integrity-check", daemon=True)
+            _integrity_thread.start()
+    _integrity_queue.put((path, kind))
+
+def queue_unchecked_backups():
+    """Queue every backup that has no result yet. Returns the number queued."""
+    queued = 0
+    for name in sorted(os.listdir(BACKUP_PATH)):
+        path = os.path.join(BACKUP_PATH, name)
+        if name.startswith("fabric_backup_") and integrity_result(path) is None:
+            queue_integrity_check(path, "backup")
+            queued += 1
+    return queued
+
+def integrity_result(path=None):
+    """Latest check of a file: a result dict, 'pending' while queued or running, or None if never checked."""
+    path = path or get_db_path()
+    with _integrity_lock:
+        if path in _integrity_pending:
+            return "pending"
+        return _integrity_results.get(path)
+
+def integrity_log():
+    """Return the logged checks, newest first."""
+    with _integrity_lock:
+        return list(_integrity_log)
 
 # ----------------------------
 # Database Connection
 # ----------------------------
+_write_counter = 0  # Bumped on every commit in this process that wrote something
+
+class _TrackedConnection(sqlite3.Connection):
+    """Connection that counts committed writes, so query caches invalidate
+    immediately without waiting for PRAGMA data_version to be polled, and
+    hands out timed cursors (see Query Timing)."""
+    def commit(self):
+        global _write_counter
+        wrote = self.in_transaction
+        start = time.perf_counter()
+        super().commit()
+        if wrote:
+            _write_counter += 1
+            if QUERY_TIMING:
+                _record_query("COMMIT", None, _caller_code(sys._getframe(1)), time.perf_counter() - start)
+
+    def __exit__(self, exc_type, exc, tb):
+        global _write_counter
+        wrote = self.in_transaction and exc_type is None
+        start = time.perf_counter()
+        result = super().__exit__(exc_type, exc, tb)
+        if wrote:
+            _write_counter += 1
+            if QUERY_TIMING:
+                _record_query("COMMIT", None, _caller_code(sys._getframe(1)), time.perf_counter() - start)
+        return result
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = _TimedCursor if QUERY_TIMING else sqlite3.Cursor
+        return super().cursor(factory)
+
+    # The C shortcuts do not go through cursor(), so route them explicitly
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
 def get_connection():
     """
     Return a direct sqlite3 connection (works with both:
@@ -64,11 +262,326 @@ def get_connection():
       - with get_connection() as conn:
     )
     """
-    conn = sqlite3.connect(get_db_path(), timeout=10)
+    conn = sqlite3.connect(get_db_path(), timeout=10, factory=_TrackedConnection)
     conn.row_factory = sqlite3.Row
+    if SQL_TRACE:
+        conn.set_trace_callback(_trace_statement)
     conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
+# ----------------------------
+# Query Timing
+# ----------------------------
+# Cursors from get_connection() time each statement: execute() plus the
+# fetchone/fetchmany/fetchall calls that read its rows, charged when the
+# cursor moves on (next execute, rows exhausted, close or garbage collection).
+# Rows read by iterating a cursor directly are not timed, which keeps the
+# per-row path in C. Statements are keyed by their SQL with whitespace and
+# IN-list placeholders folded, and keep a call count, total, max, a window of
+# recent durations for p50/p95 and the db function that last ran them. Any
+# run over SLOW_QUERY_MS goes to a rotating log with its parameter shape
+# (types only, never values). The bookkeeping is a few microseconds per
+# statement, so it stays on; QUERY_TIMING turns it off.
+# SQL_TRACE additionally installs set_trace_callback on new connections to
+# log every statement SQLite runs, trigger bodies included, with values
+# bound. It is for debugging and off by default.
+QUERY_TIMING = True
+SQL_TRACE = False
+SLOW_QUERY_MS = 200
+QUERY_TIMING_SAMPLES = 256          # Recent durations kept per statement for percentiles
+QUERY_TIMING_MAX_STATEMENTS = 1000  # Distinct statements tracked; the rest count as "(other)"
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, "slow_queries.log")
+SQL_TRACE_LOG = os.path.join(BASE_DIR, "sql_trace.log")
+LOG_MAX_BYTES = 1_000_000
+LOG_BACKUPS = 3
+
+_query_timings = {}   # statement key -> stats list
+_statement_keys = {}  # raw SQL -> statement key
+_timing_lock = threading.Lock()
+_thread_db_time = threading.local()  # Seconds of timed statements run on each thread
+_IN_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+
+class _ManyParameters:
+    """Marks the parameter sequence of an executemany()."""
+    __slots__ = ("rows",)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+# Code objects of the wrappers below; the caller recorded is the first frame outside them
+_TIMING_WRAPPERS = set()
+
+def _caller_code(frame):
+    while frame.f_code in _TIMING_WRAPPERS:
+        frame = frame.f_back
+    return frame.f_code  # Not the frame itself: that would keep its locals (and this cursor) alive
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time to the statement it last ran."""
+    _pending = None  # [sql, parameters, caller code, seconds]
+
+    def _flush(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            _record_query(*pending)
+
+    def execute(self, sql, parameters=()):
+        if self._pending is not None:
+            self._flush()
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.execute(self, sql, parameters)
+        finally:
+            self._pending = [sql, parameters, _caller_code(sys._getframe(1)), time.perf_counter() - start]
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._pending is not None:
+            self._flush()
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, seq_of_parameters)
+        finally:
+            self._pending = [sql, _ManyParameters(seq_of_parameters), _caller_code(sys._getframe(1)),
+                             time.perf_counter() - start]
+
+    def executescript(self, sql_script):
+        if self._pending is not None:
+            self._flush()
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executescript(self, sql_script)
+        finally:
+            self._pending = [sql_script, None, _caller_code(sys._getframe(1)), time.perf_counter() - start]
+
+    def fetchone(self):
+        pending = self._pending
+        if pending is None:
+            return sqlite3.Cursor.fetchone(self)
+        start = time.perf_counter()
+        row = sqlite3.Cursor.fetchone(self)
+        pending[3] += time.perf_counter() - start
+        if row is None:
+            self._flush()
+        return row
+
+    def fetchmany(self, size=None):
+        pending = self._pending
+        start = time.perf_counter()
+        rows = sqlite3.Cursor.fetchmany(self, self.arraysize if size is None else size)
+        if pending is not None:
+            pending[3] += time.perf_counter() - start
+            if not rows:
+                self._flush()
+        return rows
+
+    def fetchall(self):
+        pending = self._pending
+        start = time.perf_counter()
+        rows = sqlite3.Cursor.fetchall(self)
+        if pending is not None:
+            pending[3] += time.perf_counter() - start
+            self._flush()
+        return rows
+
+    def close(self):
+        self._flush()
+        sqlite3.Cursor.close(self)
+
+    def __del__(self):
+        try:
+            self._flush()
+        except Exception:
+            pass  # Interpreter shutdown
+
+_TIMING_WRAPPERS.update(f.__code__ for f in (
+    _TrackedConnection.execute, _TrackedConnection.executemany, _TrackedConnection.executescript,
+    _TrackedConnection.commit, _TrackedConnection.__exit__))
+
+def _code_name(code):
+    """'module.function' for a code object recorded as a caller."""
+    return f"{os.path.splitext(os.path.basename(code.co_filename))[0]}.{code.co_name}"
+
+def _statement_key(sql):
+    key = _statement_keys.get(sql)
+    if key is None:
+        if len(_statement_keys) > 4 * QUERY_TIMING_MAX_STATEMENTS:
+            _statement_keys.clear()  # f-string SQL with inlined values; start over rather than grow
+        key = _statement_keys[sql] = _IN_LIST.sub("?, ...", " ".join(sql.split()))
+    return key
+
+def _param_shape(parameters):
+    if parameters is None:
+        return "script"
+    if isinstance(parameters, _ManyParameters):
+        rows = parameters.rows
+        return f"{len(rows)} rows" if hasattr(rows, "__len__") else "rows from iterator"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    runs = []  # Long IN lists collapse to e.g. "int x812"
+    for name in (type(v).__name__ for v in parameters):
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return "(" + ", ".join(name if n == 1 else f"{name} x{n}" for name, n in runs) + ")"
+
+def _file_logger(name, path):
+    """Logger writing to a size-rotated file in BASE_DIR."""
+    logger = logging.getLogger(f"fabric_tracker.{name}")
+    if not logger.handlers:
+        handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s  %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+def _trace_statement(sql):
+    _file_logger("sql_trace", SQL_TRACE_LOG).info("%s  %s", threading.current_thread().name, sql)
+
+def _record_query(sql, parameters, caller, seconds):
+    _thread_db_time.seconds = getattr(_thread_db_time, "seconds", 0.0) + seconds
+    key = _statement_key(sql)
+    ms = seconds * 1000
+    with _timing_lock:
+        stat = _query_timings.get(key)
+        if stat is None:
+            if len(_query_timings) >= QUERY_TIMING_MAX_STATEMENTS:
+                key = "(other)"
+                stat = _query_timings.get(key)
+            if stat is None:
+                # [calls, total ms, max ms, slow runs, last caller, recent durations]
+                stat = _query_timings[key] = [0, 0.0, 0.0, 0, caller, deque(maxlen=QUERY_TIMING_SAMPLES)]
+        stat[0] += 1
+        stat[1] += ms
+        if ms > stat[2]:
+            stat[2] = ms
+        stat[4] = caller
+        stat[5].append(ms)
+    if ms >= SLOW_QUERY_MS:
+        with _timing_lock:
+            stat[3] += 1
+        _file_logger("slow_queries", SLOW_QUERY_LOG).info(
+            "%9.1f ms  %s  params=%s  %s", ms, _code_name(caller), _param_shape(parameters), key)
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def query_timings():
+    """Per-statement timings, slowest total first: [{'sql', 'caller', 'calls', 'total_ms', 'p50_ms', 'p95_ms', 'max_ms', 'slow'}]."""
+    with _timing_lock:
+        stats = [(key, stat[:5], sorted(stat[5])) for key, stat in _query_timings.items()]
+    result = [{"sql": key, "caller": _code_name(caller), "calls": calls, "total_ms": total_ms,
+               "p50_ms": _percentile(samples, 0.5), "p95_ms": _percentile(samples, 0.95),
+               "max_ms": max_ms, "slow": slow}
+              for key, (calls, total_ms, max_ms, slow, caller), samples in stats]
+    return sorted(result, key=lambda r: -r["total_ms"])
+
+def thread_db_seconds():
+    """Running total of timed statement seconds on the calling thread; diff two readings for a section's DB time."""
+    return getattr(_thread_db_time, "seconds", 0.0)
+
+def reset_query_timings():
+    with _timing_lock:
+        _query_timings.clear()
+
+def set_query_timing(enabled=None, sql_trace=None, slow_ms=None):
+    """Change timing settings; affects connections opened afterwards (slow_ms applies at once)."""
+    global QUERY_TIMING, SQL_TRACE, SLOW_QUERY_MS
+    if enabled is not None:
+        QUERY_TIMING = bool(enabled)
+    if sql_trace is not None:
+        SQL_TRACE = bool(sql_trace)
+    if slow_ms is not None:
+        SLOW_QUERY_MS = float(slow_ms)
+
+# ----------------------------
+# Data Version
+# ----------------------------
+# PRAGMA data_version on a single long-lived connection changes whenever any
+# other connection commits to the file (this process or another one), so it is
+# a cheap "has anything changed?" check for caches of query results.
+_version_conn = None
+_version_lock = threading.Lock()
+
+def get_data_version():
+    """Return a token that changes after every committed write to the database."""
+    global _version_conn
+    with _version_lock:
+        if _version_conn is None:
+            _version_conn = sqlite3.connect(get_db_path(), timeout=10, check_same_thread=False)
+        return _version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+# ----------------------------
+# Query Result Cache
+# ----------------------------
+# Read helpers decorated with @cached_query remember their results per
+# argument tuple. An entry is valid while both the in-process write counter
+# and PRAGMA data_version (writes from other processes) are unchanged.
+# Results are shared between callers, so treat them as read-only.
+_query_cache = {}  # (func name, args, kwargs) -> (token, result); insertion order = LRU order
+_query_cache_lock = threading.Lock()
+_query_stats = {}  # func name -> [hits, misses]
+
+def _cache_token():
+    return (_write_counter, get_data_version())
+
+def cached_query(func):
+    """Memoise a read-only db function until the database changes."""
+    name = func.__name__
+    _query_stats.setdefault(name, [0, 0])
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return func(*args, **kwargs)
+        token = _cache_token()  # Taken before the query so a racing write only causes a miss
+        with _query_cache_lock:
+            entry = _query_cache.pop(key, None)
+            if entry is not None and entry[0] == token:
+                _query_cache[key] = entry  # Re-insert as most recently used
+                _query_stats[name][0] += 1
+                return entry[1]
+            _query_stats[name][1] += 1
+        result = func(*args, **kwargs)
+        if not isinstance(result, (list, tuple)) or len(result) <= QUERY_CACHE_MAX_ROWS:
+            with _query_cache_lock:
+                _query_cache[key] = (token, result)
+                while len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.pop(next(iter(_query_cache)))
+        return result
+    wrapper.uncached = func
+    return wrapper
+
+def clear_query_cache():
+    """Drop every cached result (e.g. after the database file is replaced)."""
+    global _write_counter
+    with _query_cache_lock:
+        _query_cache.clear()
+        _write_counter += 1
+
+def cache_stats():
+    """Return {'size', 'max_size', 'hits', 'misses', 'functions': {name: (hits, misses)}}."""
+    with _query_cache_lock:
+        functions = {name: tuple(v) for name, v in _query_stats.items()}
+        size = len(_query_cache)
+    return {
+        "size": size,
+        "max_size": QUERY_CACHE_SIZE,
+        "hits": sum(h for h, _ in functions.values()),
+        "misses": sum(m for _, m in functions.values()),
+        "functions": functions,
+    }
+
+def reset_cache_stats():
+    with _query_cache_lock:
+        for v in _query_stats.values():
+            v[0] = v[1] = 0
+
 # ----------------------------
 # DB Initialization / Migrations
 # ----------------------------
@@ -83,6 +596,7 @@ def init_db():
 
     with get_connection() as conn:
         cur = conn.cursor()
+        _init_auto_vacuum(cur)
 
         # Core tables
         cur.execute("""
@@ -240,6 +754,58 @@ def init_db():
         cur.execute("CREATE INDEX IF NOT EXISTS idx_fabric_compositions_name ON fabric_compositions(name)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_lots_lot_no ON lots(lot_no)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_lot_no ON purchases(lot_no)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_dyeing_outputs_lot ON dyeing_outputs(lot_id)")
+        # Case-insensitive indexes for the search_*_prefix range scans
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_suppliers_name_nocase ON suppliers(name COLLATE NOCASE)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_suppliers_type_name_nocase ON suppliers(type, name COLLATE NOCASE)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_yarn_types_name_nocase ON yarn_types(name COLLATE NOCASE)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_fabric_compositions_name_nocase ON fabric_compositions(name COLLATE NOCASE)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_batches_ref_nocase ON batches(batch_ref COLLATE NOCASE)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_lots_lot_no_nocase ON lots(lot_no COLLATE NOCASE)")
+
+        # Per-unit processing rates for batch costing (falls back to COST_RATES)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS rate_cards (
+            unit_id INTEGER PRIMARY KEY,
+            rate_per_kg REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(unit_id) REFERENCES suppliers(id) ON DELETE CASCADE
+        )
+        """)
+
+        # Usage statistics for autocomplete ranking
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS usage_stats (
+            field TEXT NOT NULL,
+            context TEXT NOT NULL DEFAULT '',
+            value TEXT NOT NULL,
+            score REAL DEFAULT 0,
+            last_used REAL DEFAULT 0,
+            PRIMARY KEY (field, context, value)
+        ) WITHOUT ROWID
+        """)
+        cur.execute("SELECT 1 FROM usage_stats LIMIT 1")
+        if not cur.fetchone():
+            _backfill_usage_stats(cur)
+
+        # Global search index (FTS5), kept in sync by triggers
+        _init_search_index(cur)
+
+        # Closed financial years and their archive files
+        _init_archives(cur)
+
+        # Monthly reporting rollups, kept in sync by triggers
+        _init_rollups(cur)
+        _init_status_ranks(cur)
+        _init_status_counts(cur)
+
+        # FIFO yarn cost layers, replayed lazily from trigger-marked changes
+        _init_fifo(cur)
+        _init_yarn_stock(cur)
+        _init_snapshots(cur)
+        _init_status_events(cur)
+        _init_rolls(cur)
+        _init_sales(cur)
+        _init_maintenance(cur)
 
         conn.commit()
 
@@ -254,6 +820,11 @@ def init_db():
 
         conn.commit()
         print("[DB] New DB created and initialized." if created else "[DB] DB init/migrations complete.")
+
+    global _usage_cache
+    with _usage_lock:
+        _usage_cache = None  # Reload lazily from the (possibly new) database
+    clear_query_cache()
 # ----------------------------
 # Date Helpers
 # ----------------------------
@@ -287,14 +858,37 @@ def ui_to_db_date(ui_date: str) -> str:
         raise ValueError(f"Invalid date '{ui_date}': {e}")
 
 # ----------------------------
-# LIKE Helper
+# Prefix Range Helper
 # ----------------------------
-def _escape_like(s: str) -> str:
-    return s.replace("%", r"\%").replace("_", r"\_")
+# "col LIKE 'abc%' ESCAPE '\'" cannot use the plain b-tree indexes, so prefix
+# lookups are written as "col >= low AND col < high" against a COLLATE NOCASE
+# index instead. NOCASE only folds ASCII letters, same as the default LIKE.
+def _nocase_prefix_range(prefix: str):
+    """Return (low, high) bounds for prefix under NOCASE; high is None if unbounded."""
+    low = "".join(c.lower() if "A" <= c <= "Z" else c for c in prefix)
+    high = low
+    while high and ord(high[-1]) >= 0x10FFFF:
+        high = high[:-1]
+    if not high:
+        return low, None
+    nxt = ord(high[-1]) + 1
+    if 0xD800 <= nxt <= 0xDFFF:  # skip surrogates, they cannot be encoded
+        nxt = 0xE000
+    if ord("A") <= nxt <= ord("Z"):  # folded strings never contain A-Z
+        nxt = ord("Z") + 1
+    return low, high[:-1] + chr(nxt)
+
+def _prefix_where(column: str, prefix: str):
+    """SQL condition and params selecting rows whose column starts with prefix."""
+    low, high = _nocase_prefix_range((prefix or "").strip())
+    if high is None:
+        return f"{column} >= ? COLLATE NOCASE", (low,)
+    return f"{column} >= ? COLLATE NOCASE AND {column} < ? COLLATE NOCASE", (low, high)
 
 # ----------------------------
 # Supplier / Masters
 # ----------------------------
+@cached_query
 def list_suppliers(supplier_type=None):
     with get_connection() as conn:
         cur = conn.cursor()
@@ -306,22 +900,21 @@ def list_suppliers(supplier_type=None):
     return rows  # UI can render this as movable/resizable boxes
 
 def search_suppliers_prefix(prefix: str, supplier_type: str = None, limit: int = 20):
-    prefix = (prefix or "").strip()
-    like = _escape_like(prefix) + "%"
+    cond, params = _prefix_where("name", prefix)
     with get_connection() as conn:
         cur = conn.cursor()
         if supplier_type:
-            cur.execute(r"""
+            cur.execute(f"""
                 SELECT id, name, type, color_code FROM suppliers
-                WHERE type=? AND name LIKE ? ESCAPE '\'
-                ORDER BY name LIMIT ?
-            """, (supplier_type, like, limit))
+                WHERE type=? AND {cond}
+                ORDER BY name COLLATE NOCASE LIMIT ?
+            """, (supplier_type, *params, limit))
         else:
-            cur.execute(r"""
+            cur.execute(f"""
                 SELECT id, name, type, color_code FROM suppliers
-                WHERE name LIKE ? ESCAPE '\'
-                ORDER BY name LIMIT ?
-            """, (like, limit))
+                WHERE {cond}
+                ORDER BY name COLLATE NOCASE LIMIT ?
+            """, (*params, limit))
         rows = cur.fetchall()
     return rows
 
@@ -383,6 +976,7 @@ def delete_master_by_name(name: str):
         conn.commit()
     return True
 
+@cached_query
 def get_supplier_id_by_name(name: str, required_type: str = None):
     if not name or not name.strip():
         return None
@@ -395,6 +989,7 @@ def get_supplier_id_by_name(name: str, required_type: str = None):
         row = cur.fetchone()
     return row["id"] if row else None
 
+@cached_query
 def is_delivered_to_valid(name):
     if not name or not name.strip():
         return False
@@ -404,6 +999,7 @@ def is_delivered_to_valid(name):
 # ----------------------------
 # Yarn Types
 # ----------------------------
+@cached_query
 def list_yarn_types():
     with get_connection() as conn:
         rows = [r["name"] for r in conn.execute("SELECT DISTINCT name FROM yarn_types ORDER BY name").fetchall()]
@@ -417,11 +1013,10 @@ def add_yarn_type(name: str):
         conn.commit()
 
 def search_yarn_types_prefix(prefix: str, limit: int = 20):
-    prefix = (prefix or "").strip()
-    like = _escape_like(prefix) + "%"
+    cond, params = _prefix_where("name", prefix)
     with get_connection() as conn:
         rows = [r["name"] for r in conn.execute(
-            r"SELECT name FROM yarn_types WHERE name LIKE ? ESCAPE '\' ORDER BY name LIMIT ?", (like, limit)
+            f"SELECT name FROM yarn_types WHERE {cond} ORDER BY name COLLATE NOCASE LIMIT ?", (*params, limit)
         ).fetchall()]
     return rows
 
@@ -444,6 +1039,7 @@ def delete_yarn_type(name: str):
 # ----------------------------
 # Fabric Compositions
 # ----------------------------
+@cached_query
 def list_fabric_compositions():
     with get_connection() as conn:
         cur = conn.cursor()
@@ -478,16 +1074,15 @@ def add_fabric_composition(name: str, yarn_type_name: str, ratio: float, compone
         conn.commit()
 
 def search_fabric_compositions_prefix(prefix: str, limit: int = 20):
-    prefix = (prefix or "").strip()
-    like = _escape_like(prefix) + "%"
+    cond, params = _prefix_where("fc.name", prefix)
     with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute(r"""
+        cur.execute(f"""
             SELECT fc.name, yt.name AS yarn_type, fc.component, fc.ratio
             FROM fabric_compositions fc
             LEFT JOIN yarn_types yt ON fc.yarn_type_id = yt.id
-            WHERE fc.name LIKE ? ESCAPE '\' ORDER BY fc.name LIMIT ?
-        """, (like, limit))
+            WHERE {cond} ORDER BY fc.name COLLATE NOCASE LIMIT ?
+        """, (*params, limit))
         return cur.fetchall()
 
 def delete_fabric_composition(name: str, component: str, yarn_type_name: str):
@@ -509,53 +1104,128 @@ def delete_fabric_composition(name: str, component: str, yarn_type_name: str):
 # ----------------------------
 # Fabricators / Batches / Lots
 # ----------------------------
+@cached_query
 def get_fabricators(fab_type):
     with get_connection() as conn:
         rows = conn.execute("SELECT * FROM suppliers WHERE type=? ORDER BY name", (fab_type,)).fetchall()
     return rows
 
+@cached_query
 def get_batches_for_fabricator(fabricator_id):
     with get_connection() as conn:
         rows = conn.execute("SELECT * FROM batches WHERE fabricator_id=? ORDER BY created_at DESC", (fabricator_id,)).fetchall()
     return rows
 
 def search_batches_prefix(prefix: str, limit: int = 20):
-    prefix = (prefix or "").strip()
-    like = _escape_like(prefix) + "%"
+    cond, params = _prefix_where("batch_ref", prefix)
     with get_connection() as conn:
         rows = [r["batch_ref"] for r in conn.execute(
-            r"SELECT batch_ref FROM batches WHERE batch_ref LIKE ? ESCAPE '\' ORDER BY batch_ref LIMIT ?", (like, limit)
+            f"SELECT batch_ref FROM batches WHERE {cond} ORDER BY batch_ref COLLATE NOCASE LIMIT ?", (*params, limit)
         ).fetchall()]
     return rows
 
 def create_batch(batch_ref, fabricator_id, fabric_type_name, expected_lots, composition="", dyeing_unit_id=None, firm_name=""):
-    """Create a batch with a specified fabric type."""
+    """Create a batch with a specified fabric type, and its lots in the same transaction."""
     with get_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT 1 FROM fabric_compositions WHERE name=?", (fabric_type_name,))
         if not cur.fetchone():
             raise ValueError(f"Fabric type '{fabric_type_name}' not found.")
-        
+        cur.execute("SELECT 1 FROM batches WHERE batch_ref=?", (batch_ref,))
+        if cur.fetchone():
+            raise ValueError(f"Batch '{batch_ref}' already exists.")
+
         cur.execute("""
             INSERT INTO batches (batch_ref, fabricator_id, fabric_type_name, expected_lots, composition, dyeing_unit_id, firm_name)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (batch_ref, fabricator_id, fabric_type_name, expected_lots, composition, dyeing_unit_id, firm_name))
         bid = cur.lastrowid
-        conn.commit()  # Commit batch immediately
-
-        # Parse composition and add to fabric_compositions
-        if composition:
-            has_rib = "Yes" in composition.split("Rib: ")[1].split(",")[0]
-            has_collar = "Yes" in composition.split("Collar: ")[1].split(",")[0]
-            if has_rib:
-                add_fabric_composition(fabric_type_name, "Rib Yarn", 20.0, "Rib")
-            if has_collar:
-                add_fabric_composition(fabric_type_name, "Collar Yarn", 20.0, "Collar")
-
-        for i in range(1, expected_lots + 1):
-            create_lot(bid, i)
+        _resize_batch_lots(cur, bid, batch_ref, expected_lots)
+        conn.commit()
+
+    # Parse composition and add to fabric_compositions
+    if composition:
+        has_rib = "Yes" in composition.split("Rib: ")[1].split(",")[0]
+        has_collar = "Yes" in composition.split("Collar: ")[1].split(",")[0]
+        if has_rib:
+            add_fabric_composition(fabric_type_name, "Rib Yarn", 20.0, "Rib")
+        if has_collar:
+            add_fabric_composition(fabric_type_name, "Collar Yarn", 20.0, "Collar")
     return bid
 
+def update_batch(batch_id, batch_ref, fabric_type_name, expected_lots, status=None):
+    """
+    Edit a batch in one transaction. A new batch ref is carried over to its
+    purchases, and the lots are resized and renumbered to match.
+    """
+    if status is not None and status not in STATUSES:
+        raise ValueError(f"Invalid status: {status}")
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM fabric_compositions WHERE name=?", (fabric_type_name,))
+        if not cur.fetchone():
+            raise ValueError(f"Fabric type '{fabric_type_name}' not found.")
+        row = cur.execute("SELECT batch_ref, status FROM batches WHERE id=?", (batch_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Batch ID {batch_id} not found.")
+        if batch_ref != row["batch_ref"]:
+            cur.execute("SELECT 1 FROM batches WHERE batch_ref=?", (batch_ref,))
+            if cur.fetchone():
+                raise ValueError(f"Batch '{batch_ref}' already exists.")
+        cur.execute("""
+            UPDATE batches
+            SET batch_ref=?, fabric_type_name=?, expected_lots=?, status=?
+            WHERE id=?
+        """, (batch_ref, fabric_type_name, expected_lots, status or row["status"], batch_id))
+        if batch_ref != row["batch_ref"]:
+            cur.execute("UPDATE purchases SET batch_id=? WHERE batch_id=?", (batch_ref, row["batch_ref"]))
+        _resize_batch_lots(cur, batch_id, batch_ref, expected_lots)
+        conn.commit()
+
+def _resize_batch_lots(cur, batch_id, batch_ref, expected_lots):
+    """
+    Make a batch's lots exactly 1..expected_lots, numbered batch_ref/index.
+    Missing lots are added, surplus lots removed and lots whose number no
+    longer matches the batch ref renamed (with their purchases), each kind of
+    change in one statement. Lots with purchases or dyeing outputs are never
+    removed.
+    """
+    if expected_lots < 0:
+        raise ValueError("Expected lots cannot be negative.")
+    rows = cur.execute("SELECT id, lot_no, lot_index FROM lots WHERE batch_id=?", (batch_id,)).fetchall()
+    surplus = [r for r in rows if r["lot_index"] is not None and r["lot_index"] > expected_lots]
+    if surplus:
+        marks = ",".join("?" * len(surplus))
+        used = cur.execute(f"""
+            SELECT l.lot_no FROM lots l
+            WHERE l.id IN ({marks}) AND (
+                EXISTS (SELECT 1 FROM purchases p WHERE p.lot_no = l.lot_no)
+                OR EXISTS (SELECT 1 FROM dyeing_outputs d WHERE d.lot_id = l.id))
+            ORDER BY l.lot_index LIMIT 1
+        """, [r["id"] for r in surplus]).fetchone()
+        if used:
+            raise ValueError(f"Lot '{used['lot_no']}' has purchases or dyeing outputs and cannot be removed.")
+        cur.executemany("DELETE FROM lots WHERE id=?", [(r["id"],) for r in surplus])
+
+    surplus_ids = {r["id"] for r in surplus}
+    kept = [r for r in rows if r["id"] not in surplus_ids]
+    renames = [(f"{batch_ref}/{r['lot_index']}", r["id"], r["lot_no"]) for r in kept
+               if r["lot_index"] is not None and r["lot_no"] != f"{batch_ref}/{r['lot_index']}"]
+    missing = sorted(set(range(1, expected_lots + 1)) - {r["lot_index"] for r in kept})
+    try:
+        if renames:
+            cur.executemany("UPDATE lots SET lot_no=? WHERE id=?", [r[:2] for r in renames])
+            cur.executemany("UPDATE purchases SET lot_no=? WHERE lot_no=?", [(r[0], r[2]) for r in renames])
+        _add_lots(cur, batch_id, batch_ref, missing)
+    except sqlite3.IntegrityError:
+        raise ValueError(f"Lot numbers for batch '{batch_ref}' clash with another batch's lots.")
+
+def _add_lots(cur, batch_id, batch_ref, indexes, weight_kg=0):
+    cur.executemany(
+        "INSERT INTO lots (batch_id, lot_no, lot_index, weight_kg, status) VALUES (?, ?, ?, ?, ?)",
+        [(batch_id, f"{batch_ref}/{i}", i, weight_kg, "Ordered") for i in indexes]
+    )
+
 def create_lot(batch_id, lot_index, weight_kg=0):
     with get_connection() as conn:
         cur = conn.cursor()
@@ -571,6 +1241,7 @@ def create_lot(batch_id, lot_index, weight_kg=0):
         conn.commit()  # Commit each lot
         return cur.lastrowid
 
+@cached_query
 def get_lot_id_by_no(lot_no: str):
     if not lot_no or not lot_no.strip():
         return None
@@ -579,145 +1250,2175 @@ def get_lot_id_by_no(lot_no: str):
     return row["id"] if row else None
 
 def search_lots_prefix(prefix: str, limit: int = 20):
-    prefix = (prefix or "").strip()
-    like = _escape_like(prefix) + "%"
+    cond, params = _prefix_where("lot_no", prefix)
     with get_connection() as conn:
         rows = [r["lot_no"] for r in conn.execute(
-            r"SELECT lot_no FROM lots WHERE lot_no LIKE ? ESCAPE '\' ORDER BY lot_no LIMIT ?", (like, limit)
+            f"SELECT lot_no FROM lots WHERE {cond} ORDER BY lot_no COLLATE NOCASE LIMIT ?", (*params, limit)
         ).fetchall()]
     return rows
 
 # ----------------------------
-# Purchases / Dyeing Outputs
+# Global Search (FTS5)
 # ----------------------------
-def record_purchase(date, batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls,
-                    price_per_unit=0, delivered_to="", notes="", includes_rib_collar=0, firm_name=""):
-    if not is_delivered_to_valid(delivered_to):
-        raise ValueError(f"Delivered To '{delivered_to}' not found in Masters.")
-    with get_connection() as conn:
-        cur = conn.cursor()
+# One FTS5 row per purchase, lot, batch and dyeing output. The entity kind is
+# packed into the rowid (id * 8 + kind) so triggers can replace or delete a
+# single entry by primary key instead of scanning the index.
+SEARCH_KINDS = {1: "purchase", 2: "lot", 3: "batch", 4: "dyeing"}
+_fts_available = True
 
-        # Create batch (and its first lot) if they don't exist
-        if not batch_id or not get_batch_id_by_ref(batch_id):
-            fabricator_id = get_supplier_id_by_name(delivered_to, "knitting_unit")
-            if fabricator_id:
-                batch_id = f"BATCH_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                cur.execute("SELECT name FROM fabric_compositions LIMIT 1")
-                fabric_type_name = cur.fetchone()["name"] if cur.fetchone() else None
-                if not fabric_type_name:
-                    raise ValueError("No fabric type defined.")
-                cur.execute("""
-                    INSERT INTO batches (batch_ref, fabricator_id, fabric_type_name, expected_lots, composition)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (batch_id, fabricator_id, fabric_type_name, 1, ""))
-                bid = cur.lastrowid
-                conn.commit()  # Commit batch
-                lot_no = f"{batch_id}/1"
-                cur.execute(
-                    "INSERT INTO lots (batch_id, lot_no, lot_index, weight_kg, status) VALUES (?, ?, ?, ?, ?)",
-                    (bid, lot_no, 1, qty_kg, "Ordered")
-                )
-                conn.commit()  # Commit lot
+_SEARCH_SOURCES = {
+    "purchase": """
+        SELECT {p}.id * 8 + 1,
+               COALESCE({p}.batch_id, '') || ' ' || COALESCE({p}.lot_no, ''),
+               COALESCE({p}.supplier, '') || ' ' || COALESCE({p}.yarn_type, '') || ' ' ||
+               COALESCE({p}.delivered_to, '') || ' ' || COALESCE({p}.firm_name, ''),
+               COALESCE({p}.notes, '')
+    """,
+    "lot": """
+        SELECT {p}.id * 8 + 2, COALESCE({p}.lot_no, ''), COALESCE({p}.status, ''), ''
+    """,
+    "batch": """
+        SELECT {p}.id * 8 + 3, COALESCE({p}.batch_ref, ''),
+               COALESCE({p}.fabric_type_name, '') || ' ' || COALESCE({p}.firm_name, '') || ' ' ||
+               COALESCE((SELECT name FROM suppliers WHERE id = {p}.fabricator_id), ''),
+               COALESCE({p}.composition, '')
+    """,
+    "dyeing": """
+        SELECT {p}.id * 8 + 4,
+               COALESCE((SELECT lot_no FROM lots WHERE id = {p}.lot_id), ''),
+               COALESCE((SELECT name FROM suppliers WHERE id = {p}.dyeing_unit_id), ''),
+               COALESCE({p}.notes, '')
+    """,
+}
+_SEARCH_TABLES = {"purchase": "purchases", "lot": "lots", "batch": "batches", "dyeing": "dyeing_outputs"}
 
-        # Record purchase
+def _init_search_index(cur):
+    global _fts_available
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='search_index'")
+    existed = cur.fetchone() is not None
+    try:
         cur.execute("""
-            INSERT INTO purchases (date, batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls, price_per_unit, delivered_to, notes, includes_rib_collar, firm_name)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (ui_to_db_date(date), batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls, price_per_unit, delivered_to, notes, includes_rib_collar, firm_name))
-        purchase_id = cur.lastrowid
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                ref, names, notes,
+                tokenize = "unicode61 tokenchars '/-_.'",
+                prefix = '2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: global_search() falls back to prefix lookups
+        print(f"[DB] FTS5 unavailable, global search disabled: {e}", file=sys.stderr)
+        _fts_available = False
+        return
+    _fts_available = True
+    for kind, table in _SEARCH_TABLES.items():
+        code = {v: k for k, v in SEARCH_KINDS.items()}[kind]
+        select_new = _SEARCH_SOURCES[kind].format(p="NEW")
+        cur.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_search_{table}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO search_index (rowid, ref, names, notes) {select_new};
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_search_{table}_au AFTER UPDATE ON {table} BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code};
+                INSERT INTO search_index (rowid, ref, names, notes) {select_new};
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_search_{table}_ad AFTER DELETE ON {table} BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code};
+            END;
+        """)
+    # Dyeing rows carry their lot number, so a lot renamed with its batch
+    # re-indexes the lot's dyeing outputs too
+    dyeing_rows = _SEARCH_SOURCES["dyeing"].format(p="d") + " FROM dyeing_outputs d"
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='trg_search_lots_dyeing_au'")
+    stale = existed and cur.fetchone() is None
+    cur.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_search_lots_dyeing_au AFTER UPDATE OF lot_no ON lots
+            WHEN OLD.lot_no IS NOT NEW.lot_no BEGIN
+            DELETE FROM search_index WHERE rowid IN (SELECT id * 8 + 4 FROM dyeing_outputs WHERE lot_id = NEW.id);
+            INSERT INTO search_index (rowid, ref, names, notes) {dyeing_rows} WHERE d.lot_id = NEW.id;
+        END;
+    """)
+    if not existed:
+        _fill_search_index(cur)
+    elif stale:
+        # Lots renamed before the trigger existed left old numbers behind
+        cur.execute("DELETE FROM search_index WHERE rowid IN (SELECT id * 8 + 4 FROM dyeing_outputs)")
+        cur.execute(f"INSERT INTO search_index (rowid, ref, names, notes) {dyeing_rows}")
 
-        # Update stock
-        if delivered_to:
-            cur.execute("""
-                INSERT OR IGNORE INTO yarn_stock (fabricator, yarn_type, qty_kg)
-                VALUES (?, ?, ?)
-            """, (delivered_to, yarn_type, 0))
-            cur.execute("SELECT qty_kg FROM yarn_stock WHERE fabricator = ? AND yarn_type = ?", (delivered_to, yarn_type))
-            current_stock = cur.fetchone()["qty_kg"]
-            if current_stock + qty_kg < 0:
-                raise ValueError(f"Insufficient {yarn_type} stock ({current_stock} kg) at {delivered_to}")
-            cur.execute("""
-                UPDATE yarn_stock
-                SET qty_kg = qty_kg + ?
-                WHERE fabricator = ? AND yarn_type = ?
-            """, (qty_kg, delivered_to, yarn_type))
+def _fill_search_index(cur):
+    cur.execute("DELETE FROM search_index")
+    for kind, table in _SEARCH_TABLES.items():
+        cur.execute(
+            "INSERT INTO search_index (rowid, ref, names, notes) "
+            + _SEARCH_SOURCES[kind].format(p="t") + f" FROM {table} t"
+        )
 
-            # Apply Rib/Collar consumption if flagged
-            if includes_rib_collar:
-                cur.execute("SELECT fabric_type_name FROM batches WHERE batch_ref = ?", (batch_id,))
-                row = cur.fetchone()
-                if row:
-                    fabric_type_name = row["fabric_type_name"]
-                    cur.execute("""
-                        SELECT yt.name AS yarn_type, fc.component, fc.ratio
-                        FROM fabric_compositions fc
-                        JOIN yarn_types yt ON fc.yarn_type_id = yt.id
-                        WHERE fc.name = ? AND fc.component IN ('Rib', 'Collar')
-                    """, (fabric_type_name,))
-                    rib_collar_comps = cur.fetchall()
-                    if rib_collar_comps:
-                        for comp in rib_collar_comps:
-                            rib_collar_yarn = comp["yarn_type"]
-                            ratio = comp["ratio"]
-                            consumed_kg = qty_rolls * 0.5 * (ratio / 100)  # 0.5 kg per roll example
-                            cur.execute("""
-                                INSERT OR IGNORE INTO yarn_stock (fabricator, yarn_type, qty_kg)
-                                VALUES (?, ?, 0)
-                            """, (delivered_to, rib_collar_yarn))
-                            cur.execute("SELECT qty_kg FROM yarn_stock WHERE fabricator = ? AND yarn_type = ?", (delivered_to, rib_collar_yarn))
-                            current_rib_stock = cur.fetchone()["qty_kg"]
-                            if current_rib_stock - consumed_kg < 0:
-                                raise ValueError(f"Insufficient {rib_collar_yarn} stock ({current_rib_stock} kg) at {delivered_to}")
-                            cur.execute("""
-                                UPDATE yarn_stock
-                                SET qty_kg = qty_kg - ?
-                                WHERE fabricator = ? AND yarn_type = ?
-                            """, (consumed_kg, delivered_to, rib_collar_yarn))
+def rebuild_search_index():
+    """Repopulate the FTS index from the source tables."""
+    if not _fts_available:
+        return
+    with get_connection() as conn:
+        _fill_search_index(conn.cursor())
+        conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        conn.commit()
 
-        # Update lot weight and status
-        lot_id = get_lot_id_by_no(lot_no)
-        if lot_id:
-            cur.execute("UPDATE lots SET weight_kg=?, status='Ordered' WHERE id=?", (qty_kg, lot_id))
-        batch_id_int = get_batch_id_by_ref(batch_id)
-        if batch_id_int:
-            update_batch_status(batch_id_int, 'Ordered')
-            if lot_id:
-                update_lot_status(lot_id, 'Ordered')
-            if delivered_to and get_supplier_id_by_name(delivered_to, "knitting_unit"):
-                update_batch_status(batch_id_int, 'Knitted')
-                if lot_id:
-                    update_lot_status(lot_id, 'Knitted')
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    terms = []
+    for word in (text or "").split():
+        word = word.replace('"', '""')
+        terms.append(f'"{word}"*')
+    return " ".join(terms)
+
+def global_search(text: str, limit: int = 50):
+    """
+    Ranked search across purchases, lots, batches and dyeing outputs.
+    Returns dicts with kind, id, ref, names, notes; best matches first.
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+    if not _fts_available:
+        return (
+            [{"kind": "lot", "id": get_lot_id_by_no(n), "ref": n, "names": "", "notes": ""}
+             for n in search_lots_prefix(text, limit)]
+            + [{"kind": "batch", "id": get_batch_id_by_ref(r), "ref": r, "names": "", "notes": ""}
+               for r in search_batches_prefix(text, limit)]
+        )[:limit]
+    with get_connection() as conn:
+        rows = conn.execute("""
+            SELECT rowid, ref, names, notes
+            FROM search_index
+            WHERE search_index MATCH ?
+            ORDER BY bm25(search_index, 10.0, 4.0, 1.0)
+            LIMIT ?
+        """, (query, limit)).fetchall()
+    return [
+        {
+            "kind": SEARCH_KINDS.get(r["rowid"] % 8, "unknown"),
+            "id": r["rowid"] // 8,
+            "ref": r["ref"],
+            "names": r["names"],
+            "notes": r["notes"],
+        }
+        for r in rows
+    ]
 
+# ----------------------------
+# Monthly Rollups
+# ----------------------------
+# purchase_rollup and dyeing_rollup hold per-month totals maintained by
+# triggers in the same transaction as every write, so reports and dashboard
+# summaries read a few hundred rows instead of scanning full history. Key
+# columns are COALESCEd to '' because WITHOUT ROWID primary keys are NOT NULL.
+ROLLUP_KEYS = ("firm_name", "month", "supplier", "yarn_type", "delivered_to")
+
+# (rollup column, expression over the source row); {p} is NEW, OLD or the table
+_PURCHASE_ROLLUP_KEYS = [
+    ("firm_name", "COALESCE({p}.firm_name, '')"),
+    ("month", "substr(COALESCE({p}.date, ''), 1, 7)"),
+    ("supplier", "COALESCE({p}.supplier, '')"),
+    ("yarn_type", "COALESCE({p}.yarn_type, '')"),
+    ("delivered_to", "COALESCE({p}.delivered_to, '')"),
+]
+_PURCHASE_ROLLUP_AMOUNTS = [
+    ("entries", "1"),
+    ("qty_kg", "COALESCE({p}.qty_kg, 0)"),
+    ("qty_rolls", "COALESCE({p}.qty_rolls, 0)"),
+    ("value", "COALESCE({p}.qty_kg, 0) * COALESCE({p}.price_per_unit, 0)"),
+]
+_DYEING_ROLLUP_KEYS = [
+    ("month", "substr(COALESCE({p}.returned_date, ''), 1, 7)"),
+    ("dyeing_unit_id", "COALESCE({p}.dyeing_unit_id, 0)"),
+]
+_DYEING_ROLLUP_AMOUNTS = [
+    ("entries", "1"),
+    ("qty_kg", "COALESCE({p}.returned_qty_kg, 0)"),
+    ("qty_rolls", "COALESCE({p}.returned_qty_rolls, 0)"),
+]
+
+def _rollup_trigger_sql(table, rollup, keys, amounts, watched):
+    """AFTER INSERT/UPDATE/DELETE triggers that UPSERT signed deltas into a rollup."""
+    cols = ", ".join(c for c, _ in keys + amounts)
+    key_cols = ", ".join(c for c, _ in keys)
+    new_values = ", ".join(e.format(p="NEW") for _, e in keys + amounts)
+    match_old = " AND ".join(f"{c} = {e.format(p='OLD')}" for c, e in keys)
+    add = ", ".join(f"{c} = {c} + excluded.{c}" for c, _ in amounts)
+    sub = ", ".join(f"{c} = {c} - {e.format(p='OLD')}" for c, e in amounts)
+    insert_new = f"""
+            INSERT INTO {rollup} ({cols}) VALUES ({new_values})
+            ON CONFLICT ({key_cols}) DO UPDATE SET {add};"""
+    remove_old = f"""
+            UPDATE {rollup} SET {sub} WHERE {match_old};
+            DELETE FROM {rollup} WHERE entries <= 0 AND {match_old};"""
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{rollup}_ai AFTER INSERT ON {table} BEGIN{insert_new}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{rollup}_au AFTER UPDATE OF {watched} ON {table} BEGIN{remove_old}{insert_new}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{rollup}_ad AFTER DELETE ON {table} BEGIN{remove_old}
+        END;
+    """
+
+def _init_rollups(cur):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='purchase_rollup'")
+    existed = cur.fetchone() is not None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS purchase_rollup (
+        firm_name TEXT NOT NULL,
+        month TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        yarn_type TEXT NOT NULL,
+        delivered_to TEXT NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        qty_kg REAL NOT NULL DEFAULT 0,
+        qty_rolls INTEGER NOT NULL DEFAULT 0,
+        value REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (firm_name, month, supplier, yarn_type, delivered_to)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS dyeing_rollup (
+        month TEXT NOT NULL,
+        dyeing_unit_id INTEGER NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        qty_kg REAL NOT NULL DEFAULT 0,
+        qty_rolls INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, dyeing_unit_id)
+    ) WITHOUT ROWID
+    """)
+    # Month-first index for FY range scans across firms
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchase_rollup_month ON purchase_rollup(month)")
+    # Raw-row lookups for the partial months at the edges of a date range
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_date ON purchases(date)")
+    cur.executescript(_rollup_trigger_sql(
+        "purchases", "purchase_rollup", _PURCHASE_ROLLUP_KEYS, _PURCHASE_ROLLUP_AMOUNTS,
+        "date, firm_name, supplier, yarn_type, delivered_to, qty_kg, qty_rolls, price_per_unit",
+    ))
+    cur.executescript(_rollup_trigger_sql(
+        "dyeing_outputs", "dyeing_rollup", _DYEING_ROLLUP_KEYS, _DYEING_ROLLUP_AMOUNTS,
+        "returned_date, dyeing_unit_id, returned_qty_kg, returned_qty_rolls",
+    ))
+    if not existed:
+        _fill_rollups(cur)
+
+def _fill_rollup(cur, rollup, table, keys, amounts, after_month=None):
+    """Recompute a rollup; with after_month, only the months after it."""
+    cols = ", ".join(c for c, _ in keys + amounts)
+    key_exprs = ", ".join(e.format(p="t") for _, e in keys)
+    sums = ", ".join(f"SUM({e.format(p='t')})" for _, e in amounts)
+    if after_month:
+        month = dict(keys)["month"].format(p="t")
+        cur.execute(f"DELETE FROM {rollup} WHERE month > ?", (after_month,))
+        where, params = f"WHERE {month} > ?", (after_month,)
+    else:
+        cur.execute(f"DELETE FROM {rollup}")
+        where, params = "", ()
+    cur.execute(f"""
+        INSERT INTO {rollup} ({cols})
+        SELECT {key_exprs}, {sums} FROM {table} t {where}
+        GROUP BY {", ".join(str(i + 1) for i in range(len(keys)))}
+    """, params)
+
+def _fill_rollups(cur):
+    # Months of closed financial years also count archived rows; they are frozen
+    floor = _archive_floor(cur)
+    closed = floor[:7] if floor else None
+    _fill_rollup(cur, "purchase_rollup", "purchases", _PURCHASE_ROLLUP_KEYS, _PURCHASE_ROLLUP_AMOUNTS, closed)
+    _fill_rollup(cur, "dyeing_rollup", "dyeing_outputs", _DYEING_ROLLUP_KEYS, _DYEING_ROLLUP_AMOUNTS, closed)
+
+def rebuild_rollups():
+    """Recompute the rollup tables and status counters from the raw rows."""
+    with get_connection() as conn:
+        _fill_rollups(conn.cursor())
+        _fill_rollup(conn.cursor(), "roll_rollup", "rolls", _ROLL_ROLLUP_KEYS, _ROLL_ROLLUP_AMOUNTS)
+        _fill_status_counts(conn.cursor())
         conn.commit()
-    return purchase_id
 
-def edit_purchase(purchase_id, date, batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls,
-                  price_per_unit, delivered_to, notes="", includes_rib_collar=0, firm_name=""):
-    if not is_delivered_to_valid(delivered_to):
-        raise ValueError(f"Delivered To '{delivered_to}' not found in Masters.")
+def _next_month(month: str) -> str:
+    y, m = int(month[:4]), int(month[5:7])
+    return f"{y + m // 12:04d}-{m % 12 + 1:02d}"
+
+def _prev_month(month: str) -> str:
+    y, m = int(month[:4]), int(month[5:7])
+    return f"{y - (m == 1):04d}-{(m - 2) % 12 + 1:02d}"
+
+def _rollup_span(from_date=None, to_date=None):
+    """
+    Split a YYYY-MM-DD range into whole months answered by the rollup and
+    partial edge months that must be read from raw rows.
+    Returns (month_lo, month_hi, raw_ranges) with inclusive date bounds;
+    month_lo > month_hi means no whole month is covered.
+    """
+    month_lo, month_hi, raw = "0000-01", "9999-12", []
+    if from_date:
+        month_lo = from_date[:7] if from_date[8:10] == "01" else _next_month(from_date[:7])
+    if to_date:
+        end = datetime.strptime(to_date, "%Y-%m-%d")
+        month_hi = to_date[:7] if (end + timedelta(days=1)).day == 1 else _prev_month(to_date[:7])
+    if month_lo > month_hi:
+        return month_lo, month_hi, [(from_date or "0000-01-01", to_date or "9999-12-31")]
+    if from_date and from_date[:7] != month_lo:
+        raw.append((from_date, (datetime.strptime(month_lo + "-01", "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")))
+    if to_date and to_date[:7] != month_hi:
+        raw.append((_next_month(month_hi) + "-01", to_date))
+    return month_lo, month_hi, raw
+
+@cached_query
+def purchase_totals(from_date=None, to_date=None, firm_name=None, delivered_to=None, group_by=()):
+    """
+    Purchase totals (entries, qty_kg, qty_rolls, value) for a date range,
+    optionally grouped by any of ROLLUP_KEYS. Whole months come from
+    purchase_rollup; only the partial months at either edge touch raw rows.
+    Returns a list of dicts, one per group (a single dict when ungrouped).
+    """
+    group_by = [g for g in group_by if g in ROLLUP_KEYS]
+    filters, filter_params = "", ()
+    if firm_name is not None:
+        filters += " AND firm_name = ?"
+        filter_params += (firm_name,)
+    if delivered_to:
+        filters += " AND delivered_to = ?"
+        filter_params += (delivered_to,)
+
+    key_cols = ", ".join(c for c, _ in _PURCHASE_ROLLUP_KEYS)
+    amount_cols = ", ".join(c for c, _ in _PURCHASE_ROLLUP_AMOUNTS)
+    raw_cols = ", ".join(f"{e.format(p='p')} AS {c}" for c, e in _PURCHASE_ROLLUP_KEYS + _PURCHASE_ROLLUP_AMOUNTS)
+
+    parts, params = [], []
+    if from_date or to_date:
+        month_lo, month_hi, raw_ranges = _rollup_span(from_date, to_date)
+    else:
+        month_lo, month_hi, raw_ranges = None, None, []
+    if month_lo is None:
+        parts.append(f"SELECT {key_cols}, {amount_cols} FROM purchase_rollup")
+    elif month_lo <= month_hi:
+        parts.append(f"SELECT {key_cols}, {amount_cols} FROM purchase_rollup WHERE month BETWEEN ? AND ?")
+        params += [month_lo, month_hi]
+    for lo, hi in raw_ranges:
+        parts.append(f"SELECT {raw_cols} FROM purchases p WHERE p.date BETWEEN ? AND ?")
+        params += [lo, hi]
+
+    group = ", ".join(group_by)
+    sql = f"""
+        SELECT {group + ", " if group else ""}
+               COALESCE(SUM(entries), 0) AS entries, COALESCE(SUM(qty_kg), 0) AS qty_kg,
+               COALESCE(SUM(qty_rolls), 0) AS qty_rolls, COALESCE(SUM(value), 0) AS value
+        FROM ({" UNION ALL ".join(parts)})
+        WHERE 1 = 1{filters}
+    """
+    if group:
+        sql += f" GROUP BY {group} ORDER BY {group}"
     with get_connection() as conn:
-        cur = conn.cursor()
-        # Fetch original purchase data
-        cur.execute("SELECT qty_kg, qty_rolls, delivered_to, includes_rib_collar, yarn_type FROM purchases WHERE id=?", (purchase_id,))
-        original = cur.fetchone()
-        if not original:
-            raise ValueError(f"Purchase ID {purchase_id} not found.")
+        if raw_ranges:
+            # Closed months' rollups already count archived rows; raw edges need the archives
+            attach_archives(conn, raw_ranges[0][0], raw_ranges[-1][1])
+        rows = [dict(r) for r in conn.execute(sql, tuple(params) + filter_params).fetchall()]
+    return rows if group else rows[0]
 
-        # Adjust stock for original purchase
-        orig_kg = original["qty_kg"]
-        orig_rolls = original["qty_rolls"]
-        orig_delivered = original["delivered_to"]
-        orig_rib_collar = original["includes_rib_collar"]
-        orig_yarn = original["yarn_type"]
-        if orig_delivered:
-            cur.execute("""
-                UPDATE yarn_stock
-                SET qty_kg = qty_kg - ?
-                WHERE fabricator = ? AND yarn_type = ?
-            """, (orig_kg, orig_delivered, orig_yarn))
-            if orig_rib_collar:
-                cur.execute("SELECT fabric_type_name FROM batches WHERE batch_ref = ?", (batch_id,))
-                row = cur.fetchone()
+# ----------------------------
+# Batch Status Counters
+# ----------------------------
+# Lots and batches carry status_rank, the position of their status in
+# STATUSES, as a virtual generated column: the text stays the source of
+# truth and comparisons run on the integer. A NULL or unknown status ranks
+# as 'Ordered', matching how the dashboard shows it.
+#
+# batch_status_counts holds, per status rank, the number of batches and the
+# number of lots belonging to them. Triggers on batches and lots keep it
+# current, so the unfiltered dashboard overview reads one row per status.
+STATUSES = ["Ordered", "Knitted", "Dyed", "Received"]
+
+def _status_rank_sql(col):
+    return f"CASE {col}" + "".join(f" WHEN '{s}' THEN {i}" for i, s in enumerate(STATUSES) if i) + " ELSE 0 END"
+
+def _status_label_sql(col):
+    return f"CASE {col}" + "".join(f" WHEN {i} THEN '{s}'" for i, s in enumerate(STATUSES)) + " END"
+
+def _init_status_ranks(cur):
+    for table in ("lots", "batches"):
+        cur.execute(f"PRAGMA table_xinfo({table})")
+        if "status_rank" not in [row["name"] for row in cur.fetchall()]:
+            cur.execute(f"""ALTER TABLE {table} ADD COLUMN status_rank INTEGER
+                           GENERATED ALWAYS AS ({_status_rank_sql("status")}) VIRTUAL""")
+    # A batch's status is the MIN over its lots: one index seek
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_lots_batch_status ON lots(batch_id, status_rank)")
+
+def _init_status_counts(cur):
+    cur.execute("PRAGMA table_info(batch_status_counts)")
+    cols = [row["name"] for row in cur.fetchall()]
+    if "status" in cols:
+        # Counters used to be keyed by the status text
+        cur.execute("DROP TABLE batch_status_counts")
+        for event in ("batch_ai", "batch_ad", "batch_au", "lot_ai", "lot_ad", "lot_au"):
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_status_counts_{event}")
+    existed = "status_rank" in cols
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS batch_status_counts (
+        status_rank INTEGER PRIMARY KEY,
+        batches INTEGER NOT NULL DEFAULT 0,
+        lots INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_lots_batch ON lots(batch_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_batch_date ON purchases(batch_id, date)")
+    cur.executescript("""
+        CREATE TRIGGER IF NOT EXISTS trg_status_counts_batch_ai AFTER INSERT ON batches BEGIN
+            INSERT INTO batch_status_counts (status_rank, batches, lots)
+            VALUES (NEW.status_rank, 1, (SELECT COUNT(*) FROM lots WHERE batch_id = NEW.id))
+            ON CONFLICT (status_rank) DO UPDATE SET batches = batches + excluded.batches, lots = lots + excluded.lots;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_counts_batch_ad AFTER DELETE ON batches BEGIN
+            UPDATE batch_status_counts
+            SET batches = batches - 1, lots = lots - (SELECT COUNT(*) FROM lots WHERE batch_id = OLD.id)
+            WHERE status_rank = OLD.status_rank;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_counts_batch_au AFTER UPDATE OF status ON batches
+        WHEN OLD.status_rank IS NOT NEW.status_rank BEGIN
+            UPDATE batch_status_counts
+            SET batches = batches - 1, lots = lots - (SELECT COUNT(*) FROM lots WHERE batch_id = OLD.id)
+            WHERE status_rank = OLD.status_rank;
+            INSERT INTO batch_status_counts (status_rank, batches, lots)
+            VALUES (NEW.status_rank, 1, (SELECT COUNT(*) FROM lots WHERE batch_id = NEW.id))
+            ON CONFLICT (status_rank) DO UPDATE SET batches = batches + excluded.batches, lots = lots + excluded.lots;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_counts_lot_ai AFTER INSERT ON lots BEGIN
+            UPDATE batch_status_counts SET lots = lots + 1
+            WHERE status_rank = (SELECT status_rank FROM batches WHERE id = NEW.batch_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_counts_lot_ad AFTER DELETE ON lots BEGIN
+            UPDATE batch_status_counts SET lots = lots - 1
+            WHERE status_rank = (SELECT status_rank FROM batches WHERE id = OLD.batch_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_counts_lot_au AFTER UPDATE OF batch_id ON lots
+        WHEN OLD.batch_id IS NOT NEW.batch_id BEGIN
+            UPDATE batch_status_counts SET lots = lots - 1
+            WHERE status_rank = (SELECT status_rank FROM batches WHERE id = OLD.batch_id);
+            UPDATE batch_status_counts SET lots = lots + 1
+            WHERE status_rank = (SELECT status_rank FROM batches WHERE id = NEW.batch_id);
+        END;
+    """)
+    if not existed:
+        _fill_status_counts(cur)
+
+def _fill_status_counts(cur):
+    cur.execute("DELETE FROM batch_status_counts")
+    cur.execute("""
+        INSERT INTO batch_status_counts (status_rank, batches, lots)
+        SELECT b.status_rank, COUNT(*),
+               COALESCE(SUM((SELECT COUNT(*) FROM lots l WHERE l.batch_id = b.id)), 0)
+        FROM batches b
+        GROUP BY 1
+    """)
+
+@cached_query
+def batch_status_counts(from_date=None, to_date=None, delivered_to=None):
+    """
+    Return {status: (batch count, lot count)}. Without filters this reads the
+    maintained counters plus the batches of closed years (all Received when
+    archived); with a date range or delivered_to it counts batches that have
+    at least one matching purchase, probing purchases by index, with the
+    archives the range reaches attached like the reports do.
+    """
+    with get_connection() as conn:
+        if not (from_date or to_date or delivered_to):
+            rows = conn.execute("""
+                SELECT status_rank, SUM(batches) AS batches, SUM(lots) AS lots FROM (
+                    SELECT status_rank, batches, lots FROM batch_status_counts
+                    UNION ALL
+                    SELECT ?, batches, lots FROM fy_closings WHERE status = 'closed'
+                ) GROUP BY status_rank
+            """, (STATUSES.index("Received"),)).fetchall()
+        else:
+            attach_archives(conn, from_date, to_date)
+            cond, params = "p.batch_id = b.batch_ref", []
+            if from_date:
+                cond += " AND p.date >= ?"
+                params.append(from_date)
+            if to_date:
+                cond += " AND p.date <= ?"
+                params.append(to_date)
+            if delivered_to:
+                cond += " AND p.delivered_to = ?"
+                params.append(delivered_to)
+            rows = conn.execute(f"""
+                SELECT b.status_rank, COUNT(*) AS batches,
+                       COALESCE(SUM((SELECT COUNT(*) FROM lots l WHERE l.batch_id = b.id)), 0) AS lots
+                FROM batches b
+                WHERE EXISTS (SELECT 1 FROM purchases p WHERE {cond})
+                GROUP BY 1
+            """, params).fetchall()
+    return {STATUSES[r["status_rank"]]: (r["batches"], r["lots"]) for r in rows if r["batches"] or r["lots"]}
+
+@cached_query
+def dyeing_shortage_by_month(from_date=None, to_date=None, dyeing_unit=None):
+    """
+    Per month of a lot's last dyeing return: kg sent (lot weight) and kg
+    returned, as a list of dicts ordered by month. Lots without a recorded
+    weight are skipped since their shortage is unknown.
+    """
+    cond, params = "", []
+    if dyeing_unit:
+        cond = " WHERE d.dyeing_unit_id = (SELECT id FROM suppliers WHERE name = ? LIMIT 1)"
+        params.append(dyeing_unit)
+    outer, outer_params = "", []
+    if from_date:
+        outer += " AND last_date >= ?"
+        outer_params.append(from_date)
+    if to_date:
+        outer += " AND last_date <= ?"
+        outer_params.append(to_date)
+    with get_connection() as conn:
+        attach_archives(conn, from_date, to_date)
+        rows = conn.execute(f"""
+            SELECT substr(last_date, 1, 7) AS month, SUM(weight) AS sent_kg, SUM(returned) AS returned_kg
+            FROM (
+                SELECT COALESCE(l.weight_kg, 0) AS weight, SUM(COALESCE(d.returned_qty_kg, 0)) AS returned,
+                       MAX(d.returned_date) AS last_date
+                FROM dyeing_outputs d
+                JOIN lots l ON l.id = d.lot_id{cond}
+                GROUP BY l.id
+            )
+            WHERE weight > 0 AND last_date IS NOT NULL{outer}
+            GROUP BY 1
+            ORDER BY 1
+        """, params + outer_params).fetchall()
+    return [dict(r) for r in rows]
+
+# ----------------------------
+# Status History
+# ----------------------------
+# status_events is an append-only log of every lot and batch status change,
+# written by triggers so it lands in the same transaction as the change
+# itself. Batch rows have lot_id NULL. lead_time_report() turns the first
+# time each lot reached each status into per-stage durations.
+def _init_status_events(cur):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='status_events'")
+    existed = cur.fetchone() is not None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS status_events (
+        id INTEGER PRIMARY KEY,
+        ts TEXT NOT NULL,
+        lot_id INTEGER,
+        batch_id INTEGER,
+        from_status TEXT,
+        to_status TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_status_events_lot ON status_events(lot_id, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_status_events_batch ON status_events(batch_id, ts)")
+    # Covers the first-time-reached scan in lead_time_report
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_status_events_first ON status_events(lot_id, to_status, ts)")
+    if not existed:
+        # Statuses were not kept up to date before, so settle them first and
+        # date the history from the transactions rather than from today
+        _refresh_statuses(cur)
+        n = _backfill_status_events(cur)
+        print(f"[DB] Reconstructed {n} lot status event(s) from purchase and dyeing dates.")
+    cur.executescript("""
+        CREATE TRIGGER IF NOT EXISTS trg_status_events_lot_ai AFTER INSERT ON lots BEGIN
+            INSERT INTO status_events (ts, lot_id, batch_id, from_status, to_status)
+            VALUES (CURRENT_TIMESTAMP, NEW.id, NEW.batch_id, NULL, NEW.status);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_events_lot_au AFTER UPDATE OF status ON lots
+        WHEN OLD.status IS NOT NEW.status BEGIN
+            INSERT INTO status_events (ts, lot_id, batch_id, from_status, to_status)
+            VALUES (CURRENT_TIMESTAMP, NEW.id, NEW.batch_id, OLD.status, NEW.status);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_events_batch_ai AFTER INSERT ON batches BEGIN
+            INSERT INTO status_events (ts, lot_id, batch_id, from_status, to_status)
+            VALUES (CURRENT_TIMESTAMP, NULL, NEW.id, NULL, NEW.status);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_status_events_batch_au AFTER UPDATE OF status ON batches
+        WHEN OLD.status IS NOT NEW.status BEGIN
+            INSERT INTO status_events (ts, lot_id, batch_id, from_status, to_status)
+            VALUES (CURRENT_TIMESTAMP, NULL, NEW.id, OLD.status, NEW.status);
+        END;
+    """)
+
+def _backfill_status_events(cur):
+    """
+    Seed the log for existing lots: each status up to the current one is
+    dated by the transaction that first justified it (first purchase, first
+    purchase delivered to a knitting unit, first dyeing return, the return
+    that completed the lot).
+    """
+    cur.execute(f"""
+        INSERT INTO status_events (ts, lot_id, batch_id, from_status, to_status)
+        SELECT ts, lot_id, batch_id, LAG(status) OVER (PARTITION BY lot_id ORDER BY rank), status
+        FROM (
+            SELECT l.id AS lot_id, l.batch_id, x.status, x.rank,
+                   CASE x.rank
+                       WHEN 0 THEN COALESCE((SELECT MIN(p.date) FROM purchases p WHERE p.batch_id = b.batch_ref),
+                                            substr(l.created_at, 1, 10))
+                       WHEN 1 THEN (SELECT MIN(p.date) FROM purchases p
+                                    JOIN suppliers s ON s.name = p.delivered_to AND s.type = 'knitting_unit'
+                                    WHERE p.batch_id = b.batch_ref)
+                       WHEN 2 THEN (SELECT MIN(d.returned_date) FROM dyeing_outputs d
+                                    WHERE d.lot_id = l.id AND d.returned_qty_kg > 0)
+                       ELSE COALESCE((SELECT MIN(d.returned_date) FROM dyeing_outputs d
+                                      WHERE d.lot_id = l.id AND d.returned_qty_kg >= 0.9 * l.weight_kg),
+                                     (SELECT MAX(d.returned_date) FROM dyeing_outputs d WHERE d.lot_id = l.id))
+                   END AS ts
+            FROM lots l
+            LEFT JOIN batches b ON b.id = l.batch_id
+            JOIN ({" UNION ALL ".join(f"SELECT '{s}' AS status, {i} AS rank" for i, s in enumerate(STATUSES))}) x
+              ON x.rank <= l.status_rank
+        )
+        WHERE ts IS NOT NULL
+        ORDER BY lot_id, rank
+    """)
+    return cur.rowcount
+
+def status_history(lot_id=None, batch_id=None):
+    """Status events for a lot, or a batch's own events, oldest first."""
+    with get_connection() as conn:
+        if lot_id is not None:
+            rows = conn.execute("SELECT * FROM status_events WHERE lot_id = ? ORDER BY ts, id", (lot_id,)).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM status_events WHERE batch_id = ? AND lot_id IS NULL ORDER BY ts, id",
+                                (batch_id,)).fetchall()
+    return [dict(r) for r in rows]
+
+@cached_query
+def lead_time_report(from_date=None, to_date=None, firm=None):
+    """
+    Days lots spent between reaching one status and the next, grouped by
+    stage, unit and the month the stage ended. Ordered → Knitted is counted
+    against the knitting unit, later stages against the dyeing unit.
+    Returns dicts (stage, unit, month, lots, avg_days, p50_days, p90_days,
+    max_days) ordered by month, stage and unit.
+    """
+    cond, params = "", {"lo": from_date, "hi": to_date, "firm": firm}
+    if from_date:
+        cond += " AND s.next_ts >= :lo"
+    if to_date:
+        cond += " AND substr(s.next_ts, 1, 10) <= :hi"  # ts may carry a time of day
+    if firm is not None:
+        cond += " AND COALESCE(b.firm_name, '') = :firm"
+    with get_connection() as conn:
+        attach_archives(conn, from_date, to_date)
+        rows = conn.execute(f"""
+            WITH firsts AS (
+                SELECT lot_id, to_status AS status, {_status_rank_sql("to_status")} AS rank, MIN(ts) AS ts
+                FROM status_events
+                WHERE lot_id IS NOT NULL AND to_status IN ({", ".join(f"'{s}'" for s in STATUSES)})
+                GROUP BY lot_id, to_status
+            ), stages AS (
+                SELECT lot_id, status, rank, ts, LEAD(status) OVER w AS next_status, LEAD(ts) OVER w AS next_ts
+                FROM firsts
+                WINDOW w AS (PARTITION BY lot_id ORDER BY rank)
+            ), spans AS (
+                SELECT s.status || ' → ' || s.next_status AS stage, s.rank AS stage_rank,
+                       COALESCE(CASE WHEN s.status = 'Ordered' THEN kn.name
+                                     ELSE COALESCE(dy.name, bdy.name) END, '') AS unit,
+                       substr(s.next_ts, 1, 7) AS month,
+                       julianday(s.next_ts) - julianday(s.ts) AS days
+                FROM stages s
+                JOIN lots l ON l.id = s.lot_id
+                LEFT JOIN batches b ON b.id = l.batch_id
+                LEFT JOIN suppliers kn ON kn.id = b.fabricator_id
+                LEFT JOIN suppliers bdy ON bdy.id = b.dyeing_unit_id
+                LEFT JOIN suppliers dy ON dy.id = (SELECT d.dyeing_unit_id FROM dyeing_outputs d
+                                                   WHERE d.lot_id = s.lot_id ORDER BY d.id LIMIT 1)
+                WHERE s.next_ts IS NOT NULL AND s.next_ts >= s.ts{cond}
+            ), ranked AS (
+                SELECT *, ROW_NUMBER() OVER (g ORDER BY days) AS rn, COUNT(*) OVER g AS n
+                FROM spans
+                WINDOW g AS (PARTITION BY stage, unit, month)
+            )
+            SELECT stage, unit, month, COUNT(*) AS lots, AVG(days) AS avg_days,
+                   MIN(days) FILTER (WHERE rn >= 0.5 * n) AS p50_days,
+                   MIN(days) FILTER (WHERE rn >= 0.9 * n) AS p90_days,
+                   MAX(days) AS max_days
+            FROM ranked
+            GROUP BY stage, unit, month
+            ORDER BY month, MIN(stage_rank), unit
+        """, params).fetchall()
+    return [dict(r) for r in rows]
+
+# ----------------------------
+# Usage Statistics (Autocomplete Ranking)
+# ----------------------------
+# Scores decay exponentially with USAGE_HALF_LIFE_DAYS, so a name used often
+# last month outranks one used often two years ago. Rows are keyed by
+# (field, context, value); context is '' for global counts, or the supplier
+# name for supplier-conditioned yarn / delivered-to counts.
+_usage_cache = None  # {(field, context): {value: (score, last_used)}}
+_usage_lock = threading.Lock()
+
+def _usage_now():
+    return time.time() / 86400.0
+
+def _decayed(score, last_used, now):
+    if now <= last_used:
+        return score
+    return score * 0.5 ** ((now - last_used) / USAGE_HALF_LIFE_DAYS)
+
+def _usage_keys(supplier, yarn_type, delivered_to):
+    supplier = (supplier or "").strip()
+    yarn_type = (yarn_type or "").strip()
+    delivered_to = (delivered_to or "").strip()
+    keys = []
+    if supplier:
+        keys.append(("supplier", "", supplier))
+    if yarn_type:
+        keys.append(("yarn_type", "", yarn_type))
+        if supplier:
+            keys.append(("yarn_type", supplier, yarn_type))
+    if delivered_to:
+        keys.append(("delivered_to", "", delivered_to))
+        if supplier:
+            keys.append(("delivered_to", supplier, delivered_to))
+    return keys
+
+def _backfill_usage_stats(cur):
+    """Seed usage_stats from existing purchases, dated by purchase date."""
+    now = _usage_now()
+    stats = {}
+    cur.execute("SELECT date, supplier, yarn_type, delivered_to FROM purchases ORDER BY date")
+    for row in cur.fetchall():
+        try:
+            used = datetime.strptime(row["date"], "%Y-%m-%d").timestamp() / 86400.0
+        except (TypeError, ValueError):
+            used = now
+        for key in _usage_keys(row["supplier"], row["yarn_type"], row["delivered_to"]):
+            score, last_used = stats.get(key, (0.0, used))
+            stats[key] = (_decayed(score, last_used, used) + 1.0, used)
+    cur.executemany(
+        "INSERT OR REPLACE INTO usage_stats (field, context, value, score, last_used) VALUES (?, ?, ?, ?, ?)",
+        [(f, c, v, score, used) for (f, c, v), (score, used) in stats.items()]
+    )
+
+def _load_usage_cache():
+    global _usage_cache
+    if _usage_cache is None:
+        cache = {}
+        with get_connection() as conn:
+            for row in conn.execute("SELECT field, context, value, score, last_used FROM usage_stats"):
+                cache.setdefault((row["field"], row["context"]), {})[row["value"]] = (row["score"], row["last_used"])
+        _usage_cache = cache
+    return _usage_cache
+
+def _record_usage(cur, supplier, yarn_type, delivered_to):
+    """
+    Upsert usage counters on the caller's cursor (same transaction as the write).
+    Returns the new entries; pass them to _apply_usage() after commit.
+    """
+    now = _usage_now()
+    with _usage_lock:
+        cache = _load_usage_cache()
+        updates = []
+        for field, context, value in _usage_keys(supplier, yarn_type, delivered_to):
+            score, last_used = cache.get((field, context), {}).get(value, (0.0, now))
+            updates.append((field, context, value, _decayed(score, last_used, now) + 1.0, now))
+    cur.executemany(
+        "INSERT OR REPLACE INTO usage_stats (field, context, value, score, last_used) VALUES (?, ?, ?, ?, ?)",
+        updates
+    )
+    return updates
+
+def _apply_usage(updates):
+    with _usage_lock:
+        cache = _load_usage_cache()
+        for field, context, value, score, last_used in updates:
+            cache.setdefault((field, context), {})[value] = (score, last_used)
+
+def rank_suggestions(field: str, values, context: str = None):
+    """
+    Order values by recent usage for field ('supplier', 'yarn_type', 'delivered_to').
+    With a context (supplier name), values that supplier usually sends come first.
+    Unused values keep alphabetical order at the end. Served from memory.
+    """
+    now = _usage_now()
+    with _usage_lock:
+        cache = _load_usage_cache()
+        global_stats = cache.get((field, ""), {})
+        ctx_stats = cache.get((field, context.strip()), {}) if context and context.strip() else {}
+
+        def key(v):
+            ctx = ctx_stats.get(v)
+            glob = global_stats.get(v)
+            return (
+                -(_decayed(*ctx, now) if ctx else 0.0),
+                -(_decayed(*glob, now) if glob else 0.0),
+                v.casefold(),
+            )
+        return sorted(values, key=key)
+
+# ----------------------------
+# Rate Cards
+# ----------------------------
+UNIT_RATE_DEFAULTS = {"knitting_unit": "knitting", "dyeing_unit": "dyeing"}  # unit type -> COST_RATES key
+
+@cached_query
+def get_rate_cards():
+    """
+    Return {unit id: (name, type, rate_per_kg, is_custom)} for every knitting and
+    dyeing unit. Units without a rate card use the COST_RATES default for their type.
+    """
+    with get_connection() as conn:
+        rows = conn.execute("""
+            SELECT s.id, s.name, s.type, r.rate_per_kg
+            FROM suppliers s
+            LEFT JOIN rate_cards r ON r.unit_id = s.id
+            WHERE s.type IN ('knitting_unit', 'dyeing_unit')
+            ORDER BY s.type, s.name
+        """).fetchall()
+    return {
+        r["id"]: (r["name"], r["type"],
+                  r["rate_per_kg"] if r["rate_per_kg"] is not None else COST_RATES[UNIT_RATE_DEFAULTS[r["type"]]],
+                  r["rate_per_kg"] is not None)
+        for r in rows
+    }
+
+def set_rate_card(unit_name: str, rate_per_kg):
+    """Set a unit's processing rate per kg; None removes it (back to the default)."""
+    unit_id = get_supplier_id_by_name(unit_name)
+    if unit_id is None:
+        raise ValueError(f"Unit '{unit_name}' not found in Masters.")
+    with get_connection() as conn:
+        if rate_per_kg is None:
+            conn.execute("DELETE FROM rate_cards WHERE unit_id=?", (unit_id,))
+        else:
+            rate = float(rate_per_kg)
+            if rate < 0:
+                raise ValueError("Rate cannot be negative.")
+            conn.execute("""
+                INSERT INTO rate_cards (unit_id, rate_per_kg) VALUES (?, ?)
+                ON CONFLICT (unit_id) DO UPDATE SET rate_per_kg = excluded.rate_per_kg
+            """, (unit_id, rate))
+        conn.commit()
+
+# ----------------------------
+# FIFO Yarn Cost Layers
+# ----------------------------
+# Every purchase delivered to a fabricator pushes a cost layer (qty at its
+# price) for (fabricator, yarn_type). Rib/collar usage on a purchase and yarn
+# consumed by dyeing returns pop the oldest layers first, and each pop is
+# recorded in fifo_consumption with the purchase it drew from. Dyeing returns
+# consume at the batch's knitting unit, which is where the yarn was delivered.
+#
+# Triggers only mark a fabricator dirty from the earliest changed date; the
+# layers are replayed from that date on the next read (refresh_fifo), so an
+# edit or delete re-runs only the affected tail of one fabricator's history.
+# A '*' entry (composition or batch changes) replays everything.
+FIFO_EPSILON = 1e-6  # Kg below this counts as fully consumed
+
+# Every yarn stock movement, derived from the source tables. seq is 0 for
+# receipts and 1 for consumption; a negative purchase is a return to supplier.
+# Shared by the FIFO replay and stock reconciliation so both agree on what
+# moves stock.
+_SOURCE_MOVEMENTS = [
+    """
+    SELECT COALESCE(p.date, '') AS date, CASE WHEN p.qty_kg > 0 THEN 0 ELSE 1 END AS seq,
+           'purchase' AS source, p.id AS source_id, NULL AS lot_id, p.delivered_to AS fabricator,
+           p.yarn_type, ABS(p.qty_kg) AS qty_kg, COALESCE(p.price_per_unit, 0) AS unit_cost
+    FROM purchases p
+    WHERE p.delivered_to != '' AND p.yarn_type != '' AND p.qty_kg != 0 {purchase_filter}
+    """,
+    """
+    SELECT COALESCE(p.date, '') AS date, 1 AS seq, 'rib_collar' AS source, p.id AS source_id,
+           l.id AS lot_id, p.delivered_to AS fabricator, yt.name AS yarn_type,
+           p.qty_rolls * 0.5 * fc.ratio / 100 AS qty_kg, NULL AS unit_cost
+    FROM purchases p
+    JOIN batches b ON b.batch_ref = p.batch_id
+    JOIN fabric_compositions fc ON fc.name = b.fabric_type_name AND fc.component IN ('Rib', 'Collar')
+    JOIN yarn_types yt ON yt.id = fc.yarn_type_id
+    LEFT JOIN lots l ON l.lot_no = p.lot_no
+    WHERE p.includes_rib_collar AND p.delivered_to != '' AND p.qty_rolls > 0 {purchase_filter}
+    """,
+    """
+    SELECT COALESCE(d.returned_date, '') AS date, 1 AS seq, 'dyeing' AS source, d.id AS source_id,
+           d.lot_id AS lot_id, s.name AS fabricator, yt.name AS yarn_type,
+           d.returned_qty_kg * fc.ratio / 100 AS qty_kg, NULL AS unit_cost
+    FROM dyeing_outputs d
+    JOIN lots l ON l.id = d.lot_id
+    JOIN batches b ON b.id = l.batch_id
+    JOIN suppliers s ON s.id = b.fabricator_id
+    JOIN fabric_compositions fc ON fc.name = b.fabric_type_name AND fc.component IN ('Main Fabric', 'Rib', 'Collar')
+    JOIN yarn_types yt ON yt.id = fc.yarn_type_id
+    WHERE d.returned_qty_kg > 0 {dyeing_filter}
+    """,
+]
+# Net movements of archived financial years, carried forward as one row per
+# (fabricator, yarn_type) on the closing date. Aliased p so the purchase
+# filters apply unchanged; source_id is negated to keep it apart from purchases.
+_OPENING_MOVEMENT = """
+    SELECT p.date AS date, CASE WHEN p.qty_kg > 0 THEN 0 ELSE 1 END AS seq, 'opening' AS source,
+           -p.id AS source_id, NULL AS lot_id, p.delivered_to AS fabricator, p.yarn_type,
+           ABS(p.qty_kg) AS qty_kg, 0 AS unit_cost
+    FROM opening_stock p
+    WHERE p.qty_kg != 0 {purchase_filter}
+    """
+_STOCK_MOVEMENTS = _SOURCE_MOVEMENTS + [_OPENING_MOVEMENT]
+_STOCK_MOVEMENTS_SQL = "    UNION ALL".join(_STOCK_MOVEMENTS)
+# FIFO order: by date, receipts before consumption on the same day
+_FIFO_EVENTS_SQL = _STOCK_MOVEMENTS_SQL + "    ORDER BY date, seq, source_id\n"
+
+# Knitting unit holding the yarn for a dyeing output row ({p} is NEW or OLD)
+_FIFO_DYEING_FABRICATOR = """(SELECT s.name FROM lots l JOIN batches b ON b.id = l.batch_id
+    JOIN suppliers s ON s.id = b.fabricator_id WHERE l.id = {p}.lot_id)"""
+
+def _fifo_mark_sql(fabricator, date):
+    return f"""
+            INSERT INTO fifo_dirty (fabricator, since) SELECT {fabricator}, COALESCE({date}, '')
+            WHERE {fabricator} IS NOT NULL AND {fabricator} != ''
+            ON CONFLICT (fabricator) DO UPDATE SET since = MIN(since, excluded.since);"""
+
+def _init_fifo(cur):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='fifo_layers'")
+    existed = cur.fetchone() is not None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS fifo_layers (
+        purchase_id INTEGER PRIMARY KEY,
+        fabricator TEXT NOT NULL,
+        yarn_type TEXT NOT NULL,
+        date TEXT NOT NULL,
+        unit_cost REAL NOT NULL DEFAULT 0,
+        qty_kg REAL NOT NULL,
+        remaining_kg REAL NOT NULL
+    )
+    """)
+    # One row per (consumption, layer) pair; purchase_id NULL is kg no layer covered
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS fifo_consumption (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        lot_id INTEGER,
+        fabricator TEXT NOT NULL,
+        yarn_type TEXT NOT NULL,
+        date TEXT NOT NULL,
+        purchase_id INTEGER,
+        qty_kg REAL NOT NULL,
+        unit_cost REAL
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS fifo_dirty (
+        fabricator TEXT PRIMARY KEY,
+        since TEXT NOT NULL
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fifo_layers_fab_date ON fifo_layers(fabricator, date)")
+    cur.execute(f"""CREATE INDEX IF NOT EXISTS idx_fifo_layers_open ON fifo_layers(fabricator, yarn_type, date, purchase_id)
+                   WHERE remaining_kg > {FIFO_EPSILON}""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fifo_consumption_fab_date ON fifo_consumption(fabricator, date, purchase_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fifo_consumption_lot ON fifo_consumption(lot_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fifo_consumption_purchase ON fifo_consumption(purchase_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_batches_fabricator ON batches(fabricator_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_delivered_date ON purchases(delivered_to, date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dyeing_outputs_date ON dyeing_outputs(returned_date)")
+    dyeing_new = _FIFO_DYEING_FABRICATOR.format(p="NEW")
+    dyeing_old = _FIFO_DYEING_FABRICATOR.format(p="OLD")
+    mark_all = _fifo_mark_sql("'*'", "''")
+    cur.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_purchase_ai AFTER INSERT ON purchases BEGIN{_fifo_mark_sql("NEW.delivered_to", "NEW.date")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_purchase_au AFTER UPDATE OF date, batch_id, lot_no, yarn_type, qty_kg,
+            qty_rolls, price_per_unit, delivered_to, includes_rib_collar ON purchases BEGIN{_fifo_mark_sql("OLD.delivered_to", "OLD.date")}{_fifo_mark_sql("NEW.delivered_to", "NEW.date")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_purchase_ad AFTER DELETE ON purchases BEGIN{_fifo_mark_sql("OLD.delivered_to", "OLD.date")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_dyeing_ai AFTER INSERT ON dyeing_outputs BEGIN{_fifo_mark_sql(dyeing_new, "NEW.returned_date")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_dyeing_au AFTER UPDATE OF lot_id, returned_date, returned_qty_kg ON dyeing_outputs BEGIN{_fifo_mark_sql(dyeing_old, "OLD.returned_date")}{_fifo_mark_sql(dyeing_new, "NEW.returned_date")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_dyeing_ad AFTER DELETE ON dyeing_outputs BEGIN{_fifo_mark_sql(dyeing_old, "OLD.returned_date")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_batch_au AFTER UPDATE OF batch_ref, fabricator_id, fabric_type_name ON batches BEGIN{mark_all}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_lot_au AFTER UPDATE OF batch_id, lot_no ON lots BEGIN{mark_all}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_composition_ai AFTER INSERT ON fabric_compositions BEGIN{mark_all}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_composition_au AFTER UPDATE ON fabric_compositions BEGIN{mark_all}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_fifo_composition_ad AFTER DELETE ON fabric_compositions BEGIN{mark_all}
+        END;
+    """)
+    if not existed:
+        cur.execute(mark_all)  # First replay happens on the first read, not at startup
+
+class _LayerQueue:
+    """
+    FIFO of [purchase_id, remaining_kg, unit_cost] layers for one
+    (fabricator, yarn_type). Layers older than the replay stay in the
+    database and are fetched one at a time, only when consumption reaches them.
+    """
+    def __init__(self, stored=None):
+        self._stored = stored  # Cursor over older open layers, oldest first
+        self._next = None
+        self._layers = deque()
+        self.reloaded = []  # Older layers fetched (and so drawn on) during the replay
+
+    def append(self, layer):
+        self._layers.append(layer)
+
+    def front(self):
+        if self._next is None and self._stored is not None:
+            row = self._stored.fetchone()
+            if row is None:
+                self.close()
+            else:
+                self._next = list(row)
+                self.reloaded.append(self._next)
+        if self._next is not None:
+            return self._next
+        return self._layers[0] if self._layers else None
+
+    def popleft(self):
+        if self._next is not None:
+            self._next = None
+        else:
+            self._layers.popleft()
+
+    def close(self):
+        if self._stored is not None:
+            self._stored.close()
+            self._stored = None
+
+def _fifo_replay(cur, fabricator=None, since=""):
+    """
+    Replay one fabricator's stock movements from `since` onwards (all
+    fabricators and all history when fabricator is None). Layers and
+    consumption before `since` are kept and the later events are run against
+    the layers still open at that point.
+    """
+    layers = {}  # (fabricator, yarn_type) -> _LayerQueue
+    if fabricator is None:
+        cur.execute("DELETE FROM fifo_consumption")
+        cur.execute("DELETE FROM fifo_layers")
+        events = cur.execute(_FIFO_EVENTS_SQL.format(purchase_filter="", dyeing_filter="")).fetchall()
+    else:
+        # Plain comparisons keep the date indexes usable; only a replay from
+        # the start has to include undated rows
+        events = cur.execute(_FIFO_EVENTS_SQL.format(
+            purchase_filter="AND p.delivered_to = :fab" + (" AND p.date >= :since" if since else ""),
+            dyeing_filter="AND s.name = :fab" + (" AND d.returned_date >= :since" if since else ""),
+        ), {"fab": fabricator, "since": since}).fetchall()
+        cur.execute("""
+            SELECT DISTINCT purchase_id FROM fifo_consumption
+            WHERE fabricator = ? AND date >= ? AND purchase_id IS NOT NULL
+        """, (fabricator, since))
+        reopened = [r[0] for r in cur.fetchall()]
+        cur.execute("DELETE FROM fifo_consumption WHERE fabricator = ? AND date >= ?", (fabricator, since))
+        cur.execute("DELETE FROM fifo_layers WHERE fabricator = ? AND date >= ?", (fabricator, since))
+        # Layers drawn on after `since` get back what the deleted rows took
+        cur.executemany("""
+            UPDATE fifo_layers SET remaining_kg = qty_kg - COALESCE(
+                (SELECT SUM(qty_kg) FROM fifo_consumption c WHERE c.purchase_id = fifo_layers.purchase_id), 0)
+            WHERE purchase_id = ?
+        """, [(pid,) for pid in reopened])
+        # Older open layers are read lazily, and only for yarn types consumed
+        for yarn in {e["yarn_type"] for e in events if e["seq"]}:
+            layers[(fabricator, yarn)] = _LayerQueue(cur.connection.execute(f"""
+                SELECT purchase_id, remaining_kg, unit_cost FROM fifo_layers
+                WHERE fabricator = ? AND yarn_type = ? AND remaining_kg > {FIFO_EPSILON}
+                ORDER BY date, purchase_id
+            """, (fabricator, yarn)))
+
+    new_layers, consumed = [], []
+    for date, seq, source, source_id, lot_id, fab, yarn, qty, unit_cost in events:
+        queue = layers.get((fab, yarn))
+        if queue is None:
+            queue = layers[(fab, yarn)] = _LayerQueue()
+        if seq == 0:
+            layer = [source_id, qty, unit_cost]
+            queue.append(layer)
+            new_layers.append((source_id, fab, yarn, date, unit_cost, qty, layer))
+            continue
+        need = qty
+        while need > FIFO_EPSILON:
+            layer = queue.front()
+            if layer is None:
+                break
+            take = min(need, layer[1])
+            layer[1] -= take
+            need -= take
+            consumed.append((source, source_id, lot_id, fab, yarn, date, layer[0], take, layer[2]))
+            if layer[1] <= FIFO_EPSILON:
+                queue.popleft()
+        if need > FIFO_EPSILON:
+            consumed.append((source, source_id, lot_id, fab, yarn, date, None, need, None))
+    for queue in layers.values():
+        queue.close()
+
+    cur.executemany(
+        "INSERT INTO fifo_layers (purchase_id, fabricator, yarn_type, date, unit_cost, qty_kg, remaining_kg) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(pid, fab, yarn, date, cost, qty, max(layer[1], 0.0)) for pid, fab, yarn, date, cost, qty, layer in new_layers],
+    )
+    cur.executemany("UPDATE fifo_layers SET remaining_kg = ? WHERE purchase_id = ?",
+                    [(max(layer[1], 0.0), layer[0]) for queue in layers.values() for layer in queue.reloaded])
+    cur.executemany("""
+        INSERT INTO fifo_consumption (source, source_id, lot_id, fabricator, yarn_type, date, purchase_id, qty_kg, unit_cost)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, consumed)
+
+def _fifo_sync(cur):
+    """Replay whatever the triggers marked dirty. Returns True if anything ran."""
+    dirty = cur.execute("SELECT fabricator, since FROM fifo_dirty").fetchall()
+    if not dirty:
+        return False
+    floor = _archive_floor(cur)
+    if any(r["fabricator"] == "*" for r in dirty):
+        _fifo_replay_all(cur, floor)
+    else:
+        for r in dirty:
+            since = max(r["since"], _next_day(floor)) if floor else r["since"]
+            _fifo_replay(cur, r["fabricator"], since)
+    cur.execute("DELETE FROM fifo_dirty")
+    return True
+
+def _fifo_replay_all(cur, floor=None):
+    """
+    Replay every fabricator: from scratch, or once a financial year has been
+    archived, from the day after it closed. Layers up to the close stay as they
+    were, since the rows they came from are no longer in this database.
+    """
+    if not floor:
+        _fifo_replay(cur)
+        return
+    since = _next_day(floor)
+    filters = {"purchase_filter": "AND p.date >= :since", "dyeing_filter": "AND d.returned_date >= :since"}
+    fabricators = set()
+    for movement in _STOCK_MOVEMENTS:
+        cur.execute(f"SELECT DISTINCT fabricator FROM ({movement.format(**filters)})", {"since": since})
+        fabricators.update(r[0] for r in cur)
+    cur.execute("""
+        SELECT fabricator FROM fifo_layers WHERE date >= :since
+        UNION SELECT fabricator FROM fifo_consumption WHERE date >= :since
+    """, {"since": since})
+    fabricators.update(r[0] for r in cur)
+    for fabricator in sorted(f for f in fabricators if f):
+        _fifo_replay(cur, fabricator, since)
+
+def refresh_fifo():
+    """Bring the FIFO layers up to date with all writes so far."""
+    with get_connection() as conn:
+        if conn.execute("SELECT 1 FROM fifo_dirty LIMIT 1").fetchone():
+            _fifo_sync(conn.cursor())
+            conn.commit()
+
+def rebuild_fifo():
+    """Replay every fabricator's history (since the last closed year) into fresh layers."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _fifo_replay_all(cur, _archive_floor(cur))
+        cur.execute("DELETE FROM fifo_dirty")
+        conn.commit()
+
+def fifo_lot_consumption(lot_id=None, batch_ref=None):
+    """
+    Purchase layers consumed by one lot, or by every lot of a batch: a list
+    of dicts (source, source_id, date, yarn_type, fabricator, purchase_id,
+    supplier, purchase_date, qty_kg, unit_cost, cost). Rows with purchase_id
+    None are kg that no earlier purchase covered; their cost is None.
+    """
+    refresh_fifo()
+    if lot_id is not None:
+        where, params = "c.lot_id = ?", (lot_id,)
+    else:
+        where, params = "c.lot_id IN (SELECT l.id FROM lots l JOIN batches b ON b.id = l.batch_id WHERE b.batch_ref = ?)", (batch_ref,)
+    with get_connection() as conn:
+        attach_archives(conn)  # Layers may come from archived purchases
+        rows = conn.execute(f"""
+            SELECT c.source, c.source_id, c.date, c.yarn_type, c.fabricator, c.purchase_id, p.supplier,
+                   p.date AS purchase_date, c.qty_kg, c.unit_cost, c.qty_kg * c.unit_cost AS cost
+            FROM fifo_consumption c
+            LEFT JOIN purchases p ON p.id = c.purchase_id
+            WHERE {where}
+            ORDER BY c.date, c.id
+        """, params).fetchall()
+    return [dict(r) for r in rows]
+
+def fifo_stock_value(fabricator=None):
+    """Open layers per (fabricator, yarn_type): list of dicts with qty_kg, value and layers."""
+    refresh_fifo()
+    sql = f"""
+        SELECT fabricator, yarn_type, COUNT(*) AS layers, SUM(remaining_kg) AS qty_kg,
+               SUM(remaining_kg * unit_cost) AS value, MIN(date) AS oldest
+        FROM fifo_layers
+        WHERE remaining_kg > {FIFO_EPSILON}{" AND fabricator = ?" if fabricator else ""}
+        GROUP BY fabricator, yarn_type
+        ORDER BY fabricator, yarn_type
+    """
+    with get_connection() as conn:
+        rows = conn.execute(sql, (fabricator,) if fabricator else ()).fetchall()
+    return [dict(r) for r in rows]
+
+# ----------------------------
+# Stock Reconciliation
+# ----------------------------
+# yarn_stock is adjusted incrementally by the purchase and dyeing functions.
+# reconcile_yarn_stock() recomputes every (fabricator, yarn_type) balance from
+# the source tables in one aggregate pass over _STOCK_MOVEMENTS, then
+# reports, and optionally fixes, every balance that has drifted from it.
+STOCK_DRIFT_TOLERANCE = 0.001  # Kg
+
+def _init_yarn_stock(cur):
+    """Collapse duplicate yarn_stock rows and enforce one row per key."""
+    # Lets the purchase side of reconciliation run as a covering index scan
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_stock ON purchases(delivered_to, yarn_type, qty_kg)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchases_rib_collar ON purchases(delivered_to) WHERE includes_rib_collar")
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_yarn_stock_key'")
+    if cur.fetchone():
+        return
+    cur.execute("""
+        DELETE FROM yarn_stock WHERE id NOT IN (
+            SELECT MIN(id) FROM yarn_stock GROUP BY fabricator, yarn_type
+        )
+    """)
+    cur.execute("CREATE UNIQUE INDEX idx_yarn_stock_key ON yarn_stock(fabricator, yarn_type)")
+    # Duplicates were all adjusted together, so the surviving values are unreliable
+    drift = _reconcile_yarn_stock(cur, fix=True)
+    if drift:
+        print(f"[DB] Rebuilt {len(drift)} yarn stock balance(s) from purchases and dyeing outputs.")
+
+def _expected_yarn_stock(cur):
+    # Each kind of movement is aggregated on its own so SQLite can flatten it
+    # into an index scan instead of materialising the whole union
+    expected = {}
+    for movement in _STOCK_MOVEMENTS:
+        cur.execute(f"""
+            SELECT fabricator, yarn_type, SUM(CASE WHEN seq = 0 THEN qty_kg ELSE -qty_kg END)
+            FROM ({movement.format(purchase_filter="", dyeing_filter="")})
+            GROUP BY fabricator, yarn_type
+        """)
+        for fabricator, yarn_type, qty_kg in cur:
+            expected[(fabricator, yarn_type)] = expected.get((fabricator, yarn_type), 0.0) + qty_kg
+    return expected
+
+def _reconcile_yarn_stock(cur, fix=False):
+    expected = _expected_yarn_stock(cur)
+    cur.execute("""
+        SELECT fabricator, yarn_type, SUM(COALESCE(qty_kg, 0)) FROM yarn_stock
+        WHERE fabricator IS NOT NULL AND yarn_type IS NOT NULL
+        GROUP BY fabricator, yarn_type
+    """)
+    recorded = {(r[0], r[1]): r[2] for r in cur}
+    drift = []
+    for key in expected.keys() | recorded.keys():
+        want, have = expected.get(key, 0.0), recorded.get(key, 0.0)
+        if abs(have - want) > STOCK_DRIFT_TOLERANCE:
+            drift.append({"fabricator": key[0], "yarn_type": key[1],
+                          "recorded": have, "expected": want, "drift": have - want})
+    drift.sort(key=lambda d: (-abs(d["drift"]), d["fabricator"], d["yarn_type"]))
+    if fix and drift:
+        cur.executemany("""
+            INSERT INTO yarn_stock (fabricator, yarn_type, qty_kg) VALUES (?, ?, ?)
+            ON CONFLICT (fabricator, yarn_type) DO UPDATE SET qty_kg = excluded.qty_kg
+        """, [(d["fabricator"], d["yarn_type"], d["expected"]) for d in drift])
+    return drift
+
+def reconcile_yarn_stock(fix=False):
+    """
+    Compare yarn_stock with the balances implied by purchases, rib/collar
+    usage and dyeing outputs. Returns a list of dicts (fabricator, yarn_type,
+    recorded, expected, drift), largest drift first. With fix=True the
+    drifted balances are also reset to their expected values.
+    """
+    with get_connection() as conn:
+        drift = _reconcile_yarn_stock(conn.cursor(), fix)
+        if fix and drift:
+            conn.commit()
+    return drift
+
+# ----------------------------
+# As-of Snapshots
+# ----------------------------
+# At the end of every complete month the yarn stock balances and the running
+# totals of each open lot are written to checkpoint tables. stock_as_of() and
+# wip_as_of() start from the nearest checkpoint at or before the requested
+# date and add at most one month of movements, so a year-end figure costs the
+# same however much history is on file.
+#
+# Checkpoints are built forward from the latest one. Triggers drop every
+# checkpoint from the month of a changed row onwards (from a lot's first
+# movement for lot changes, all of them for batch or composition changes),
+# and the next take_checkpoints() rebuilds the tail.
+WIP_RECEIVED_RATIO = 0.9  # Same threshold record_dyeing_output uses for 'Received'
+
+_SNAPSHOT_TABLES = ("snapshot_checkpoints", "stock_checkpoints", "wip_checkpoints")
+
+# Checkpoints up to the last closed financial year are never dropped: the
+# rows behind them may have moved to an archive. One lower bound keeps the
+# delete a single range seek.
+_SNAPSHOT_OPEN_SQL = "(SELECT COALESCE(strftime('%Y-%m', MAX(end_date), '+1 day'), '') FROM fy_closings)"
+
+def _snapshot_drop_sql(month):
+    return "".join(f"""
+            DELETE FROM {table} WHERE month >= MAX({month}, {_SNAPSHOT_OPEN_SQL});""" for table in _SNAPSHOT_TABLES)
+
+def _init_snapshots(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS snapshot_checkpoints (
+        month TEXT PRIMARY KEY,
+        taken_at TEXT NOT NULL
+    ) WITHOUT ROWID
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_checkpoints (
+        month TEXT NOT NULL,
+        fabricator TEXT NOT NULL,
+        yarn_type TEXT NOT NULL,
+        qty_kg REAL NOT NULL,
+        PRIMARY KEY (month, fabricator, yarn_type)
+    ) WITHOUT ROWID
+    """)
+    # Only lots still open at the month end are stored
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS wip_checkpoints (
+        month TEXT NOT NULL,
+        lot_id INTEGER NOT NULL,
+        issued_kg REAL NOT NULL,
+        returned_kg REAL NOT NULL,
+        PRIMARY KEY (month, lot_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dyeing_outputs_lot ON dyeing_outputs(lot_id)")
+    cur.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='trg_snapshot_purchase_ai'")
+    row = cur.fetchone()
+    if row and "fy_closings" not in row[0]:
+        # Older triggers dropped checkpoints without regard to closed years
+        cur.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_snapshot_%'")
+        for (name,) in cur.fetchall():
+            cur.execute(f"DROP TRIGGER {name}")
+    cur.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='trg_snapshot_lot_au'")
+    row = cur.fetchone()
+    if row and "WHEN" not in row[0]:
+        # It used to drop every open checkpoint on any write, including the
+        # unchanged weight record_purchase stores on each purchase
+        cur.execute("DROP TRIGGER trg_snapshot_lot_au")
+    purchase_month = "substr(COALESCE({p}.date, ''), 1, 7)"
+    dyeing_month = "substr(COALESCE({p}.returned_date, ''), 1, 7)"
+    drop_all = _snapshot_drop_sql("''")
+    # A lot change can only move checkpoints from its first yarn issue or
+    # fabric return on; with neither, the month is NULL and nothing is dropped
+    lot_month = f"""(SELECT MIN(month) FROM (
+                SELECT MIN({purchase_month.format(p='p')}) AS month FROM purchases p WHERE p.lot_no IN (OLD.lot_no, NEW.lot_no)
+                UNION ALL
+                SELECT MIN({dyeing_month.format(p='d')}) FROM dyeing_outputs d WHERE d.lot_id = NEW.id))"""
+    cur.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_purchase_ai AFTER INSERT ON purchases BEGIN{_snapshot_drop_sql(purchase_month.format(p="NEW"))}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_purchase_au AFTER UPDATE OF date, batch_id, lot_no, yarn_type, qty_kg,
+            qty_rolls, delivered_to, includes_rib_collar ON purchases BEGIN{_snapshot_drop_sql(f"MIN({purchase_month.format(p='OLD')}, {purchase_month.format(p='NEW')})")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_purchase_ad AFTER DELETE ON purchases BEGIN{_snapshot_drop_sql(purchase_month.format(p="OLD"))}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_dyeing_ai AFTER INSERT ON dyeing_outputs BEGIN{_snapshot_drop_sql(dyeing_month.format(p="NEW"))}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_dyeing_au AFTER UPDATE OF lot_id, returned_date, returned_qty_kg ON dyeing_outputs BEGIN{_snapshot_drop_sql(f"MIN({dyeing_month.format(p='OLD')}, {dyeing_month.format(p='NEW')})")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_dyeing_ad AFTER DELETE ON dyeing_outputs BEGIN{_snapshot_drop_sql(dyeing_month.format(p="OLD"))}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_batch_au AFTER UPDATE OF batch_ref, fabricator_id, fabric_type_name ON batches BEGIN{drop_all}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_lot_au AFTER UPDATE OF batch_id, lot_no, weight_kg ON lots
+            WHEN OLD.weight_kg IS NOT NEW.weight_kg OR OLD.batch_id IS NOT NEW.batch_id OR OLD.lot_no IS NOT NEW.lot_no
+            BEGIN{_snapshot_drop_sql(lot_month)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_composition_ai AFTER INSERT ON fabric_compositions BEGIN{drop_all}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_composition_au AFTER UPDATE ON fabric_compositions BEGIN{drop_all}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_snapshot_composition_ad AFTER DELETE ON fabric_compositions BEGIN{drop_all}
+        END;
+    """)
+
+def _month_end(month: str) -> str:
+    return (datetime.strptime(_next_month(month) + "-01", "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+
+def _movement_filters(lo, fabricator=None):
+    """purchase/dyeing filters for movements dated lo..:hi (all history up to :hi when lo is None)."""
+    if lo:
+        purchase = "AND p.date >= :lo AND p.date <= :hi"
+        dyeing = "AND d.returned_date >= :lo AND d.returned_date <= :hi"
+    else:
+        purchase = "AND COALESCE(p.date, '') <= :hi"
+        dyeing = "AND COALESCE(d.returned_date, '') <= :hi"
+    if fabricator is not None:
+        purchase += " AND p.delivered_to = :fab"
+        dyeing += " AND s.name = :fab"
+    return {"purchase_filter": purchase, "dyeing_filter": dyeing}
+
+def _stock_movement_totals(cur, lo, hi, fabricator=None, by_month=False):
+    """Net kg per (fabricator, yarn_type), or per (month, fabricator, yarn_type) with by_month."""
+    group = "substr(date, 1, 7), fabricator, yarn_type" if by_month else "'', fabricator, yarn_type"
+    filters = _movement_filters(lo, fabricator)
+    totals = {}
+    for movement in _STOCK_MOVEMENTS:
+        cur.execute(f"""
+            SELECT {group}, SUM(CASE WHEN seq = 0 THEN qty_kg ELSE -qty_kg END)
+            FROM ({movement.format(**filters)})
+            GROUP BY 1, 2, 3
+        """, {"lo": lo, "hi": hi, "fab": fabricator})
+        for month, fab, yarn_type, qty_kg in cur:
+            key = (month, fab, yarn_type) if by_month else (fab, yarn_type)
+            totals[key] = totals.get(key, 0.0) + qty_kg
+    return totals
+
+def _lot_movement_totals(cur, lo, hi, by_month=False):
+    """Yarn issued to and fabric returned for each lot, as {key: [issued_kg, returned_kg]}."""
+    filters = _movement_filters(lo)
+    month = "substr(COALESCE({col}, ''), 1, 7)" if by_month else "''"
+    totals = {}
+    queries = [
+        (0, f"""SELECT {month.format(col="p.date")}, l.id, SUM(p.qty_kg) FROM purchases p
+                JOIN lots l ON l.lot_no = p.lot_no
+                WHERE p.qty_kg != 0 {filters["purchase_filter"]} GROUP BY 1, 2"""),
+        (1, f"""SELECT {month.format(col="d.returned_date")}, d.lot_id, SUM(d.returned_qty_kg) FROM dyeing_outputs d
+                WHERE d.lot_id IS NOT NULL {filters["dyeing_filter"]} GROUP BY 1, 2"""),
+    ]
+    for i, sql in queries:
+        cur.execute(sql, {"lo": lo, "hi": hi})
+        for m, lot_id, kg in cur:
+            key = (m, lot_id) if by_month else lot_id
+            totals.setdefault(key, [0.0, 0.0])[i] += kg or 0.0
+    return totals
+
+def _lot_totals_to(cur, lot_ids, hi):
+    """[issued_kg, returned_kg] for each of lot_ids from all movements up to hi."""
+    totals = {lot_id: [0.0, 0.0] for lot_id in lot_ids}
+    ids = list(totals)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        cur.execute(f"""
+            SELECT l.id, SUM(p.qty_kg) FROM lots l JOIN purchases p ON p.lot_no = l.lot_no
+            WHERE l.id IN ({marks}) AND COALESCE(p.date, '') <= ? GROUP BY l.id
+        """, chunk + [hi])
+        for lot_id, kg in cur.fetchall():
+            totals[lot_id][0] = kg or 0.0
+        cur.execute(f"""
+            SELECT lot_id, SUM(returned_qty_kg) FROM dyeing_outputs
+            WHERE lot_id IN ({marks}) AND COALESCE(returned_date, '') <= ? GROUP BY lot_id
+        """, chunk + [hi])
+        for lot_id, kg in cur.fetchall():
+            totals[lot_id][1] = kg or 0.0
+    return totals
+
+def _lot_weights(cur, lot_ids=None):
+    if lot_ids is None:
+        cur.execute("SELECT id, weight_kg FROM lots")
+        return {r[0]: r[1] for r in cur}
+    weights = {}
+    ids = list(lot_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cur.execute(f"SELECT id, weight_kg FROM lots WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        weights.update((r[0], r[1]) for r in cur)
+    return weights
+
+def _wip_status(issued_kg, returned_kg, weight_kg):
+    """Lot status implied by its totals, or None before any yarn or fabric has moved."""
+    target = weight_kg or issued_kg
+    if returned_kg > FIFO_EPSILON and target and returned_kg >= WIP_RECEIVED_RATIO * target:
+        return "Received"
+    if returned_kg > FIFO_EPSILON:
+        return "Dyed"
+    if issued_kg > FIFO_EPSILON:
+        return "Knitted"
+    return None
+
+def _last_complete_month():
+    return _prev_month(datetime.now().strftime("%Y-%m"))
+
+def _take_checkpoints(cur, through=None):
+    """Add checkpoints for every month after the latest one up to `through`. Returns the count."""
+    through = through or _last_complete_month()
+    last = cur.execute("SELECT MAX(month) FROM snapshot_checkpoints").fetchone()[0]
+    if last and last >= through:
+        return 0
+    lo = _next_month(last) + "-01" if last else None
+    hi = _month_end(through)
+    stock_moves = _stock_movement_totals(cur, lo, hi, by_month=True)
+    lot_moves = _lot_movement_totals(cur, lo, hi, by_month=True)
+    if last:
+        first = _next_month(last)
+    else:
+        months = {k[0] for k in stock_moves} | {k[0] for k in lot_moves}
+        months.discard("")
+        if not stock_moves and not lot_moves:
+            return 0
+        first = min(months | {through})
+
+    balances, lots = {}, {}
+    if last:
+        cur.execute("SELECT fabricator, yarn_type, qty_kg FROM stock_checkpoints WHERE month = ?", (last,))
+        balances = {(r[0], r[1]): r[2] for r in cur}
+        cur.execute("SELECT lot_id, issued_kg, returned_kg FROM wip_checkpoints WHERE month = ?", (last,))
+        lots = {r[0]: [r[1], r[2]] for r in cur}
+        # Lots closed at the last checkpoint but moving again need their totals so far
+        reopened = {k[1] for k in lot_moves} - lots.keys()
+        lots.update(_lot_totals_to(cur, reopened, _month_end(last)))
+        weights = _lot_weights(cur, lots)
+    else:
+        weights = _lot_weights(cur)
+
+    by_month_stock, by_month_lots = {}, {}
+    for (month, fab, yarn_type), kg in stock_moves.items():
+        by_month_stock.setdefault(month if month >= first else first, []).append((fab, yarn_type, kg))
+    for (month, lot_id), kg in lot_moves.items():
+        by_month_lots.setdefault(month if month >= first else first, []).append((lot_id, kg))
+
+    now = datetime.now().isoformat(timespec="seconds")
+    month, taken = first, 0
+    while month <= through:
+        for fab, yarn_type, kg in by_month_stock.get(month, ()):
+            balances[(fab, yarn_type)] = balances.get((fab, yarn_type), 0.0) + kg
+        for lot_id, (issued, returned) in by_month_lots.get(month, ()):
+            totals = lots.setdefault(lot_id, [0.0, 0.0])
+            totals[0] += issued
+            totals[1] += returned
+        cur.executemany("INSERT INTO stock_checkpoints (month, fabricator, yarn_type, qty_kg) VALUES (?, ?, ?, ?)",
+                        [(month, k[0], k[1], kg) for k, kg in balances.items() if abs(kg) > FIFO_EPSILON])
+        cur.executemany("INSERT INTO wip_checkpoints (month, lot_id, issued_kg, returned_kg) VALUES (?, ?, ?, ?)",
+                        [(month, lot_id, t[0], t[1]) for lot_id, t in lots.items()
+                         if _wip_status(t[0], t[1], weights.get(lot_id)) not in (None, "Received")])
+        cur.execute("INSERT INTO snapshot_checkpoints (month, taken_at) VALUES (?, ?)", (month, now))
+        month, taken = _next_month(month), taken + 1
+    return taken
+
+def take_checkpoints(through=None):
+    """Checkpoint stock and WIP for every complete month not yet covered. Returns the number added."""
+    with get_connection() as conn:
+        taken = _take_checkpoints(conn.cursor(), through)
+        if taken:
+            conn.commit()
+    return taken
+
+def _checkpoint_before(cur, date):
+    """Latest checkpoint month whose month end is on or before `date`, or None."""
+    month = date[:7]
+    if _month_end(month) != date:
+        month = _prev_month(month)
+    cur.execute("SELECT MAX(month) FROM snapshot_checkpoints WHERE month <= ?", (month,))
+    return cur.fetchone()[0]
+
+def stock_as_of(date, fabricator=None):
+    """
+    Yarn stock per (fabricator, yarn_type) at the end of `date` (YYYY-MM-DD),
+    as a list of dicts (fabricator, yarn_type, qty_kg) with nonzero balances.
+    """
+    with get_connection() as conn:
+        attach_archives(conn, _prev_month(date[:7]) + "-01", date)
+        cur = conn.cursor()
+        if _take_checkpoints(cur):
+            conn.commit()
+        base = _checkpoint_before(cur, date)
+        balances = {}
+        if base:
+            sql = "SELECT fabricator, yarn_type, qty_kg FROM stock_checkpoints WHERE month = ?"
+            params = [base]
+            if fabricator is not None:
+                sql += " AND fabricator = ?"
+                params.append(fabricator)
+            balances = {(r[0], r[1]): r[2] for r in cur.execute(sql, params)}
+        lo = _next_month(base) + "-01" if base else None
+        for key, kg in _stock_movement_totals(cur, lo, date, fabricator).items():
+            balances[key] = balances.get(key, 0.0) + kg
+    return [{"fabricator": k[0], "yarn_type": k[1], "qty_kg": kg}
+            for k, kg in sorted(balances.items()) if abs(kg) > FIFO_EPSILON]
+
+def wip_as_of(date, firm=None):
+    """
+    Lots in progress (Knitted or Dyed) at the end of `date`, as dicts with
+    lot_id, lot_no, batch_ref, firm, fabricator, issued_kg, returned_kg and status.
+    """
+    with get_connection() as conn:
+        attach_archives(conn, _prev_month(date[:7]) + "-01", date)
+        cur = conn.cursor()
+        if _take_checkpoints(cur):
+            conn.commit()
+        base = _checkpoint_before(cur, date)
+        lots = {}
+        if base:
+            cur.execute("SELECT lot_id, issued_kg, returned_kg FROM wip_checkpoints WHERE month = ?", (base,))
+            lots = {r[0]: [r[1], r[2]] for r in cur}
+        lo = _next_month(base) + "-01" if base else None
+        moves = _lot_movement_totals(cur, lo, date)
+        if base:
+            lots.update(_lot_totals_to(cur, moves.keys() - lots.keys(), _month_end(base)))
+        for lot_id, (issued, returned) in moves.items():
+            totals = lots.setdefault(lot_id, [0.0, 0.0])
+            totals[0] += issued
+            totals[1] += returned
+        result = []
+        ids = list(lots)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cur.execute(f"""
+                SELECT l.id, l.lot_no, l.weight_kg, COALESCE(b.batch_ref, '') AS batch_ref,
+                       COALESCE(b.firm_name, '') AS firm, COALESCE(s.name, '') AS fabricator
+                FROM lots l
+                LEFT JOIN batches b ON b.id = l.batch_id
+                LEFT JOIN suppliers s ON s.id = b.fabricator_id
+                WHERE l.id IN ({','.join('?' * len(chunk))})
+            """, chunk)
+            for r in cur.fetchall():
+                if firm is not None and r["firm"] != firm:
+                    continue
+                issued, returned = lots[r["id"]]
+                status = _wip_status(issued, returned, r["weight_kg"])
+                if status in (None, "Received"):
+                    continue
+                result.append({"lot_id": r["id"], "lot_no": r["lot_no"], "batch_ref": r["batch_ref"],
+                               "firm": r["firm"], "fabricator": r["fabricator"],
+                               "issued_kg": issued, "returned_kg": returned, "status": status})
+    result.sort(key=lambda r: (r["batch_ref"], r["lot_no"] or ""))
+    return result
+
+# ----------------------------
+# Lot Genealogy
+# ----------------------------
+# trace() walks the purchase -> batch -> lot -> dyeing output graph with one
+# recursive CTE. Backward steps go from outputs to the yarn that fed them:
+# purchases booked against a lot or its batch, and purchases whose FIFO
+# layers the lot's yarn was drawn from. Forward steps go the other way.
+# Every step is an index probe from the row just reached, so the cost
+# follows the size of the trace, not of the tables.
+TRACE_DIRECTIONS = ("backward", "forward", "both")
+TRACE_MAX_DEPTH = 6  # The graph is at most four steps deep; a guard, not a limit
+
+# (direction, recursive SELECT). Each yields kind, id, via, parent_kind,
+# parent_id, child_kind, child_id for the rows one step from t, and ends in a
+# WHERE clause so the direction and depth guard can be appended.
+_TRACE_STEPS = [
+    ("backward", """
+        SELECT 'purchase', p.id, 'issued', 'purchase', p.id, 'lot', t.id, t.dir, t.depth + 1
+        FROM trace t JOIN lots l ON l.id = t.id JOIN purchases p ON p.lot_no = l.lot_no
+        WHERE t.kind = 'lot'"""),
+    ("backward", """
+        SELECT 'purchase', c.purchase_id, 'fifo', 'purchase', c.purchase_id, 'lot', t.id, t.dir, t.depth + 1
+        FROM trace t JOIN fifo_consumption c ON c.lot_id = t.id
+        WHERE t.kind = 'lot' AND c.purchase_id IS NOT NULL"""),
+    ("backward", """
+        SELECT 'batch', l.batch_id, 'batch', 'batch', l.batch_id, 'lot', t.id, t.dir, t.depth + 1
+        FROM trace t JOIN lots l ON l.id = t.id
+        WHERE t.kind = 'lot' AND l.batch_id IS NOT NULL"""),
+    ("backward", """
+        SELECT 'purchase', p.id, 'issued', 'purchase', p.id, 'batch', t.id, t.dir, t.depth + 1
+        FROM trace t JOIN batches b ON b.id = t.id JOIN purchases p ON p.batch_id = b.batch_ref
+        WHERE t.kind = 'batch' AND COALESCE(p.lot_no, '') = ''"""),
+    ("backward", """
+        SELECT 'lot', d.lot_id, 'dyed', 'lot', d.lot_id, 'dyeing', t.id, t.dir, t.depth + 1
+        FROM trace t JOIN dyeing_outputs d ON d.id = t.id
+        WHERE t.kind = 'dyeing' AND d.lot_id IS NOT NULL"""),
+    ("forward", """
+        SELECT 'lot', l.id, 'issued', 'purchase', t.id, 'lot', l.id, t.dir, t.depth + 1
+        FROM trace t JOIN purchases p ON p.id = t.id JOIN lots l ON l.lot_no = p.lot_no
+        WHERE t.kind = 'purchase'"""),
+    ("forward", """
+        SELECT 'batch', b.id, 'issued', 'purchase', t.id, 'batch', b.id, t.dir, t.depth + 1
+        FROM trace t JOIN purchases p ON p.id = t.id JOIN batches b ON b.batch_ref = p.batch_id
+        WHERE t.kind = 'purchase' AND COALESCE(p.lot_no, '') = ''"""),
+    ("forward", """
+        SELECT 'lot', c.lot_id, 'fifo', 'purchase', t.id, 'lot', c.lot_id, t.dir, t.depth + 1
+        FROM trace t JOIN fifo_consumption c ON c.purchase_id = t.id
+        WHERE t.kind = 'purchase' AND c.lot_id IS NOT NULL"""),
+    ("forward", """
+        SELECT 'lot', l.id, 'batch', 'batch', t.id, 'lot', l.id, t.dir, t.depth + 1
+        FROM trace t JOIN lots l ON l.batch_id = t.id
+        WHERE t.kind = 'batch'"""),
+    ("forward", """
+        SELECT 'dyeing', d.id, 'dyed', 'lot', t.id, 'dyeing', d.id, t.dir, t.depth + 1
+        FROM trace t JOIN dyeing_outputs d ON d.lot_id = t.id
+        WHERE t.kind = 'lot'"""),
+]
+
+def _trace_sql(directions):
+    steps = "".join(f"""
+        UNION{sql} AND t.dir = '{direction}' AND t.depth < {TRACE_MAX_DEPTH}"""
+                    for direction, sql in _TRACE_STEPS if direction in directions)
+    return f"""
+        WITH RECURSIVE trace(kind, id, via, parent_kind, parent_id, child_kind, child_id, dir, depth) AS (
+            SELECT json_extract(s.value, '$[0]'), json_extract(s.value, '$[1]'),
+                   NULL, NULL, NULL, NULL, NULL, d.value, 0
+            FROM json_each(:seeds) s, json_each(:dirs) d{steps}
+        )
+        SELECT * FROM trace
+    """
+
+def _trace_details(cur, kind, ids):
+    """Display fields for the traced rows of one kind, keyed by id."""
+    queries = {
+        "purchase": """
+            SELECT id, date, supplier, yarn_type, qty_kg, qty_rolls, price_per_unit,
+                   delivered_to, batch_id AS batch_ref, lot_no, firm_name
+            FROM purchases WHERE id IN (SELECT value FROM json_each(?))""",
+        "batch": """
+            SELECT b.id, b.batch_ref, b.fabric_type_name, b.status, b.firm_name,
+                   COALESCE(k.name, '') AS knitter, COALESCE(u.name, '') AS dyeing_unit
+            FROM batches b
+            LEFT JOIN suppliers k ON k.id = b.fabricator_id
+            LEFT JOIN suppliers u ON u.id = b.dyeing_unit_id
+            WHERE b.id IN (SELECT value FROM json_each(?))""",
+        "lot": """
+            SELECT l.id, l.lot_no, l.lot_index, l.weight_kg, l.status, l.batch_id,
+                   COALESCE(b.batch_ref, '') AS batch_ref,
+                   (SELECT COALESCE(SUM(p.qty_kg), 0) FROM purchases p WHERE p.lot_no = l.lot_no) AS issued_kg,
+                   (SELECT COALESCE(SUM(d.returned_qty_kg), 0) FROM dyeing_outputs d WHERE d.lot_id = l.id) AS returned_kg
+            FROM lots l LEFT JOIN batches b ON b.id = l.batch_id
+            WHERE l.id IN (SELECT value FROM json_each(?))""",
+        "dyeing": """
+            SELECT d.id, d.lot_id, d.returned_date, d.returned_qty_kg, COALESCE(s.name, '') AS dyeing_unit
+            FROM dyeing_outputs d LEFT JOIN suppliers s ON s.id = d.dyeing_unit_id
+            WHERE d.id IN (SELECT value FROM json_each(?))""",
+    }
+    cur.execute(queries[kind], (json.dumps(sorted(ids)),))
+    details = {r["id"]: dict(r) for r in cur.fetchall()}
+    if kind == "lot":
+        for lot in details.values():
+            # Shortage against the lot weight when recorded, else the yarn issued
+            sent = lot["weight_kg"] or lot["issued_kg"]
+            lot["sent_kg"] = sent
+            lot["shortage_kg"] = sent - lot["returned_kg"] if lot["returned_kg"] else None
+            lot["shortage_pct"] = lot["shortage_kg"] / sent * 100 if sent and lot["shortage_kg"] is not None else None
+    return details
+
+def trace(lot_nos=(), batch_refs=(), purchase_ids=(), dyeing_ids=(), direction="both"):
+    """
+    Genealogy of the given lots, batches (all of their lots), purchases or
+    dyeing outputs. direction is 'backward' (towards the yarn purchases),
+    'forward' (towards dyeing returns) or 'both'. Returns a dict with
+    "nodes" {(kind, id): details} (kind is purchase, batch, lot or dyeing;
+    each node also has depth, the fewest steps from a starting row),
+    "edges" [(parent, child, via)] oriented from purchase towards output,
+    via being 'issued', 'fifo', 'batch' or 'dyed', "fifo" {(purchase_id,
+    lot_id): (kg, cost)} for the yarn drawn by FIFO, and "missing", the
+    references that matched nothing.
+    """
+    if direction not in TRACE_DIRECTIONS:
+        raise ValueError(f"Invalid trace direction: {direction}")
+    directions = ("backward", "forward") if direction == "both" else (direction,)
+    refresh_fifo()
+    with get_connection() as conn:
+        attach_archives(conn)  # Archived lots and the purchases FIFO still draws on
+        cur = conn.cursor()
+        seeds, missing = [], []
+        for lot_no in lot_nos:
+            row = cur.execute("SELECT id FROM lots WHERE lot_no=?", (lot_no,)).fetchone()
+            if row:
+                seeds.append(("lot", row["id"]))
+            else:
+                missing.append(lot_no)
+        for batch_ref in batch_refs:
+            row = cur.execute("SELECT id FROM batches WHERE batch_ref=?", (batch_ref,)).fetchone()
+            if not row:
+                missing.append(batch_ref)
+                continue
+            seeds.append(("batch", row["id"]))
+            seeds.extend(("lot", r["id"]) for r in cur.execute("SELECT id FROM lots WHERE batch_id=?", (row["id"],)).fetchall())
+        seeds.extend(("purchase", int(i)) for i in purchase_ids)
+        seeds.extend(("dyeing", int(i)) for i in dyeing_ids)
+
+        depth, edges = {}, set()
+        if seeds:
+            cur.execute(_trace_sql(directions), {"seeds": json.dumps(seeds), "dirs": json.dumps(directions)})
+            for r in cur.fetchall():
+                node = (r["kind"], r["id"])
+                depth[node] = min(depth.get(node, r["depth"]), r["depth"])
+                if r["via"]:
+                    edges.add(((r["parent_kind"], r["parent_id"]), (r["child_kind"], r["child_id"]), r["via"]))
+
+        nodes = {}
+        for kind in ("purchase", "batch", "lot", "dyeing"):
+            ids = [i for k, i in depth if k == kind]
+            if ids:
+                for i, details in _trace_details(cur, kind, ids).items():
+                    nodes[(kind, i)] = dict(details, depth=depth[(kind, i)])
+        missing += [f"{k} {i}" for k, i in depth if (k, i) not in nodes and depth[(k, i)] == 0]
+
+        fifo = {}
+        lot_ids = [i for k, i in nodes if k == "lot"]
+        if lot_ids:
+            cur.execute("""
+                SELECT purchase_id, lot_id, SUM(qty_kg) AS kg, SUM(qty_kg * unit_cost) AS cost
+                FROM fifo_consumption
+                WHERE lot_id IN (SELECT value FROM json_each(?)) AND purchase_id IS NOT NULL
+                GROUP BY purchase_id, lot_id
+            """, (json.dumps(lot_ids),))
+            fifo = {(r["purchase_id"], r["lot_id"]): (r["kg"], r["cost"]) for r in cur.fetchall()}
+    return {"nodes": nodes, "edges": sorted(e for e in edges if e[0] in nodes and e[1] in nodes),
+            "fifo": fifo, "missing": missing}
+
+# ----------------------------
+# Finished Rolls
+# ----------------------------
+# Every dyeing return with a roll count gets one rolls row per roll, written
+# in a single INSERT. A roll code is ROLL_CODE_PREFIX plus the row id, so a
+# scanned code resolves through the primary key with no extra index, and
+# AUTOINCREMENT keeps printed codes from ever being reused. state is stored
+# as its index in ROLL_STATES to keep rows small. roll_rollup holds roll
+# counts and weights per (lot, state, location) and is kept in sync by
+# triggers, so summaries read one row per group however many rolls exist.
+ROLL_STATES = ["In Stock", "Reserved", "Dispatched", "Rejected"]
+ROLL_CODE_PREFIX = "R"
+_MAX_ROWID = 2 ** 63 - 1
+ROLL_SUMMARY_KEYS = ("firm", "batch_ref", "lot_no", "state", "location")
+
+_ROLL_ROLLUP_KEYS = [
+    ("lot_id", "{p}.lot_id"),
+    ("state", "{p}.state"),
+    ("location", "COALESCE({p}.location, '')"),
+]
+_ROLL_ROLLUP_AMOUNTS = [
+    ("entries", "1"),
+    ("weight_kg", "COALESCE({p}.weight_kg, 0)"),
+]
+
+def _roll_state_label_sql(col):
+    return f"CASE {col}" + "".join(f" WHEN {i} THEN '{s}'" for i, s in enumerate(ROLL_STATES)) + " END"
+
+def _init_rolls(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rolls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dyeing_output_id INTEGER NOT NULL,
+        lot_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        weight_kg REAL,
+        state INTEGER NOT NULL DEFAULT 0,
+        location TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rolls_lot ON rolls(lot_id, state)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rolls_output ON rolls(dyeing_output_id)")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS roll_rollup (
+        lot_id INTEGER NOT NULL,
+        state INTEGER NOT NULL,
+        location TEXT NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        weight_kg REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (lot_id, state, location)
+    ) WITHOUT ROWID
+    """)
+    cur.executescript(_rollup_trigger_sql(
+        "rolls", "roll_rollup", _ROLL_ROLLUP_KEYS, _ROLL_ROLLUP_AMOUNTS, "lot_id, state, location, weight_kg",
+    ))
+    # Rolls follow their dyeing return when it is moved to another lot or deleted
+    cur.executescript("""
+        CREATE TRIGGER IF NOT EXISTS trg_rolls_dyeing_au AFTER UPDATE OF lot_id ON dyeing_outputs BEGIN
+            UPDATE rolls SET lot_id = NEW.lot_id WHERE dyeing_output_id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rolls_dyeing_ad AFTER DELETE ON dyeing_outputs BEGIN
+            DELETE FROM rolls WHERE dyeing_output_id = OLD.id;
+        END;
+    """)
+
+def roll_code(roll_id):
+    return f"{ROLL_CODE_PREFIX}{roll_id:08d}"
+
+def _roll_id(code):
+    """Row id from a roll code (the prefix is optional), or None."""
+    code = str(code).strip().upper()
+    if code.startswith(ROLL_CODE_PREFIX):
+        code = code[len(ROLL_CODE_PREFIX):]
+    # Scanned or typed codes can be anything; only an id SQLite can bind is one
+    if not (code.isascii() and code.isdigit()):
+        return None
+    roll_id = int(code)
+    return roll_id if roll_id <= _MAX_ROWID else None
+
+def _roll_weights(total_kg, count):
+    """Split a returned weight evenly over count rolls, rounding onto the last roll."""
+    if count <= 0:
+        return []
+    each = round((total_kg or 0) / count, 2)
+    return [each] * (count - 1) + [round((total_kg or 0) - each * (count - 1), 2)]
+
+def _generate_rolls(cur, dyeing_output_id, lot_id, weights, location=None):
+    cur.execute("""
+        INSERT INTO rolls (dyeing_output_id, lot_id, seq, weight_kg, location)
+        SELECT ?, ?, key + 1, value, ? FROM json_each(?)
+    """, (dyeing_output_id, lot_id, location, json.dumps(list(weights))))
+    return cur.rowcount
+
+def generate_rolls(dyeing_output_id, weights=None, location=None):
+    """
+    Create the rolls for a dyeing return that has none yet, e.g. one recorded
+    before rolls were tracked. weights defaults to the returned kg split
+    evenly over the returned roll count. Returns the number of rolls created.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        row = cur.execute("SELECT lot_id, returned_qty_kg, returned_qty_rolls FROM dyeing_outputs WHERE id=?",
+                          (dyeing_output_id,)).fetchone()
+        if not row:
+            raise ValueError(f"Dyeing output {dyeing_output_id} not found.")
+        if cur.execute("SELECT 1 FROM rolls WHERE dyeing_output_id=? LIMIT 1", (dyeing_output_id,)).fetchone():
+            raise ValueError(f"Dyeing output {dyeing_output_id} already has rolls.")
+        if weights is None:
+            weights = _roll_weights(row["returned_qty_kg"], row["returned_qty_rolls"] or 0)
+        created = _generate_rolls(cur, dyeing_output_id, row["lot_id"], weights, location)
+        conn.commit()
+    return created
+
+_ROLL_SELECT = """
+    SELECT r.id, r.dyeing_output_id, r.lot_id, r.seq, r.weight_kg, r.state, r.location,
+           l.lot_no, COALESCE(b.batch_ref, '') AS batch_ref, COALESCE(b.fabric_type_name, '') AS fabric_type,
+           d.returned_date
+    FROM rolls r
+    JOIN lots l ON l.id = r.lot_id
+    LEFT JOIN batches b ON b.id = l.batch_id
+    LEFT JOIN dyeing_outputs d ON d.id = r.dyeing_output_id
+"""
+
+def _roll_dict(row):
+    roll = dict(row)
+    roll["code"] = roll_code(roll["id"])
+    roll["state"] = ROLL_STATES[roll["state"]]
+    return roll
+
+def find_roll(code):
+    """The roll for a scanned code, with its lot and batch, or None."""
+    roll_id = _roll_id(code)
+    if roll_id is None:
+        return None
+    with get_connection() as conn:
+        row = conn.execute(_ROLL_SELECT + " WHERE r.id = ?", (roll_id,)).fetchone()
+    return _roll_dict(row) if row else None
+
+def lot_rolls(lot_id=None, dyeing_output_id=None, state=None):
+    """Rolls of a lot or of one dyeing return, optionally in one state."""
+    where, params = [], []
+    if lot_id is not None:
+        where.append("r.lot_id = ?")
+        params.append(lot_id)
+    if dyeing_output_id is not None:
+        where.append("r.dyeing_output_id = ?")
+        params.append(dyeing_output_id)
+    if state is not None:
+        where.append("r.state = ?")
+        params.append(ROLL_STATES.index(state))
+    sql = _ROLL_SELECT + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY r.id"
+    with get_connection() as conn:
+        return [_roll_dict(r) for r in conn.execute(sql, params).fetchall()]
+
+def set_roll_state(codes, state=None, location=None):
+    """
+    Move scanned rolls to a state and/or location in one UPDATE. Unknown
+    codes raise ValueError before anything changes. Rolls only enter or
+    leave Dispatched through a sale (_dispatch/_release), which keeps
+    sale_allocations in step. Returns the number of rolls updated.
+    """
+    if state is not None and state not in ROLL_STATES:
+        raise ValueError(f"Invalid roll state: {state}")
+    if state == "Dispatched":
+        raise ValueError("Rolls are dispatched by recording a sale on the Sales tab.")
+    ids = [_roll_id(c) for c in codes]
+    bad = [c for c, i in zip(codes, ids) if i is None]
+    if bad:
+        raise ValueError(f"Invalid roll code(s): {', '.join(map(str, bad))}")
+    sets, params = [], []
+    if state is not None:
+        sets.append("state = ?")
+        params.append(ROLL_STATES.index(state))
+    if location is not None:
+        sets.append("location = ?")
+        params.append(location.strip() or None)
+    if not sets or not ids:
+        return 0
+    with get_connection() as conn:
+        cur = conn.cursor()
+        ids_json = json.dumps(ids)
+        found = cur.execute("SELECT COUNT(*) FROM rolls WHERE id IN (SELECT value FROM json_each(?))",
+                            (ids_json,)).fetchone()[0]
+        if found != len(set(ids)):
+            known = {r[0] for r in cur.execute("SELECT id FROM rolls WHERE id IN (SELECT value FROM json_each(?))",
+                                               (ids_json,)).fetchall()}
+            raise ValueError(f"Roll(s) not found: {', '.join(roll_code(i) for i in ids if i not in known)}")
+        if state is not None:
+            sold = [roll_code(r[0]) for r in cur.execute(
+                "SELECT id FROM rolls WHERE id IN (SELECT value FROM json_each(?)) AND state = ? ORDER BY id",
+                (ids_json, ROLL_STATES.index("Dispatched"))).fetchall()]
+            if sold:
+                raise ValueError(f"Roll(s) {', '.join(sold)} are dispatched; edit or delete the sale to return them.")
+        cur.execute(f"UPDATE rolls SET {', '.join(sets)} WHERE id IN (SELECT value FROM json_each(?))",
+                    params + [ids_json])
+        conn.commit()
+        return cur.rowcount
+
+@cached_query
+def roll_summary(group_by=("state",), firm=None, state=None, location=None):
+    """
+    Roll counts and weights from roll_rollup, grouped by any of
+    ROLL_SUMMARY_KEYS. Returns a list of dicts with the group columns,
+    rolls and weight_kg (a single dict when ungrouped).
+    """
+    group_by = [g for g in group_by if g in ROLL_SUMMARY_KEYS]
+    filters, params = "", []
+    if firm is not None:
+        filters += " AND firm = ?"
+        params.append(firm)
+    if state is not None:
+        filters += " AND state = ?"
+        params.append(state)
+    if location is not None:
+        filters += " AND location = ?"
+        params.append(location)
+    group = ", ".join(group_by)
+    sql = f"""
+        SELECT {group + ", " if group else ""}
+               COALESCE(SUM(entries), 0) AS rolls, COALESCE(SUM(weight_kg), 0) AS weight_kg
+        FROM (
+            SELECT COALESCE(b.firm_name, '') AS firm, COALESCE(b.batch_ref, '') AS batch_ref, l.lot_no,
+                   {_roll_state_label_sql("rr.state")} AS state, rr.location, rr.entries, rr.weight_kg
+            FROM roll_rollup rr
+            JOIN lots l ON l.id = rr.lot_id
+            LEFT JOIN batches b ON b.id = l.batch_id
+        )
+        WHERE 1 = 1{filters}
+    """
+    if group:
+        sql += f" GROUP BY {group} ORDER BY {group}"
+    with get_connection() as conn:
+        rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+    return rows if group else rows[0]
+
+# ----------------------------
+# Purchases / Dyeing Outputs
+# ----------------------------
+def record_purchase(date, batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls,
+                    price_per_unit=0, delivered_to="", notes="", includes_rib_collar=0, firm_name=""):
+    if not is_delivered_to_valid(delivered_to):
+        raise ValueError(f"Delivered To '{delivered_to}' not found in Masters.")
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _check_open_period(cur, ui_to_db_date(date))
+
+        # Create batch (and its first lot) if they don't exist
+        if not batch_id or not get_batch_id_by_ref(batch_id):
+            fabricator_id = get_supplier_id_by_name(delivered_to, "knitting_unit")
+            if fabricator_id:
+                row = cur.execute("SELECT name FROM fabric_compositions LIMIT 1").fetchone()
+                if not row:
+                    raise ValueError("No fabric type defined.")
+                stamp = f"BATCH_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                batch_id, n = stamp, 1
+                while cur.execute("SELECT 1 FROM batches WHERE batch_ref=?", (batch_id,)).fetchone():
+                    n += 1
+                    batch_id = f"{stamp}_{n}"  # Several purchases within one second
+                # Created in this transaction, so a failure below leaves no stray batch
+                cur.execute("""
+                    INSERT INTO batches (batch_ref, fabricator_id, fabric_type_name, expected_lots, composition, firm_name)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (batch_id, fabricator_id, row["name"], 1, "", firm_name))
+                _add_lots(cur, cur.lastrowid, batch_id, [1], qty_kg)
+                lot_no = f"{batch_id}/1"
+
+        # Record purchase
+        cur.execute("""
+            INSERT INTO purchases (date, batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls, price_per_unit, delivered_to, notes, includes_rib_collar, firm_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (ui_to_db_date(date), batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls, price_per_unit, delivered_to, notes, includes_rib_collar, firm_name))
+        purchase_id = cur.lastrowid
+
+        # Update stock
+        if delivered_to:
+            cur.execute("""
+                INSERT OR IGNORE INTO yarn_stock (fabricator, yarn_type, qty_kg)
+                VALUES (?, ?, ?)
+            """, (delivered_to, yarn_type, 0))
+            cur.execute("SELECT qty_kg FROM yarn_stock WHERE fabricator = ? AND yarn_type = ?", (delivered_to, yarn_type))
+            current_stock = cur.fetchone()["qty_kg"]
+            if current_stock + qty_kg < 0:
+                raise ValueError(f"Insufficient {yarn_type} stock ({current_stock} kg) at {delivered_to}")
+            cur.execute("""
+                UPDATE yarn_stock
+                SET qty_kg = qty_kg + ?
+                WHERE fabricator = ? AND yarn_type = ?
+            """, (qty_kg, delivered_to, yarn_type))
+
+            # Apply Rib/Collar consumption if flagged
+            if includes_rib_collar:
+                cur.execute("SELECT fabric_type_name FROM batches WHERE batch_ref = ?", (batch_id,))
+                row = cur.fetchone()
+                if row:
+                    fabric_type_name = row["fabric_type_name"]
+                    cur.execute("""
+                        SELECT yt.name AS yarn_type, fc.component, fc.ratio
+                        FROM fabric_compositions fc
+                        JOIN yarn_types yt ON fc.yarn_type_id = yt.id
+                        WHERE fc.name = ? AND fc.component IN ('Rib', 'Collar')
+                    """, (fabric_type_name,))
+                    rib_collar_comps = cur.fetchall()
+                    if rib_collar_comps:
+                        for comp in rib_collar_comps:
+                            rib_collar_yarn = comp["yarn_type"]
+                            ratio = comp["ratio"]
+                            consumed_kg = qty_rolls * 0.5 * (ratio / 100)  # 0.5 kg per roll example
+                            cur.execute("""
+                                INSERT OR IGNORE INTO yarn_stock (fabricator, yarn_type, qty_kg)
+                                VALUES (?, ?, 0)
+                            """, (delivered_to, rib_collar_yarn))
+                            cur.execute("SELECT qty_kg FROM yarn_stock WHERE fabricator = ? AND yarn_type = ?", (delivered_to, rib_collar_yarn))
+                            current_rib_stock = cur.fetchone()["qty_kg"]
+                            if current_rib_stock - consumed_kg < 0:
+                                raise ValueError(f"Insufficient {rib_collar_yarn} stock ({current_rib_stock} kg) at {delivered_to}")
+                            cur.execute("""
+                                UPDATE yarn_stock
+                                SET qty_kg = qty_kg - ?
+                                WHERE fabricator = ? AND yarn_type = ?
+                            """, (consumed_kg, delivered_to, rib_collar_yarn))
+
+        # Update lot weight and status. Looked up on this cursor: the cached
+        # lookups use another connection, which can't see a batch created above.
+        row = cur.execute("SELECT id FROM lots WHERE lot_no=? LIMIT 1", ((lot_no or "").strip(),)).fetchone()
+        lot_id = row["id"] if row else None
+        if lot_id:
+            cur.execute("UPDATE lots SET weight_kg=?, status='Ordered' WHERE id=?", (qty_kg, lot_id))
+        row = cur.execute("SELECT id FROM batches WHERE batch_ref=? LIMIT 1", ((batch_id or "").strip(),)).fetchone()
+        batch_id_int = row["id"] if row else None
+        if batch_id_int:
+            # Status changes go through this cursor; a second connection would
+            # block on the write lock this transaction already holds.
+            _set_batch_status(cur, batch_id_int, 'Ordered')
+            if lot_id:
+                _set_lot_status(cur, lot_id, 'Ordered')
+            if delivered_to and get_supplier_id_by_name(delivered_to, "knitting_unit"):
+                _set_batch_status(cur, batch_id_int, 'Knitted')
+                if lot_id:
+                    _set_lot_status(cur, lot_id, 'Knitted')
+
+        usage = _record_usage(cur, supplier, yarn_type, delivered_to)
+        conn.commit()
+    _apply_usage(usage)
+    return purchase_id
+
+def edit_purchase(purchase_id, date, batch_id, lot_no, supplier, yarn_type, qty_kg, qty_rolls,
+                  price_per_unit, delivered_to, notes="", includes_rib_collar=0, firm_name=""):
+    if not is_delivered_to_valid(delivered_to):
+        raise ValueError(f"Delivered To '{delivered_to}' not found in Masters.")
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Fetch original purchase data
+        cur.execute("SELECT date, batch_id, qty_kg, qty_rolls, delivered_to, includes_rib_collar, yarn_type FROM purchases WHERE id=?", (purchase_id,))
+        original = cur.fetchone()
+        if not original:
+            raise ValueError(f"Purchase ID {purchase_id} not found.")
+        _check_open_period(cur, original["date"], ui_to_db_date(date))
+
+        # Adjust stock for original purchase
+        orig_kg = original["qty_kg"]
+        orig_rolls = original["qty_rolls"]
+        orig_delivered = original["delivered_to"]
+        orig_rib_collar = original["includes_rib_collar"]
+        orig_yarn = original["yarn_type"]
+        orig_batch = original["batch_id"]
+        if orig_delivered:
+            cur.execute("""
+                UPDATE yarn_stock
+                SET qty_kg = qty_kg - ?
+                WHERE fabricator = ? AND yarn_type = ?
+            """, (orig_kg, orig_delivered, orig_yarn))
+            if orig_rib_collar:
+                # Reverse against the batch the purchase was recorded for, not the edited one
+                cur.execute("SELECT fabric_type_name FROM batches WHERE batch_ref = ?", (orig_batch,))
+                row = cur.fetchone()
                 if row:
                     fabric_type_name = row["fabric_type_name"]
                     cur.execute("""
@@ -746,6 +3447,10 @@ def edit_purchase(purchase_id, date, batch_id, lot_no, supplier, yarn_type, qty_
 
         # Adjust new stock
         if delivered_to:
+            cur.execute("""
+                INSERT OR IGNORE INTO yarn_stock (fabricator, yarn_type, qty_kg)
+                VALUES (?, ?, 0)
+            """, (delivered_to, yarn_type))
             cur.execute("SELECT qty_kg FROM yarn_stock WHERE fabricator = ? AND yarn_type = ?", (delivered_to, yarn_type))
             current_stock = cur.fetchone()
             if not current_stock or current_stock["qty_kg"] + qty_kg < 0:
@@ -790,9 +3495,10 @@ def edit_purchase(purchase_id, date, batch_id, lot_no, supplier, yarn_type, qty_
 def delete_purchase(purchase_id: int):
     with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT lot_no, batch_id, qty_kg, qty_rolls, delivered_to, includes_rib_collar, yarn_type FROM purchases WHERE id=?", (purchase_id,))
+        cur.execute("SELECT date, lot_no, batch_id, qty_kg, qty_rolls, delivered_to, includes_rib_collar, yarn_type FROM purchases WHERE id=?", (purchase_id,))
         row = cur.fetchone()
         if row:
+            _check_open_period(cur, row["date"])
             lot_no = row["lot_no"]
             batch_id = row["batch_id"]
             qty_kg = row["qty_kg"]
@@ -836,7 +3542,9 @@ def delete_purchase(purchase_id: int):
             cur.execute("DELETE FROM purchases WHERE id=?", (purchase_id,))
         conn.commit()
 
-def record_dyeing_output(lot_id, returned_date, returned_qty_kg, returned_qty_rolls, notes="", dyeing_unit_name=None):
+def record_dyeing_output(lot_id, returned_date, returned_qty_kg, returned_qty_rolls, notes="", dyeing_unit_name=None,
+                         roll_weights=None):
+    """Record a dyeing return and its rolls (roll_weights, else the kg split evenly)."""
     resolved_lot_id = None
     if isinstance(lot_id, int):
         resolved_lot_id = lot_id
@@ -856,6 +3564,7 @@ def record_dyeing_output(lot_id, returned_date, returned_qty_kg, returned_qty_ro
         batch_id = cur.fetchone()["batch_id"]
         if not batch_id:
             raise ValueError(f"Batch for lot ID {resolved_lot_id} not found.")
+        _check_open_period(cur, ui_to_db_date(returned_date))
         if dyeing_unit_id:
             cur.execute("UPDATE batches SET dyeing_unit_id = ? WHERE id = ?", (dyeing_unit_id, batch_id))
 
@@ -864,6 +3573,11 @@ def record_dyeing_output(lot_id, returned_date, returned_qty_kg, returned_qty_ro
             VALUES (?, ?, ?, ?, ?, ?)
         """, (resolved_lot_id, dyeing_unit_id, ui_to_db_date(returned_date), returned_qty_kg, returned_qty_rolls, notes))
         dyeing_output_id = cur.lastrowid
+        if roll_weights is None:
+            roll_weights = _roll_weights(returned_qty_kg, returned_qty_rolls or 0)
+        elif returned_qty_rolls and len(roll_weights) != returned_qty_rolls:
+            raise ValueError(f"{len(roll_weights)} roll weights given for {returned_qty_rolls} rolls.")
+        _generate_rolls(cur, dyeing_output_id, resolved_lot_id, roll_weights)
 
         # Update stock
         cur.execute("SELECT weight_kg, lot_no FROM lots WHERE id=?", (resolved_lot_id,))
@@ -871,15 +3585,21 @@ def record_dyeing_output(lot_id, returned_date, returned_qty_kg, returned_qty_ro
         if lot_data:
             weight_kg = lot_data["weight_kg"] or 0
             lot_no = lot_data["lot_no"]
-            cur.execute("SELECT fabric_type_name FROM batches WHERE id=?", (batch_id,))
-            fabric_type_name = cur.fetchone()["fabric_type_name"]
+            # The yarn was knitted at the batch's knitting unit, so its stock is debited
+            cur.execute("""
+                SELECT b.fabric_type_name, s.name AS knitter
+                FROM batches b LEFT JOIN suppliers s ON s.id = b.fabricator_id
+                WHERE b.id=?
+            """, (batch_id,))
+            batch_row = cur.fetchone()
+            fabric_type_name, knitter = batch_row["fabric_type_name"], batch_row["knitter"]
             cur.execute("""
                 SELECT yt.name AS yarn_type, fc.component, fc.ratio
                 FROM fabric_compositions fc
                 JOIN yarn_types yt ON fc.yarn_type_id = yt.id
                 WHERE fc.name = ? AND fc.component IN ('Main Fabric', 'Rib', 'Collar')
             """, (fabric_type_name,))
-            compositions = cur.fetchall()
+            compositions = cur.fetchall() if knitter else []
             for comp in compositions:
                 yarn_type = comp["yarn_type"]
                 ratio = comp["ratio"]
@@ -887,24 +3607,24 @@ def record_dyeing_output(lot_id, returned_date, returned_qty_kg, returned_qty_ro
                 cur.execute("""
                     INSERT OR IGNORE INTO yarn_stock (fabricator, yarn_type, qty_kg)
                     VALUES (?, ?, 0)
-                """, (dyeing_unit_name or "Unknown", yarn_type))
-                cur.execute("SELECT qty_kg FROM yarn_stock WHERE fabricator = ? AND yarn_type = ?", (dyeing_unit_name or "Unknown", yarn_type))
+                """, (knitter, yarn_type))
+                cur.execute("SELECT qty_kg FROM yarn_stock WHERE fabricator = ? AND yarn_type = ?", (knitter, yarn_type))
                 current_stock = cur.fetchone()["qty_kg"]
                 if current_stock - consumed_kg < 0:
-                    raise ValueError(f"Insufficient {yarn_type} stock ({current_stock} kg) at {dyeing_unit_name or 'Unknown'}")
+                    raise ValueError(f"Insufficient {yarn_type} stock ({current_stock} kg) at {knitter}")
                 cur.execute("""
                     UPDATE yarn_stock
                     SET qty_kg = qty_kg - ?
                     WHERE fabricator = ? AND yarn_type = ?
-                """, (consumed_kg, dyeing_unit_name or "Unknown", yarn_type))
+                """, (consumed_kg, knitter, yarn_type))
 
-        # Update lot status based on completion
+        # Update lot status based on completion (through this cursor, as in record_purchase)
         if lot_data and returned_qty_kg >= 0.9 * weight_kg:
-            update_lot_status(resolved_lot_id, 'Received')
-            update_batch_status(batch_id, 'Received')
+            _set_lot_status(cur, resolved_lot_id, 'Received')
+            _set_batch_status(cur, batch_id, 'Received')
         elif returned_qty_kg > 0:
-            update_lot_status(resolved_lot_id, 'Dyed')
-            update_batch_status(batch_id, 'Dyed')
+            _set_lot_status(cur, resolved_lot_id, 'Dyed')
+            _set_batch_status(cur, batch_id, 'Dyed')
 
         conn.commit()
     return dyeing_output_id
@@ -912,20 +3632,28 @@ def record_dyeing_output(lot_id, returned_date, returned_qty_kg, returned_qty_ro
 def delete_dyeing_output(dyeing_id: int):
     with get_connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT lot_id, returned_qty_kg, dyeing_unit_id FROM dyeing_outputs WHERE id=?", (dyeing_id,))
+        cur.execute("SELECT lot_id, returned_date, returned_qty_kg FROM dyeing_outputs WHERE id=?", (dyeing_id,))
         row = cur.fetchone()
         if row:
+            _check_open_period(cur, row["returned_date"])
             lot_id = row["lot_id"]
             returned_qty_kg = row["returned_qty_kg"]
-            dyeing_unit_id = row["dyeing_unit_id"]
-            cur.execute("SELECT name FROM suppliers WHERE id=?", (dyeing_unit_id,))
-            dyeing_unit_name = cur.fetchone()["name"] if dyeing_unit_id else "Unknown"
+            cur.execute("SELECT COUNT(*) FROM rolls WHERE dyeing_output_id=? AND state=?",
+                        (dyeing_id, ROLL_STATES.index("Dispatched")))
+            dispatched = cur.fetchone()[0]
+            if dispatched:
+                raise ValueError(f"{dispatched} roll(s) from this dyeing return have been dispatched.")
 
-            # Adjust stock
+            # Adjust stock: credit back the knitting unit it was debited from
             cur.execute("SELECT batch_id FROM lots WHERE id=?", (lot_id,))
             batch_id = cur.fetchone()["batch_id"]
-            cur.execute("SELECT fabric_type_name FROM batches WHERE id=?", (batch_id,))
-            fabric_type_name = cur.fetchone()["fabric_type_name"]
+            cur.execute("""
+                SELECT b.fabric_type_name, s.name AS knitter
+                FROM batches b LEFT JOIN suppliers s ON s.id = b.fabricator_id
+                WHERE b.id=?
+            """, (batch_id,))
+            batch_row = cur.fetchone()
+            fabric_type_name, knitter = batch_row["fabric_type_name"], batch_row["knitter"]
             cur.execute("""
                 SELECT yt.name AS yarn_type, fc.component, fc.ratio
                 FROM fabric_compositions fc
@@ -941,19 +3669,17 @@ def delete_dyeing_output(dyeing_id: int):
                     UPDATE yarn_stock
                     SET qty_kg = qty_kg + ?
                     WHERE fabricator = ? AND yarn_type = ?
-                """, (consumed_kg, dyeing_unit_name, yarn_type))
+                """, (consumed_kg, knitter, yarn_type))
 
             cur.execute("DELETE FROM dyeing_outputs WHERE id=?", (dyeing_id,))
             # Revert lot and batch status if no other dyeing outputs exist
             cur.execute("SELECT COUNT(*) FROM dyeing_outputs WHERE lot_id=?", (lot_id,))
             if cur.fetchone()[0] == 0:
-                update_lot_status(lot_id, 'Knitted')
-                cur.execute("SELECT MIN(status) AS min_status FROM lots WHERE batch_id=?", (batch_id,))
-                min_status = cur.fetchone()["min_status"]
-                update_batch_status(batch_id, min_status)
+                _set_lot_status(cur, lot_id, 'Knitted')  # Also settles the batch status
         conn.commit()
 
 # Helper function to get batch_id by reference
+@cached_query
 def get_batch_id_by_ref(batch_ref):
     with get_connection() as conn:
         row = conn.execute("SELECT id FROM batches WHERE batch_ref=? LIMIT 1", (batch_ref,)).fetchone()
@@ -981,69 +3707,915 @@ def delete_batch(batch_ref):
 # ----------------------------
 # New Functions
 # ----------------------------
-def update_batch_status(batch_id, status):
-    if status not in ['Ordered', 'Knitted', 'Dyed', 'Received']:
+def _set_batch_status(cur, batch_id, status):
+    if status not in STATUSES:
+        raise ValueError(f"Invalid status: {status}")
+    cur.execute("UPDATE batches SET status=? WHERE id=?", (status, batch_id))
+    cur.execute("UPDATE lots SET status=? WHERE batch_id=?", (status, batch_id))
+
+def _set_lot_status(cur, lot_id, status):
+    if status not in STATUSES:
         raise ValueError(f"Invalid status: {status}")
+    cur.execute("UPDATE lots SET status=? WHERE id=?", (status, lot_id))
+    cur.execute("SELECT batch_id FROM lots WHERE id=?", (lot_id,))
+    row = cur.fetchone()
+    if row and row["batch_id"] is not None:
+        _sync_batch_status(cur, row["batch_id"])
+
+def _sync_batch_status(cur, batch_id):
+    """Set a batch to the least advanced status among its lots."""
+    cur.execute("SELECT MIN(status_rank) FROM lots WHERE batch_id=?", (batch_id,))
+    rank = cur.fetchone()[0]
+    if rank is not None:
+        cur.execute("UPDATE batches SET status=? WHERE id=? AND status IS NOT ?",
+                    (STATUSES[rank], batch_id, STATUSES[rank]))
+
+# Status each lot's transactions justify: a dyeing return of 90% of the lot
+# weight, any dyeing return, yarn delivered to a knitting unit for the batch,
+# or any purchase for the batch. NULL when nothing has happened yet.
+_BATCH_PURCHASE_EVIDENCE = """
+    CASE WHEN EXISTS (SELECT 1 FROM purchases p
+                      JOIN suppliers s ON s.name = p.delivered_to AND s.type = 'knitting_unit'
+                      WHERE p.batch_id = b.batch_ref) THEN 'Knitted'
+         WHEN EXISTS (SELECT 1 FROM purchases p WHERE p.batch_id = b.batch_ref) THEN 'Ordered'
+    END"""
+_LOT_EVIDENCE_SQL = f"""
+    SELECT l.id AS lot_id, l.batch_id,
+           CASE WHEN EXISTS (SELECT 1 FROM dyeing_outputs d WHERE d.lot_id = l.id
+                             AND d.returned_qty_kg >= 0.9 * l.weight_kg) THEN 'Received'
+                WHEN EXISTS (SELECT 1 FROM dyeing_outputs d WHERE d.lot_id = l.id
+                             AND d.returned_qty_kg > 0) THEN 'Dyed'
+                ELSE {_BATCH_PURCHASE_EVIDENCE}
+           END AS status
+    FROM lots l
+    JOIN batches b ON b.id = l.batch_id
+"""
+
+def _refresh_statuses(cur):
+    cur.execute(f"CREATE TEMP TABLE lot_evidence AS SELECT * FROM ({_LOT_EVIDENCE_SQL}) WHERE status IS NOT NULL")
+    cur.execute("""
+        UPDATE lots SET status = e.status
+        FROM lot_evidence e
+        WHERE lots.id = e.lot_id AND lots.status IS NOT e.status
+          AND NOT (e.status = 'Ordered' AND lots.status_rank > 0)
+    """)
+    changed = cur.rowcount
+    cur.execute(f"""
+        UPDATE batches SET status = e.status
+        FROM (
+            SELECT batch_id, {_status_label_sql("MIN(status_rank)")} AS status
+            FROM lots WHERE batch_id IS NOT NULL GROUP BY batch_id
+            UNION ALL
+            SELECT b.id, {_BATCH_PURCHASE_EVIDENCE} FROM batches b
+            WHERE NOT EXISTS (SELECT 1 FROM lots l WHERE l.batch_id = b.id)
+        ) e
+        WHERE batches.id = e.batch_id AND e.status IS NOT NULL AND batches.status IS NOT e.status
+          AND NOT (e.status = 'Ordered' AND batches.status_rank > 0)
+    """)
+    changed += cur.rowcount
+    cur.execute("DROP TABLE temp.lot_evidence")
+    return changed
+
+def refresh_statuses():
+    """
+    Bring every lot and batch status in line with its transactions. A batch
+    takes the least advanced status of its lots (or its own purchases when it
+    has no lots). Rows are only written when the status actually changes, and
+    'Ordered' never demotes a later status. Returns the number of rows updated.
+    """
+    with get_connection() as conn:
+        changed = _refresh_statuses(conn.cursor())
+        conn.commit()
+    return changed
+
+def update_batch_status(batch_id, status):
     with get_connection() as conn:
-        conn.execute("UPDATE batches SET status=? WHERE id=?", (status, batch_id))
-        conn.execute("UPDATE lots SET status=? WHERE batch_id=?", (status, batch_id))
+        _set_batch_status(conn.cursor(), batch_id, status)
         conn.commit()
 
 def update_lot_status(lot_id, status):
-    if status not in ['Ordered', 'Knitted', 'Dyed', 'Received']:
-        raise ValueError(f"Invalid status: {status}")
     with get_connection() as conn:
-        conn.execute("UPDATE lots SET status=? WHERE id=?", (status, lot_id))
-        # Update batch status based on minimum lot status
-        cur = conn.cursor()
-        cur.execute("SELECT batch_id FROM lots WHERE id=?", (lot_id,))
-        batch_id = cur.fetchone()["batch_id"]
-        cur.execute("SELECT MIN(status) AS min_status FROM lots WHERE batch_id=?", (batch_id,))
-        min_status = cur.fetchone()["min_status"]
-        if min_status == status:
-            conn.execute("UPDATE batches SET status=? WHERE id=?", (status, batch_id))
+        _set_lot_status(conn.cursor(), lot_id, status)
         conn.commit()
 
+@cached_query
 def get_batch_status(batch_id):
     with get_connection() as conn:
         row = conn.execute("SELECT status FROM batches WHERE id=? LIMIT 1", (batch_id,)).fetchone()
     return row["status"] if row else None
 
+@cached_query
 def get_lot_status(lot_id):
     with get_connection() as conn:
         row = conn.execute("SELECT status FROM lots WHERE id=? LIMIT 1", (lot_id,)).fetchone()
     return row["status"] if row else None
 
 def calculate_net_price(batch_id):
+    """Net cost of one batch (by batch ref) from the batch costing engine."""
+    from fabric_tracker_tk import costing  # costing imports db
+    cost = costing.batch_cost(batch_id)
+    return cost["net_cost"] if cost else 0
+
+# ----------------------------
+# Sales / Dispatch
+# ----------------------------
+# Customers, finished stock that is not tracked roll by roll, and sales. A
+# sale's item is one or more roll codes (comma separated), a lot number or a
+# finished_stock item. The stock leaves in the same transaction as the sale
+# row: rolls are marked Dispatched (a lot's rolls in stock are taken first,
+# whole rolls only, and a quantity they cannot make up exactly is refused)
+# and finished_stock rows are drawn down oldest first.
+# sale_allocations records what each sale took, so editing or deleting a
+# sale puts exactly that stock back.
+SALES_PAGE_SIZE = 200  # Rows per fetch_* page
+_QTY_EPSILON = 1e-6
+
+def _init_sales(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS customers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        contact TEXT DEFAULT ''
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS finished_stock (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item TEXT NOT NULL,
+        lot_id INTEGER,
+        quantity REAL NOT NULL DEFAULT 0,
+        unit TEXT DEFAULT 'kg',
+        location TEXT DEFAULT '',
+        FOREIGN KEY(lot_id) REFERENCES lots(id)
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER NOT NULL,
+        item TEXT NOT NULL,
+        quantity REAL NOT NULL DEFAULT 0,
+        price REAL DEFAULT 0,
+        date TEXT,
+        FOREIGN KEY(customer_id) REFERENCES customers(id)
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sale_allocations (
+        sale_id INTEGER NOT NULL,
+        roll_id INTEGER,
+        stock_id INTEGER,
+        quantity REAL NOT NULL,
+        FOREIGN KEY(sale_id) REFERENCES sales(id) ON DELETE CASCADE
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_customers_name_nocase ON customers(name COLLATE NOCASE)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_finished_stock_item ON finished_stock(item)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_finished_stock_lot ON finished_stock(lot_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer ON sales(customer_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sale_allocations_sale ON sale_allocations(sale_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sale_allocations_stock ON sale_allocations(stock_id)")
+
+def _dispatch(cur, sale_id, item, quantity):
+    """Take the stock for a sale and record it in sale_allocations. Returns the quantity dispatched."""
+    in_stock = ROLL_STATES.index("In Stock")
+    rolls, drawn = [], []  # [(roll_id, kg)], [(stock_id, quantity)]
+    codes = [c.strip() for c in item.split(",") if c.strip()]
+    if codes and all(c.upper().startswith(ROLL_CODE_PREFIX) and _roll_id(c) is not None for c in codes):
+        ids = list(dict.fromkeys(_roll_id(c) for c in codes))
+        found = {r["id"]: r for r in cur.execute(
+            "SELECT id, weight_kg, state FROM rolls WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ids),)).fetchall()}
+        for i in ids:
+            if i not in found:
+                raise ValueError(f"Roll '{roll_code(i)}' not found.")
+            if ROLL_STATES[found[i]["state"]] in ("Dispatched", "Rejected"):
+                raise ValueError(f"Roll '{roll_code(i)}' is {ROLL_STATES[found[i]['state']]}.")
+            rolls.append((i, found[i]["weight_kg"] or 0))
+    else:
+        lot_id = get_lot_id_by_no(item)
+        remaining, next_roll = quantity, None
+        if lot_id:
+            for r in cur.execute("SELECT id, weight_kg FROM rolls WHERE lot_id=? AND state=? ORDER BY id",
+                                 (lot_id, in_stock)).fetchall():
+                if remaining <= _QTY_EPSILON:
+                    break
+                kg = r["weight_kg"] or 0
+                if kg > remaining + _QTY_EPSILON:
+                    next_roll = kg  # Rolls leave whole, so this one would overshoot
+                    break
+                rolls.append((r["id"], kg))
+                remaining -= kg
+        if remaining > _QTY_EPSILON:
+            for r in cur.execute("""
+                SELECT id, quantity FROM finished_stock
+                WHERE (item = ? OR lot_id = ?) AND quantity > 0
+                ORDER BY id
+            """, (item, lot_id)).fetchall():
+                take = min(r["quantity"], remaining)
+                drawn.append((r["id"], take))
+                remaining -= take
+                if remaining <= _QTY_EPSILON:
+                    break
+        if remaining > _QTY_EPSILON and next_roll is not None:
+            taken = quantity - remaining
+            raise ValueError(f"'{item}' is dispatched in whole rolls: {taken:,.2f} or {taken + next_roll:,.2f} "
+                             f"can be sold, not {quantity:,.2f}.")
+        if remaining > _QTY_EPSILON:
+            raise ValueError(f"Only {quantity - remaining:,.2f} of '{item}' in stock; {quantity:,.2f} needed.")
+
+    cur.executemany("UPDATE rolls SET state = ? WHERE id = ?",
+                    [(ROLL_STATES.index("Dispatched"), i) for i, _kg in rolls])
+    cur.executemany("UPDATE finished_stock SET quantity = quantity - ? WHERE id = ?",
+                    [(q, i) for i, q in drawn])
+    cur.executemany("INSERT INTO sale_allocations (sale_id, roll_id, stock_id, quantity) VALUES (?, ?, ?, ?)",
+                    [(sale_id, i, None, kg) for i, kg in rolls] + [(sale_id, None, i, q) for i, q in drawn])
+    # Listed roll codes go out at their own weight, whatever quantity was entered
+    return round(sum(kg for _i, kg in rolls) + sum(q for _i, q in drawn), 3)
+
+def _release(cur, sale_id):
+    """Return the stock a sale took."""
+    cur.execute("""
+        UPDATE rolls SET state = ?
+        WHERE id IN (SELECT roll_id FROM sale_allocations WHERE sale_id = ? AND roll_id IS NOT NULL)
+    """, (ROLL_STATES.index("In Stock"), sale_id))
+    cur.execute("""
+        UPDATE finished_stock
+        SET quantity = quantity + (SELECT SUM(a.quantity) FROM sale_allocations a
+                                   WHERE a.sale_id = ? AND a.stock_id = finished_stock.id)
+        WHERE id IN (SELECT stock_id FROM sale_allocations WHERE sale_id = ?)
+    """, (sale_id, sale_id))
+    cur.execute("DELETE FROM sale_allocations WHERE sale_id = ?", (sale_id,))
+
+class Database:
+    """
+    Repository behind the Sales, Customers, Finished Stock and Purchases
+    screens. fetch_* return tuples in the screens' column order, one page at
+    a time: pass the last row's key back to get the next page.
+    """
+    def __init__(self, page_size=SALES_PAGE_SIZE):
+        self.page_size = page_size
+
+    def _fetch(self, sql, params, limit):
+        with get_connection() as conn:
+            return [tuple(r) for r in conn.execute(sql + " LIMIT ?", (*params, limit or self.page_size)).fetchall()]
+
+    # Customers
+    def fetch_customers(self, limit=None, after_name=None, after_id=None):
+        """Customers by name; after_name and after_id are the last row of the previous page."""
+        # Names differing only in case sort together, so id breaks the tie. The
+        # >= bound lets the NOCASE index seek; a row-value compare would scan it.
+        name = after_name or ""
+        return self._fetch("""
+            SELECT id, name, contact FROM customers
+            WHERE name COLLATE NOCASE >= ? AND (name COLLATE NOCASE > ? OR id > ?)
+            ORDER BY name COLLATE NOCASE, id
+        """, (name, name, after_id or 0), limit)
+
+    def insert_customer(self, name, contact=""):
+        try:
+            with get_connection() as conn:
+                cur = conn.execute("INSERT INTO customers (name, contact) VALUES (?, ?)", (name.strip(), contact.strip()))
+                conn.commit()
+                return cur.lastrowid
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Customer '{name}' already exists.")
+
+    def update_customer(self, customer_id, name, contact=""):
+        try:
+            with get_connection() as conn:
+                conn.execute("UPDATE customers SET name=?, contact=? WHERE id=?", (name.strip(), contact.strip(), customer_id))
+                conn.commit()
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Customer '{name}' already exists.")
+
+    def delete_customer(self, customer_id):
+        with get_connection() as conn:
+            if conn.execute("SELECT 1 FROM sales WHERE customer_id=? LIMIT 1", (customer_id,)).fetchone():
+                raise ValueError("This customer has sales and cannot be deleted.")
+            conn.execute("DELETE FROM customers WHERE id=?", (customer_id,))
+            conn.commit()
+
+    # Finished stock
+    def fetch_stock(self, limit=None, before_id=None):
+        """Finished stock rows, newest first; before_id is the last id of the previous page."""
+        return self._fetch(
+            "SELECT id, item, quantity, unit, location FROM finished_stock WHERE id < ? ORDER BY id DESC",
+            (before_id or sys.maxsize,), limit)
+
+    def insert_stock(self, item, quantity, unit="kg", location=""):
+        with get_connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO finished_stock (item, lot_id, quantity, unit, location) VALUES (?, ?, ?, ?, ?)",
+                (item.strip(), get_lot_id_by_no(item.strip()), quantity, unit or "kg", location))
+            conn.commit()
+            return cur.lastrowid
+
+    def update_stock(self, stock_id, item, quantity, unit="kg", location=""):
+        with get_connection() as conn:
+            conn.execute("UPDATE finished_stock SET item=?, lot_id=?, quantity=?, unit=?, location=? WHERE id=?",
+                         (item.strip(), get_lot_id_by_no(item.strip()), quantity, unit or "kg", location, stock_id))
+            conn.commit()
+
+    def delete_stock(self, stock_id):
+        with get_connection() as conn:
+            if conn.execute("SELECT 1 FROM sale_allocations WHERE stock_id=? LIMIT 1", (stock_id,)).fetchone():
+                raise ValueError("Sales have been dispatched from this stock; it cannot be deleted.")
+            conn.execute("DELETE FROM finished_stock WHERE id=?", (stock_id,))
+            conn.commit()
+
+    # Sales
+    def fetch_sales(self, limit=None, before_id=None, customer=None):
+        """Sales newest first, optionally for one customer; before_id pages as in fetch_stock."""
+        sql = """
+            SELECT s.id, c.name, s.item, s.quantity, s.price, s.date
+            FROM sales s JOIN customers c ON c.id = s.customer_id
+            WHERE s.id < ?"""
+        params = [before_id or sys.maxsize]
+        if customer:
+            sql += " AND c.name = ?"
+            params.append(customer)
+        rows = self._fetch(sql + " ORDER BY s.id DESC", params, limit)
+        return [(*r[:5], db_to_ui_date(r[5])) for r in rows]
+
+    def _customer_id(self, cur, customer):
+        row = cur.execute("SELECT id FROM customers WHERE name=?", (customer.strip(),)).fetchone()
+        if not row:
+            raise ValueError(f"Customer '{customer}' not found.")
+        return row["id"]
+
+    def insert_sale(self, customer, item, quantity, price=0, date=""):
+        """Record a sale and dispatch its stock in one transaction. Returns the sale id."""
+        date = ui_to_db_date(date) if date else datetime.now().strftime("%Y-%m-%d")
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO sales (customer_id, item, quantity, price, date) VALUES (?, ?, ?, ?, ?)",
+                        (self._customer_id(cur, customer), item.strip(), quantity, price, date))
+            sale_id = cur.lastrowid
+            cur.execute("UPDATE sales SET quantity=? WHERE id=?", (_dispatch(cur, sale_id, item.strip(), quantity), sale_id))
+            conn.commit()
+        return sale_id
+
+    def update_sale(self, sale_id, customer, item, quantity, price=0, date=""):
+        """Return the sale's stock and dispatch it again as edited; nothing changes if that fails."""
+        date = ui_to_db_date(date) if date else datetime.now().strftime("%Y-%m-%d")
+        with get_connection() as conn:
+            cur = conn.cursor()
+            _release(cur, sale_id)
+            dispatched = _dispatch(cur, sale_id, item.strip(), quantity)
+            cur.execute("UPDATE sales SET customer_id=?, item=?, quantity=?, price=?, date=? WHERE id=?",
+                        (self._customer_id(cur, customer), item.strip(), dispatched, price, date, sale_id))
+            conn.commit()
+
+    def delete_sale(self, sale_id):
+        with get_connection() as conn:
+            cur = conn.cursor()
+            _release(cur, sale_id)
+            cur.execute("DELETE FROM sales WHERE id=?", (sale_id,))
+            conn.commit()
+
+    # Yarn purchases (the Entries tab records them in full)
+    def fetch_purchases(self, limit=None, before_id=None):
+        rows = self._fetch("""
+            SELECT id, supplier, yarn_type, qty_kg, price_per_unit, date, delivered_to
+            FROM purchases WHERE id < ? ORDER BY id DESC
+        """, (before_id or sys.maxsize,), limit)
+        return [(*r[:5], db_to_ui_date(r[5]), r[6]) for r in rows]
+
+    def insert_purchase(self, supplier, item, quantity, price=0, date="", delivered_to=""):
+        """
+        Record a purchase with no batch of its own. Yarn for a knitting unit
+        gets a new batch and lot from record_purchase; yarn for any other
+        destination needs a batch, so it is refused here in favour of Entries.
+        """
+        if not get_supplier_id_by_name(delivered_to, "knitting_unit"):
+            if not is_delivered_to_valid(delivered_to):
+                raise ValueError(f"Delivered To '{delivered_to}' not found in Masters.")
+            raise ValueError(f"'{delivered_to}' is not a knitting unit. Purchases delivered there need a "
+                             "batch and lot; record them on the Entries tab.")
+        return record_purchase(date, "", "", supplier, item, quantity, 0, price, delivered_to)
+
+    def update_purchase(self, purchase_id, supplier, item, quantity, price=0, date="", delivered_to=""):
+        with get_connection() as conn:
+            row = conn.execute("SELECT * FROM purchases WHERE id=?", (purchase_id,)).fetchone()
+        if not row:
+            raise ValueError(f"Purchase {purchase_id} not found.")
+        edit_purchase(purchase_id, date, row["batch_id"], row["lot_no"], supplier, item, quantity,
+                      row["qty_rolls"], price, delivered_to, row["notes"] or "",
+                      row["includes_rib_collar"] or 0, row["firm_name"] or "")
+
+    def delete_purchase(self, purchase_id):
+        delete_purchase(purchase_id)
+
+# ----------------------------
+# Financial Year Archive
+# ----------------------------
+# close_financial_year() moves a closed FY's finished work out of the hot
+# database into archive_<FY>.db beside it: batches that are Received, have
+# nothing dated after the year end and no rolls left in stock, together with
+# their lots, purchases, dyeing returns, rolls and status history, plus
+# purchases that belong to no remaining batch. What the archived rows did to
+# yarn stock is carried forward as opening_stock rows on the closing date, and
+# the rollups, month-end checkpoints and FIFO layers up to that date are kept
+# as they were. Purchases and dyeing returns dated in a closed year are locked.
+#
+# attach_archives() ATTACHes the archives a date range reaches and shadows the
+# archived tables with TEMP views over main plus the archives, so report
+# queries on that connection read closed years without naming them.
+ARCHIVE_FILE_PREFIX = "archive_"
+
+# Archived tables in parent-to-child order: the rows taken (from the temp id
+# tables filled at close) and the indexes their archive copies get
+_ARCHIVE_TABLES = {
+    "batches": ("id IN (SELECT id FROM temp.fy_archive_batches)",
+                [("batch_ref",), ("fabricator_id",)]),
+    "lots": ("id IN (SELECT id FROM temp.fy_archive_lots)",
+             [("lot_no",), ("batch_id", "status_rank")]),
+    "purchases": ("id IN (SELECT id FROM temp.fy_archive_purchases)",
+                  [("date",), ("batch_id", "date"), ("lot_no",), ("delivered_to", "date")]),
+    "dyeing_outputs": ("id IN (SELECT id FROM temp.fy_archive_dyeing)",
+                       [("returned_date",), ("lot_id",)]),
+    "rolls": ("lot_id IN (SELECT id FROM temp.fy_archive_lots)",
+              [("lot_id", "state"), ("dyeing_output_id",)]),
+    "status_events": ("lot_id IN (SELECT id FROM temp.fy_archive_lots) OR batch_id IN (SELECT id FROM temp.fy_archive_batches)",
+                      [("lot_id", "to_status", "ts"), ("batch_id", "ts")]),
+}
+
+_CLOSED_FLOOR_SQL = "(SELECT MAX(end_date) FROM fy_closings WHERE status = 'closed')"
+# The lock is lifted while a close runs, which may archive rows of earlier closed years
+_LOCK_FLOOR_SQL = """(SELECT MAX(end_date) FROM fy_closings WHERE status = 'closed'
+            AND NOT EXISTS (SELECT 1 FROM fy_closings WHERE status = 'closing'))"""
+
+def _period_lock_sql(table, date_col, watched):
+    abort = "SELECT RAISE(ABORT, 'Date falls in a closed financial year');"
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fy_lock_{table}_bi BEFORE INSERT ON {table}
+        WHEN NEW.{date_col} <= {_LOCK_FLOOR_SQL} BEGIN {abort} END;
+        CREATE TRIGGER IF NOT EXISTS trg_fy_lock_{table}_bu BEFORE UPDATE OF {watched} ON {table}
+        WHEN OLD.{date_col} <= {_LOCK_FLOOR_SQL} OR NEW.{date_col} <= {_LOCK_FLOOR_SQL} BEGIN {abort} END;
+        CREATE TRIGGER IF NOT EXISTS trg_fy_lock_{table}_bd BEFORE DELETE ON {table}
+        WHEN OLD.{date_col} <= {_LOCK_FLOOR_SQL} BEGIN {abort} END;
+    """
+
+def _init_archives(cur):
+    # status is 'closing' while a close is in progress (in its transaction)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS fy_closings (
+        fy TEXT PRIMARY KEY,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        first_date TEXT,
+        last_date TEXT,
+        batches INTEGER NOT NULL DEFAULT 0,
+        lots INTEGER NOT NULL DEFAULT 0,
+        purchases INTEGER NOT NULL DEFAULT 0,
+        dyeing_outputs INTEGER NOT NULL DEFAULT 0,
+        rolls INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'closing',
+        closed_at TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS opening_stock (
+        id INTEGER PRIMARY KEY,
+        fy TEXT NOT NULL,
+        date TEXT NOT NULL,
+        delivered_to TEXT NOT NULL,
+        yarn_type TEXT NOT NULL,
+        qty_kg REAL NOT NULL
+    )
+    """)
+    cur.executescript(_period_lock_sql(
+        "purchases", "date", "date, firm_name, supplier, yarn_type, qty_kg, qty_rolls, price_per_unit, delivered_to"))
+    cur.executescript(_period_lock_sql(
+        "dyeing_outputs", "returned_date", "lot_id, dyeing_unit_id, returned_date, returned_qty_kg, returned_qty_rolls"))
+
+def fy_dates(start_year):
+    """(first day, last day) of the April-March financial year starting in start_year."""
+    return f"{start_year}-04-01", f"{start_year + 1}-03-31"
+
+def fy_label(start_year):
+    return f"{start_year}-{(start_year + 1) % 100:02d}"
+
+def _next_day(date: str) -> str:
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+def _archive_floor(cur):
+    """End date of the last closed financial year, or None."""
+    return cur.execute(f"SELECT {_CLOSED_FLOOR_SQL}").fetchone()[0]
+
+def _check_open_period(cur, *dates):
+    floor = _archive_floor(cur)
+    for date in dates:
+        if floor and date and date <= floor:
+            raise ValueError(f"{db_to_ui_date(date)} falls in a closed financial year "
+                             f"(closed up to {db_to_ui_date(floor)}).")
+
+def archive_path(file_name):
+    return os.path.join(os.path.dirname(get_db_path()), file_name)
+
+def list_fy_closings():
+    """Closed financial years, oldest first, as dicts (fy, start_date, end_date, file_name, counts, closed_at)."""
+    with get_connection() as conn:
+        rows = conn.execute("SELECT * FROM fy_closings WHERE status = 'closed' ORDER BY end_date").fetchall()
+    return [dict(r) for r in rows]
+
+def _archives_for(cur, from_date=None, to_date=None):
+    cur.execute("""
+        SELECT fy, file_name FROM fy_closings
+        WHERE status = 'closed' AND last_date >= ? AND first_date <= ?
+        ORDER BY end_date
+    """, (from_date or "", to_date or "9999-12-31"))
+    return [(r[0], r[1]) for r in cur.fetchall()]
+
+def archives_for(from_date=None, to_date=None):
+    """Labels of the closed years holding rows dated within the range."""
+    with get_connection() as conn:
+        return [fy for fy, _ in _archives_for(conn.cursor(), from_date, to_date)]
+
+def attach_archives(conn, from_date=None, to_date=None):
+    """
+    Make the archives holding rows dated from_date..to_date readable on conn
+    through the usual table names. Call before the connection writes
+    anything (ATTACH is not allowed inside a transaction) and do not write to
+    the archived tables on it afterwards. Returns the FY labels attached.
+    """
+    cur = conn.cursor()
+    attached = []
+    for fy, file_name in _archives_for(cur, from_date, to_date):
+        path = archive_path(file_name)
+        if not os.path.exists(path):
+            print(f"[DB] Archive {file_name} for FY {fy} is missing; its rows are left out.", file=sys.stderr)
+            continue
+        schema = f"fy_archive_{len(attached)}"
+        cur.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        attached.append((fy, schema))
+    if not attached:
+        return []
+    for table in _ARCHIVE_TABLES:
+        cols = [r["name"] for r in cur.execute(f"PRAGMA main.table_xinfo({table})").fetchall()]
+        arms = [f"SELECT {', '.join(cols)} FROM main.{table}"]
+        for _fy, schema in attached:
+            have = {r["name"] for r in cur.execute(f"PRAGMA {schema}.table_info({table})").fetchall()}
+            # Columns added after the archive was written read as NULL
+            arms.append(f"SELECT {', '.join(c if c in have else f'NULL AS {c}' for c in cols)} FROM {schema}.{table}")
+        cur.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(arms)}")
+    # An attached year's own rows replace its carried-forward balances
+    labels = ", ".join("'" + fy.replace("'", "''") + "'" for fy, _ in attached)
+    cur.execute(f"CREATE TEMP VIEW opening_stock AS SELECT * FROM main.opening_stock WHERE fy NOT IN ({labels})")
+    return [fy for fy, _ in attached]
+
+def _create_archive_table(cur, schema, table, indexes):
+    cols = cur.execute(f"PRAGMA main.table_xinfo({table})").fetchall()
+    # Generated columns are stored as plain values in the archive
+    defs = ", ".join(f"{c['name']} {c['type']}{' PRIMARY KEY' if c['pk'] else ''}" for c in cols)
+    cur.execute(f"CREATE TABLE {schema}.{table} ({defs})")
+    for index_cols in indexes:
+        cur.execute(f"CREATE INDEX {schema}.idx_{table}_{'_'.join(index_cols)} ON {table}({', '.join(index_cols)})")
+    return [c["name"] for c in cols]
+
+def _archive_year(cur, fy, start_date, end_date, file_name):
+    """Move the closed rows into the attached fy_archive schema. Returns the counts moved."""
+    cut, closed_month = end_date, end_date[:7]
+    # FIFO layers and month-end checkpoints must be current before their rows leave
+    _fifo_sync(cur)
+    _take_checkpoints(cur, closed_month)
+    # Registered first so the snapshot triggers keep checkpoints up to the cut
+    cur.execute("INSERT INTO fy_closings (fy, start_date, end_date, file_name) VALUES (?, ?, ?, ?)",
+                (fy, start_date, end_date, file_name))
+
+    params = {"cut": cut, "received": STATUSES.index("Received"),
+              "in_stock": ROLL_STATES.index("In Stock"), "reserved": ROLL_STATES.index("Reserved")}
+    cur.execute("CREATE TEMP TABLE fy_archive_batches (id INTEGER PRIMARY KEY, batch_ref TEXT)")
+    cur.execute("""
+        INSERT INTO temp.fy_archive_batches (id, batch_ref)
+        SELECT b.id, b.batch_ref FROM batches b
+        WHERE b.status_rank = :received
+          AND NOT EXISTS (SELECT 1 FROM purchases p WHERE p.batch_id = b.batch_ref AND p.date > :cut)
+          AND NOT EXISTS (SELECT 1 FROM lots l JOIN purchases p ON p.lot_no = l.lot_no
+                          WHERE l.batch_id = b.id AND p.date > :cut)
+          AND NOT EXISTS (SELECT 1 FROM lots l JOIN dyeing_outputs d ON d.lot_id = l.id
+                          WHERE l.batch_id = b.id AND d.returned_date > :cut)
+          AND NOT EXISTS (SELECT 1 FROM lots l JOIN rolls r ON r.lot_id = l.id
+                          WHERE l.batch_id = b.id AND r.state IN (:in_stock, :reserved))
+          AND NOT EXISTS (SELECT 1 FROM lots l JOIN finished_stock f ON f.lot_id = l.id WHERE l.batch_id = b.id)
+    """, params)
+    cur.execute("CREATE TEMP TABLE fy_archive_lots (id INTEGER PRIMARY KEY)")
+    cur.execute("INSERT INTO temp.fy_archive_lots SELECT id FROM lots WHERE batch_id IN (SELECT id FROM temp.fy_archive_batches)")
+    # A batch's purchases, and purchases no remaining batch or lot claims
+    cur.execute("CREATE TEMP TABLE fy_archive_purchases (id INTEGER PRIMARY KEY)")
+    cur.execute("""
+        INSERT INTO temp.fy_archive_purchases
+        SELECT id FROM purchases WHERE batch_id IN (SELECT batch_ref FROM temp.fy_archive_batches)
+        UNION
+        SELECT id FROM purchases
+        WHERE COALESCE(date, '') <= :cut
+          AND COALESCE(batch_id, '') NOT IN (SELECT batch_ref FROM batches WHERE batch_ref IS NOT NULL
+                                             AND id NOT IN (SELECT id FROM temp.fy_archive_batches))
+          AND COALESCE(lot_no, '') NOT IN (SELECT lot_no FROM lots WHERE lot_no IS NOT NULL
+                                           AND id NOT IN (SELECT id FROM temp.fy_archive_lots))
+    """, params)
+    cur.execute("CREATE TEMP TABLE fy_archive_dyeing (id INTEGER PRIMARY KEY)")
+    cur.execute("INSERT INTO temp.fy_archive_dyeing SELECT id FROM dyeing_outputs WHERE lot_id IN (SELECT id FROM temp.fy_archive_lots)")
+
+    # What the archived rows did to yarn stock stays on the books as opening balances
+    filters = {"purchase_filter": "AND p.id IN (SELECT id FROM temp.fy_archive_purchases)",
+               "dyeing_filter": "AND d.id IN (SELECT id FROM temp.fy_archive_dyeing)"}
+    opening = {}
+    for movement in _SOURCE_MOVEMENTS:
+        cur.execute(f"""
+            SELECT fabricator, yarn_type, SUM(CASE WHEN seq = 0 THEN qty_kg ELSE -qty_kg END)
+            FROM ({movement.format(**filters)})
+            GROUP BY fabricator, yarn_type
+        """)
+        for fabricator, yarn_type, qty_kg in cur:
+            opening[(fabricator, yarn_type)] = opening.get((fabricator, yarn_type), 0.0) + qty_kg
+    cur.executemany("INSERT INTO opening_stock (fy, date, delivered_to, yarn_type, qty_kg) VALUES (?, ?, ?, ?, ?)",
+                    [(fy, cut, k[0], k[1], kg) for k, kg in sorted(opening.items()) if abs(kg) > FIFO_EPSILON])
+
+    cur.execute(f"""
+        SELECT MIN(d), MAX(d) FROM (
+            SELECT date AS d FROM purchases WHERE {_ARCHIVE_TABLES["purchases"][0]}
+            UNION ALL SELECT returned_date FROM dyeing_outputs WHERE {_ARCHIVE_TABLES["dyeing_outputs"][0]}
+            UNION ALL SELECT substr(ts, 1, 10) FROM status_events WHERE {_ARCHIVE_TABLES["status_events"][0]}
+        ) WHERE d IS NOT NULL AND d != ''
+    """)
+    first_date, last_date = cur.fetchone()
+
+    counts = {}
+    for table, (where, indexes) in _ARCHIVE_TABLES.items():
+        cols = ", ".join(_create_archive_table(cur, "fy_archive", table, indexes))
+        cur.execute(f"INSERT INTO fy_archive.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE {where}")
+        counts[table] = cur.rowcount
+
+    # Closed months keep their totals, archived rows included
+    for rollup in ("purchase_rollup", "dyeing_rollup"):
+        cur.execute(f"CREATE TEMP TABLE fy_archive_{rollup} AS SELECT * FROM {rollup} WHERE month <= ?", (closed_month,))
+    for table, (where, _indexes) in reversed(_ARCHIVE_TABLES.items()):
+        cur.execute(f"DELETE FROM main.{table} WHERE {where}")
+    for rollup in ("purchase_rollup", "dyeing_rollup"):
+        cur.execute(f"DELETE FROM {rollup} WHERE month <= ?", (closed_month,))
+        cur.execute(f"INSERT INTO {rollup} SELECT * FROM temp.fy_archive_{rollup}")
+    # Layers up to the cut are final; the deletes only marked dates before it
+    cur.execute("DELETE FROM fifo_dirty")
+
+    cur.execute("""
+        UPDATE fy_closings SET first_date = ?, last_date = ?, batches = ?, lots = ?, purchases = ?,
+               dyeing_outputs = ?, rolls = ?, status = 'closed', closed_at = ?
+        WHERE fy = ?
+    """, (first_date, last_date, counts["batches"], counts["lots"], counts["purchases"], counts["dyeing_outputs"],
+          counts["rolls"], datetime.now().isoformat(timespec="seconds"), fy))
+    for name in ("batches", "lots", "purchases", "dyeing", "purchase_rollup", "dyeing_rollup"):
+        cur.execute(f"DROP TABLE temp.fy_archive_{name}")
+    return counts
+
+def close_financial_year(start_year, vacuum=True):
+    """
+    Close the April-March financial year starting in start_year: archive its
+    finished batches and unclaimed purchases to archive_<FY>.db, carry their
+    stock forward and lock the period. Returns a dict with the archive path,
+    the rows moved per table and the database size before and after.
+    """
+    fy = fy_label(start_year)
+    start_date, end_date = fy_dates(start_year)
+    if end_date >= datetime.now().strftime("%Y-%m-%d"):
+        raise ValueError(f"FY {fy} has not ended yet.")
+    file_name = f"{ARCHIVE_FILE_PREFIX}{fy}.db"
+    path = archive_path(file_name)
+    size_before = os.path.getsize(get_db_path())
     with get_connection() as conn:
         cur = conn.cursor()
-        # Yarn cost
-        cur.execute("SELECT SUM(price_per_unit * qty_kg) AS yarn_cost FROM purchases WHERE batch_id=?", (batch_id,))
-        yarn_cost = cur.fetchone()["yarn_cost"] or 0
+        floor = _archive_floor(cur)
+        if floor and end_date <= floor:
+            raise ValueError(f"FY {fy} is already closed (closed up to {db_to_ui_date(floor)}).")
+        if os.path.exists(path):
+            raise ValueError(f"Archive file already exists: {path}")
+        cur.execute("ATTACH DATABASE ? AS fy_archive", (path,))
+        try:
+            cur.execute("BEGIN")  # One transaction across the hot database and the archive
+            counts = _archive_year(cur, fy, start_date, end_date, file_name)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            cur.execute("DETACH DATABASE fy_archive")
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        cur.execute("DETACH DATABASE fy_archive")
+    if vacuum:
+        with get_connection() as conn:
+            conn.execute("VACUUM")
+    clear_query_cache()
+    print(f"[DB] Closed FY {fy}: archived {counts['batches']} batch(es), {counts['purchases']} purchase(s) "
+          f"and {counts['dyeing_outputs']} dyeing return(s) to {file_name}.")
+    return {"fy": fy, "path": path, "counts": counts,
+            "size_before": size_before, "size_after": os.path.getsize(get_db_path())}
 
-        # Knitting cost based on configurable rate
-        cur.execute("""
-            SELECT p.delivered_to, SUM(p.qty_kg) AS total_kg
-            FROM purchases p
-            WHERE p.batch_id=? AND p.delivered_to IN ('Shiv Fabrics')
-            GROUP BY p.delivered_to
-        """, (batch_id,))
-        knitting_row = cur.fetchone()
-        knitting_cost = (knitting_row["total_kg"] or 0) * COST_RATES["knitting"] if knitting_row else 0
-
-        # Dyeing cost based on configurable rate
-        cur.execute("""
-            SELECT SUM(d.returned_qty_kg) AS dyed_kg
-            FROM dyeing_outputs d
-            JOIN lots l ON d.lot_id = l.id
-            JOIN batches b ON l.batch_id = b.id
-            WHERE b.id=? AND d.dyeing_unit_id = (SELECT id FROM suppliers WHERE name='Oswal Finishing Mills' LIMIT 1)
-        """, (batch_id,))
-        dyeing_row = cur.fetchone()
-        dyeing_cost = (dyeing_row["dyed_kg"] or 0) * COST_RATES["dyeing"] if dyeing_row else 0
-
-        net_price = yarn_cost + knitting_cost + dyeing_cost
-    return net_price
+# ----------------------------
+# Database Maintenance
+# ----------------------------
+# Planner statistics and free space are looked after without user action:
+# - stale statistics refreshed when the app closes (optimize_db);
+# - ANALYZE of a table once its row count has moved by ANALYZE_CHANGE_RATIO
+#   since it was last analyzed (analyze_if_needed, counts kept in
+#   analyze_state). analysis_limit samples each index, so this stays in the
+#   milliseconds even on the roll and status-event tables;
+# - auto_vacuum=INCREMENTAL, enabled once by a migration, so pages freed by
+#   deletes and archiving can be handed back in VACUUM_STEP_PAGES steps while
+#   the app is idle (incremental_vacuum_step) instead of a full VACUUM. If
+#   the migration's VACUUM fails, startup carries on and it is retried when
+#   the app is next idle or started.
+# Every run is logged in memory with file stats before and after it.
+ANALYZE_CHANGE_RATIO = 0.25  # Re-analyze after the row count moves by 25%
+ANALYZE_MIN_CHANGE = 500     # ... and by at least this many rows
+ANALYSIS_LIMIT = 1000        # Index entries sampled by ANALYZE / optimize
+VACUUM_STEP_PAGES = 256      # Free pages returned per idle step (1 MB at 4 KB pages)
+MAINTENANCE_LOG_SIZE = 50
+
+# Tables whose size changes with day-to-day use; the masters stay small
+_MAINTENANCE_TABLES = ("purchases", "batches", "lots", "dyeing_outputs", "rolls", "status_events",
+                       "fifo_layers", "fifo_consumption", "customers", "finished_stock", "sales",
+                       "sale_allocations")
+_AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+_maintenance_log = deque(maxlen=MAINTENANCE_LOG_SIZE)  # Newest first
+_maintenance_lock = threading.Lock()
+
+_auto_vacuum_pending = False  # The switch failed at startup; retried when idle
+
+def _init_auto_vacuum(cur):
+    """
+    Switch the file to incremental auto-vacuum; must run outside a
+    transaction. Returns True once the mode is on. A failure (file locked by
+    another program, not enough disk for the copy VACUUM makes) is logged and
+    left for enable_incremental_vacuum() or the next start.
+    """
+    global _auto_vacuum_pending
+    if cur.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        _auto_vacuum_pending = False
+        return True
+    # The new mode only takes effect through a full VACUUM once tables exist
+    started = time.perf_counter()
+    try:
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cur.execute("VACUUM")
+    except sqlite3.Error as e:
+        _auto_vacuum_pending = True
+        print(f"[DB] Could not enable incremental auto-vacuum, will retry: {e}", file=sys.stderr)
+        return False
+    _auto_vacuum_pending = False
+    print(f"[DB] Enabled incremental auto-vacuum in {time.perf_counter() - started:.1f}s.")
+    return True
+
+def _init_maintenance(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS analyze_state (
+        tbl TEXT PRIMARY KEY,
+        row_count INTEGER NOT NULL,
+        analyzed_at TEXT NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+def db_file_stats():
+    """Return size, page and free-page counts of the database file."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+        page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = cur.execute("PRAGMA freelist_count").fetchone()[0]
+        mode = cur.execute("PRAGMA auto_vacuum").fetchone()[0]
+        analyzed_at = cur.execute("SELECT MAX(analyzed_at) FROM analyze_state").fetchone()[0]
+    return {
+        "size": os.path.getsize(get_db_path()),
+        "page_size": page_size,
+        "page_count": page_count,
+        "free_pages": free_pages,
+        "free_bytes": free_pages * page_size,
+        "auto_vacuum": _AUTO_VACUUM_MODES.get(mode, str(mode)),
+        "analyzed_at": analyzed_at,
+    }
+
+def _run_maintenance(action, work):
+    """Run work() with file stats and timing logged around it; work returns a detail string or None to skip logging."""
+    before = db_file_stats()
+    started = time.perf_counter()
+    detail = work()
+    ms = (time.perf_counter() - started) * 1000
+    if detail is None:
+        return None
+    after = db_file_stats()
+    entry = {"at": datetime.now().isoformat(timespec="seconds"), "action": action, "detail": detail,
+             "ms": ms, "before": before, "after": after}
+    with _maintenance_lock:
+        _maintenance_log.appendleft(entry)
+    print(f"[DB] {action}: {detail} in {ms:.0f} ms, {before['free_pages']} -> {after['free_pages']} free page(s).")
+    return entry
+
+def maintenance_log():
+    """Return the logged maintenance runs, newest first."""
+    with _maintenance_lock:
+        return list(_maintenance_log)
+
+def _tables_to_analyze(cur, force=False):
+    analyzed = {r["tbl"]: r["row_count"] for r in cur.execute("SELECT tbl, row_count FROM analyze_state")}
+    due = {}
+    for table in _MAINTENANCE_TABLES:
+        count = cur.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        last = analyzed.get(table)
+        if force or last is None or (abs(count - last) >= ANALYZE_MIN_CHANGE
+                                     and abs(count - last) >= ANALYZE_CHANGE_RATIO * last):
+            due[table] = count
+    return due
+
+def analyze_if_needed(force=False):
+    """ANALYZE the tables whose row counts moved enough since their last ANALYZE. Returns the tables analyzed."""
+    analyzed = []
+
+    def work():
+        with get_connection() as conn:
+            cur = conn.cursor()
+            due = _tables_to_analyze(cur, force)
+            if not due:
+                return None
+            cur.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            now = datetime.now().isoformat(timespec="seconds")
+            for table, count in due.items():
+                cur.execute(f"ANALYZE {table}")
+                cur.execute("INSERT OR REPLACE INTO analyze_state (tbl, row_count, analyzed_at) VALUES (?, ?, ?)",
+                            (table, count, now))
+            conn.commit()
+        analyzed.extend(due)
+        return ", ".join(f"{t} ({c:,} rows)" for t, c in due.items())
+
+    _run_maintenance("ANALYZE", work)
+    return analyzed
+
+def optimize_db():
+    """
+    Refresh stale planner statistics before the app closes. Returns what
+    was analyzed (empty when nothing was stale).
+
+    Plain PRAGMA optimize only acts on what the closing connection's own
+    queries flagged, which is nothing on a fresh connection. SQLite 3.46+
+    can be told to check every table (0x10000); older versions fall back to
+    analyze_if_needed(). Nothing is logged when nothing was stale.
+    """
+    if sqlite3.sqlite_version_info < (3, 46, 0):
+        return analyze_if_needed()
+    analyzed = []
+
+    def work():
+        with get_connection() as conn:
+            conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            # 0x01 lists what would be done without doing it
+            planned = [r[0] for r in conn.execute("PRAGMA optimize = 0x10003")]
+            if not planned:
+                return None
+            conn.execute("PRAGMA optimize = 0x10002")
+        analyzed.extend(planned)
+        return "; ".join(planned)
+
+    _run_maintenance("PRAGMA optimize", work)
+    return analyzed
+
+def incremental_vacuum_step(max_pages=VACUUM_STEP_PAGES):
+    """Return up to max_pages free pages to the file system. Returns the pages freed (0 when there were none)."""
+    freed = [0]
+
+    def work():
+        with get_connection() as conn:
+            cur = conn.cursor()
+            free = cur.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free or cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return None
+            # The pragma steps once per page released through zero-column rows, which
+            # execute() stops at after the first; executescript() runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+            freed[0] = free - cur.execute("PRAGMA freelist_count").fetchone()[0]
+        return f"{freed[0]:,} page(s) released"
+
+    _run_maintenance("Incremental vacuum", work)
+    return freed[0]
+
+def enable_incremental_vacuum():
+    """Retry the switch to incremental auto-vacuum if it failed at startup. Returns True when it is on."""
+    if not _auto_vacuum_pending:
+        return True
+    enabled = [False]
+
+    def work():
+        with get_connection() as conn:
+            enabled[0] = _init_auto_vacuum(conn.cursor())
+        return "incremental auto-vacuum enabled" if enabled[0] else None
+
+    _run_maintenance("VACUUM", work)
+    return enabled[0]
+
+def run_maintenance():
+    """Analyze what is due and release every free page now. Returns (tables analyzed, pages freed)."""
+    enable_incremental_vacuum()
+    return analyze_if_needed(), incremental_vacuum_step(max_pages=0)  # 0 = every free page
 
 # ----------------------------
 # Initialization on Import
@@ -0,0 +1,202 @@
+"""
+UI latency instrumentation: timed frame loaders and actions, and a watchdog
+for Tk event-loop stalls.
+
+Loaders and action handlers are decorated with @timed. The outermost timed
+call on the Tk thread is an action (e.g. EntriesFrame.save_purchase) and the
+timed calls it makes (reload_entries, build_tabs, ...) become its children.
+Every span splits its time into DB time, the statements timed by db on this
+thread (needs db.QUERY_TIMING), and widget time, the rest. After an action
+the time until Tk next reaches idle is recorded as paint time, which covers
+the geometry and redraw work the action queued.
+
+StallWatchdog keeps an after() heartbeat on the Tk thread. A helper thread
+notices when the heartbeat is late by STALL_MS or more and samples the Tk
+thread's stack while it is still stuck. When the heartbeat resumes, the stall
+is logged with those samples. A heartbeat during an action means it ran a
+nested event loop, normally a dialog waiting on the user, so the action is
+flagged and its time is not all latency.
+"""
+import functools
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from fabric_tracker_tk import db
+
+STALL_MS = 250             # Event-loop gaps at least this long are logged as stalls
+HEARTBEAT_MS = 50          # Interval of the Tk heartbeat the watchdog measures
+MAX_STACK_SAMPLES = 5      # Stack samples kept per stall (one per STALL_MS stuck)
+STACK_DEPTH = 25           # Innermost frames kept per sample
+ACTION_MIN_MS = 5          # Faster actions only count towards the loader stats
+ACTION_LOG_SIZE = 200
+STALL_LOG_SIZE = 100
+LOADER_SAMPLES = 256       # Recent durations kept per loader for percentiles
+
+_lock = threading.Lock()
+_actions = deque(maxlen=ACTION_LOG_SIZE)  # Newest first
+_stalls = deque(maxlen=STALL_LOG_SIZE)    # Newest first
+_loaders = {}  # qualified name -> [calls, total ms, db ms, max ms, recent ms]
+_open = []     # Spans open on the Tk thread, outermost first
+_tk_ident = threading.main_thread().ident
+_root = None
+
+def timed(func):
+    """Time a frame loader or UI action on the Tk thread; calls from other threads pass straight through."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if threading.get_ident() != _tk_ident:
+            return func(*args, **kwargs)
+        span = {"name": name, "total_ms": 0.0, "db_ms": 0.0, "widget_ms": 0.0, "children": []}
+        if _open:
+            _open[-1]["children"].append(span)
+        _open.append(span)
+        start = time.perf_counter()
+        db_start = db.thread_db_seconds()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            total_ms = (time.perf_counter() - start) * 1000
+            db_ms = (db.thread_db_seconds() - db_start) * 1000
+            span.update(total_ms=total_ms, db_ms=db_ms, widget_ms=max(total_ms - db_ms, 0.0))
+            _open.pop()
+            _record_loader(name, total_ms, db_ms)
+            if not _open:
+                _finish_action(span)
+    return wrapper
+
+def _record_loader(name, total_ms, db_ms):
+    with _lock:
+        stat = _loaders.get(name)
+        if stat is None:
+            stat = _loaders[name] = [0, 0.0, 0.0, 0.0, deque(maxlen=LOADER_SAMPLES)]
+        stat[0] += 1
+        stat[1] += total_ms
+        stat[2] += db_ms
+        stat[3] = max(stat[3], total_ms)
+        stat[4].append(total_ms)
+
+def _finish_action(span):
+    if span["total_ms"] < ACTION_MIN_MS:
+        return
+    span["at"] = datetime.fromtimestamp(time.time() - span["total_ms"] / 1000).isoformat(timespec="milliseconds")
+    span["paint_ms"] = None
+    with _lock:
+        _actions.appendleft(span)
+    if _root is not None:
+        ended = time.perf_counter()
+        try:
+            _root.after_idle(lambda: span.update(paint_ms=(time.perf_counter() - ended) * 1000))
+        except Exception:
+            pass  # Window already destroyed
+
+def current_action():
+    """Name of the action running on the Tk thread, if any."""
+    spans = _open[:1]
+    return spans[0]["name"] if spans else None
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def loader_stats():
+    """Per loader/action: [{'name', 'calls', 'total_ms', 'db_ms', 'widget_ms', 'p50_ms', 'p95_ms', 'max_ms'}], slowest total first."""
+    with _lock:
+        stats = [(name, s[:4], sorted(s[4])) for name, s in _loaders.items()]
+    result = [{"name": name, "calls": calls, "total_ms": total_ms, "db_ms": db_ms,
+               "widget_ms": max(total_ms - db_ms, 0.0), "p50_ms": _percentile(samples, 0.5),
+               "p95_ms": _percentile(samples, 0.95), "max_ms": max_ms}
+              for name, (calls, total_ms, db_ms, max_ms), samples in stats]
+    return sorted(result, key=lambda r: -r["total_ms"])
+
+def recent_actions():
+    with _lock:
+        return list(_actions)
+
+def recent_stalls():
+    with _lock:
+        return list(_stalls)
+
+def reset():
+    with _lock:
+        _actions.clear()
+        _stalls.clear()
+        _loaders.clear()
+
+def report():
+    """Everything collected so far, as plain data ready for json.dump."""
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "settings": {"stall_ms": STALL_MS, "heartbeat_ms": HEARTBEAT_MS, "query_timing": db.QUERY_TIMING,
+                     "slow_query_ms": db.SLOW_QUERY_MS},
+        "platform": {"python": sys.version.split()[0], "sqlite": db.sqlite3.sqlite_version, "os": sys.platform},
+        "actions": recent_actions(),
+        "stalls": recent_stalls(),
+        "loaders": loader_stats(),
+        "sql": db.query_timings()[:200],
+    }
+
+def export_json(path):
+    """Write report() to path; returns the path."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report(), f, indent=2)
+    return path
+
+class StallWatchdog:
+    """Logs Tk event-loop stalls of STALL_MS or more, with stack samples taken from a helper thread."""
+    def __init__(self, root, stall_ms=None):
+        global _root
+        _root = root
+        self.root = root
+        self.stall_ms = stall_ms or STALL_MS
+        self._beat = time.monotonic()
+        self._samples = []
+        self._stop = threading.Event()
+        self._job = root.after(HEARTBEAT_MS, self._heartbeat)
+        self._thread = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        now = time.monotonic()
+        late_ms = (now - self._beat) * 1000 - HEARTBEAT_MS
+        self._beat = now
+        with _lock:
+            samples, self._samples = self._samples, []
+        if _open:
+            _open[0]["nested_loop"] = True  # Events are being served inside an action: a dialog is up
+        if late_ms >= self.stall_ms:
+            stall = {"at": datetime.fromtimestamp(time.time() - late_ms / 1000).isoformat(timespec="milliseconds"),
+                     "ms": late_ms, "action": current_action() or (samples[0]["action"] if samples else None),
+                     "samples": samples}
+            with _lock:
+                _stalls.appendleft(stall)
+            print(f"[UI] Event loop stalled {late_ms:,.0f} ms"
+                  + (f" in {stall['action']}" if stall["action"] else "") + ".", file=sys.stderr)
+        self._job = self.root.after(HEARTBEAT_MS, self._heartbeat)
+
+    def _watch(self):
+        poll = min(self.stall_ms / 4, HEARTBEAT_MS) / 1000
+        while not self._stop.wait(poll):
+            stuck_ms = (time.monotonic() - self._beat) * 1000 - HEARTBEAT_MS
+            with _lock:
+                taken = len(self._samples)
+            if taken >= MAX_STACK_SAMPLES or stuck_ms < self.stall_ms * (taken + 1):
+                continue
+            frame = sys._current_frames().get(_tk_ident)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)[-STACK_DEPTH:]
+            del frame  # Holding it would keep the Tk thread's locals (open cursors) alive
+            with _lock:
+                self._samples.append({"after_ms": stuck_ms, "action": current_action(),
+                                      "stack": [line.rstrip() for line in stack]})
+
+    def stop(self):
+        self._stop.set()
+        if self._job:
+            self.root.after_cancel(self._job)
+            self._job = None
@@ -7,7 +7,16 @@ from fabric_tracker_tk.ui_entries import EntriesFrame
 from fabric_tracker_tk.ui_masters import MastersFrame
 from fabric_tracker_tk.ui_fabricators import FabricatorsFrame
 from fabric_tracker_tk.reports import ReportsFrame
+from fabric_tracker_tk.ui_search import SearchFrame
+from fabric_tracker_tk.ui_trace import TraceFrame
+from fabric_tracker_tk.ui_sales import SalesUI
+from fabric_tracker_tk.ui_customers import CustomersUI
+from fabric_tracker_tk.ui_stock import StockUI
+from fabric_tracker_tk.ui_purchases import PurchasesUI
+from fabric_tracker_tk.ui_diagnostics import DiagnosticsFrame
 from fabric_tracker_tk.backup_restore import BackupRestoreFrame  # import the backup/restore UI
+from fabric_tracker_tk.maintenance import MaintenanceScheduler
+from fabric_tracker_tk.latency import StallWatchdog, timed
 
 class FabricTrackerApp(tk.Tk):
     def __init__(self):
@@ -40,16 +49,62 @@ class FabricTrackerApp(tk.Tk):
         self.fabricators_frame = FabricatorsFrame(self.notebook, controller=self)
         self.masters_frame = MastersFrame(self.notebook, controller=self, on_change_callback=self.on_master_change)
         self.reports_frame = ReportsFrame(self.notebook, self)
+        self.search_frame = SearchFrame(self.notebook, self)
+        self.trace_frame = TraceFrame(self.notebook, self)
+        self.diagnostics_frame = DiagnosticsFrame(self.notebook, self)
         self.backup_frame = BackupRestoreFrame(self.notebook, controller=self)  # create backup/restore tab
+        # Sales / dispatch screens build themselves inside a plain frame
+        self.sales_frame, self.customers_frame, self.stock_frame, self.purchases_frame = (
+            ttk.Frame(self.notebook) for _ in range(4))
+        self.sales_ui = SalesUI(self.sales_frame)
+        self.customers_ui = CustomersUI(self.customers_frame)
+        self.stock_ui = StockUI(self.stock_frame)
+        self.purchases_ui = PurchasesUI(self.purchases_frame)
 
         # Add to notebook
         self.notebook.add(self.entries_frame, text="Entries")
         self.notebook.add(self.dashboard_frame, text="Dashboard")
         self.notebook.add(self.fabricators_frame, text="Fabricators")
+        self.notebook.add(self.sales_frame, text="Sales")
+        self.notebook.add(self.customers_frame, text="Customers")
+        self.notebook.add(self.stock_frame, text="Finished Stock")
+        self.notebook.add(self.purchases_frame, text="Purchase Ledger")
         self.notebook.add(self.masters_frame, text="Masters")
         self.notebook.add(self.reports_frame, text="Reports")
+        self.notebook.add(self.search_frame, text="Search")
+        self.notebook.add(self.trace_frame, text="Trace")
         self.notebook.add(self.backup_frame, text="Backup & Restore")  # add the new tab
+        self.notebook.add(self.diagnostics_frame, text="Diagnostics")
 
+        # ANALYZE and free-page release while nobody is using the app
+        self.maintenance = MaintenanceScheduler(self)
+        # Event-loop stalls are logged with stack samples (Diagnostics tab)
+        self.watchdog = StallWatchdog(self)
+
+    def on_close(self):
+        """Reconcile yarn stock, checkpoint, optimize and back up before exiting; none may block closing."""
+        self.maintenance.stop()
+        self.watchdog.stop()
+        try:
+            drift = db.reconcile_yarn_stock(fix=True)
+            if drift:
+                print(f"[DB] Stock reconciliation corrected {len(drift)} yarn balance(s).")
+        except Exception as e:
+            print(f"[DB] Stock reconciliation failed: {e}", file=sys.stderr)
+        try:
+            taken = db.take_checkpoints()
+            if taken:
+                print(f"[DB] Took {taken} month-end stock/WIP checkpoint(s).")
+        except Exception as e:
+            print(f"[DB] Checkpointing failed: {e}", file=sys.stderr)
+        try:
+            db.optimize_db()
+        except Exception as e:
+            print(f"[DB] Optimize failed: {e}", file=sys.stderr)
+        db.backup_db()
+        self.destroy()
+
+    @timed
     def on_master_change(self):
         """Callback when Masters data changes, refreshes Entries and Fabricators."""
         try:
@@ -59,88 +114,10 @@ class FabricTrackerApp(tk.Tk):
         except Exception as e:
             print("Error on master change:", e)
 
+    @timed
     def update_all_statuses(self):
         """Trigger status updates across all tabs."""
-        with db.get_connection() as conn:
-            cur = conn.cursor()
-            # Update statuses based on transactions
-            cur.execute("""
-                UPDATE batches
-                SET status='Knitted'
-                WHERE id IN (
-                    SELECT DISTINCT b.id
-                    FROM batches b
-                    JOIN purchases p ON b.batch_ref = p.batch_id
-                    JOIN suppliers s ON s.name = p.delivered_to AND s.type = 'knitting_unit'
-                )
-            """)
-            cur.execute("""
-                UPDATE lots
-                SET status='Knitted'
-                WHERE batch_id IN (
-                    SELECT DISTINCT b.id
-                    FROM batches b
-                    JOIN purchases p ON b.batch_id = p.batch_id
-                    JOIN suppliers s ON s.name = p.delivered_to AND s.type = 'knitting_unit'
-                )
-            """)
-            cur.execute("""
-                UPDATE batches
-                SET status='Dyed'
-                WHERE id IN (
-                    SELECT DISTINCT b.id
-                    FROM batches b
-                    JOIN lots l ON b.id = l.batch_id
-                    JOIN dyeing_outputs d ON l.id = d.lot_id
-                    WHERE d.returned_qty_kg > 0
-                )
-            """)
-            cur.execute("""
-                UPDATE lots
-                SET status='Dyed'
-                WHERE id IN (
-                    SELECT DISTINCT l.id
-                    FROM lots l
-                    JOIN dyeing_outputs d ON l.id = d.lot_id
-                    WHERE d.returned_qty_kg > 0
-                )
-            """)
-            cur.execute("""
-                UPDATE batches
-                SET status='Received'
-                WHERE id IN (
-                    SELECT DISTINCT b.id
-                    FROM batches b
-                    JOIN lots l ON b.id = l.batch_id
-                    JOIN dyeing_outputs d ON l.id = d.lot_id
-                    WHERE d.returned_qty_kg >= 0.9 * l.weight_kg
-                )
-            """)
-            cur.execute("""
-                UPDATE lots
-                SET status='Received'
-                WHERE id IN (
-                    SELECT DISTINCT l.id
-                    FROM lots l
-                    JOIN dyeing_outputs d ON l.id = d.lot_id
-                    WHERE d.returned_qty_kg >= 0.9 * l.weight_kg
-                )
-            """)
-            # Set "Ordered" for lots/batches with purchases but no further processing
-            cur.execute("""
-                UPDATE lots
-                SET status='Ordered'
-                WHERE batch_id IN (
-                    SELECT id FROM batches WHERE id IN (SELECT DISTINCT batch_id FROM purchases)
-                ) AND status NOT IN ('Knitted', 'Dyed', 'Received')
-            """)
-            cur.execute("""
-                UPDATE batches
-                SET status='Ordered'
-                WHERE id IN (SELECT DISTINCT batch_id FROM purchases)
-                AND status NOT IN ('Knitted', 'Dyed', 'Received')
-            """)
-            conn.commit()
+        db.refresh_statuses()
 
         # Reload all affected frames
         self.entries_frame.reload_entries()
@@ -149,11 +126,17 @@ class FabricTrackerApp(tk.Tk):
         if hasattr(self.reports_frame, "reload_data"):
             self.reports_frame.reload_data()
 
+    def show_trace(self, ref):
+        """Open the Trace tab for a lot number or batch ref."""
+        self.notebook.select(self.trace_frame)
+        self.trace_frame.trace(ref)
+
     def open_dyeing_tab_for_batch(self, dyeer_name, batch_ref):
         """Proxy to fabricators frame."""
         if hasattr(self.fabricators_frame, "open_dyeing_tab_for_batch"):
             self.fabricators_frame.open_dyeing_tab_for_batch(dyeer_name, batch_ref)
 
+    @timed
     def on_purchase_recorded(self, batch_id, lot_no, delivered_to):
         """Callback for purchase recording."""
         if batch_id and delivered_to:
@@ -175,6 +158,7 @@ class FabricTrackerApp(tk.Tk):
         self.update_all_statuses()
         self.entries_frame.refresh_lists_callback()  # Refresh lists after purchase
 
+    @timed
     def on_dyeing_output_recorded(self, lot_id):
         """Callback for dyeing output recording."""
         if lot_id:
@@ -199,5 +183,5 @@ class FabricTrackerApp(tk.Tk):
 
 if __name__ == "__main__":
     app = FabricTrackerApp()
-    app.protocol("WM_DELETE_WINDOW", lambda: [db.backup_db(), app.destroy()])  # Auto-backup on close
+    app.protocol("WM_DELETE_WINDOW", app.on_close)  # Reconcile stock and auto-backup on close
     app.mainloop()
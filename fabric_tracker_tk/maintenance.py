@@ -0,0 +1,55 @@
+"""Background database maintenance for the Tk app: startup integrity check, ANALYZE and incremental vacuum."""
+import sys
+import time
+from fabric_tracker_tk import db
+
+MAINTENANCE_TICK_MS = 5000        # How often the scheduler checks for idle time
+MAINTENANCE_IDLE_SECONDS = 60     # No key or mouse input for this long counts as idle
+INTEGRITY_CHECK_DELAY_MS = 10000  # Let the first screens load before reading the whole file
+
+class MaintenanceScheduler:
+    """
+    Runs db maintenance in small steps while the user is idle: once per idle
+    spell the row counts are checked for a due ANALYZE, then each tick
+    releases up to db.VACUUM_STEP_PAGES free pages until none are left.
+    Steps run on the Tk thread between events and take milliseconds. Shortly
+    after startup the database and any backups not yet verified are queued for
+    a quick_check on the checker thread.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.last_input = time.monotonic()
+        self.checked_analyze = False
+        for sequence in ("<Any-KeyPress>", "<Any-ButtonPress>", "<MouseWheel>"):
+            root.bind_all(sequence, self._on_input, add="+")
+        self._job = root.after(MAINTENANCE_TICK_MS, self._tick)
+        root.after(INTEGRITY_CHECK_DELAY_MS, self._queue_integrity_checks)
+
+    def _queue_integrity_checks(self):
+        try:
+            db.queue_unchecked_backups()  # Includes the backup made as the app last closed
+        except OSError as e:
+            print(f"[DB] Could not list backups to check: {e}", file=sys.stderr)
+        db.queue_integrity_check()
+
+    def _on_input(self, _event=None):
+        self.last_input = time.monotonic()
+        self.checked_analyze = False  # New activity may have changed row counts
+
+    def _tick(self):
+        try:
+            if time.monotonic() - self.last_input >= MAINTENANCE_IDLE_SECONDS:
+                if not self.checked_analyze:
+                    self.checked_analyze = True
+                    db.enable_incremental_vacuum()  # No-op unless it failed at startup
+                    db.analyze_if_needed()
+                else:
+                    db.incremental_vacuum_step()
+        except Exception as e:
+            print(f"[DB] Idle maintenance failed: {e}", file=sys.stderr)
+        self._job = self.root.after(MAINTENANCE_TICK_MS, self._tick)
+
+    def stop(self):
+        if self._job:
+            self.root.after_cancel(self._job)
+            self._job = None
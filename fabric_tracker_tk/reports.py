@@ -1,13 +1,365 @@
+import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
+from array import array
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, NamedStyle
 from fabric_tracker_tk import db
+from fabric_tracker_tk import costing
+from fabric_tracker_tk.latency import timed
 from datetime import datetime
 
 COLS       = ("firm", "date", "batch", "supplier", "yarn", "kg", "rolls", "delivered")
 HEADINGS   = ["Firm", "Date", "Batch", "Supplier", "Yarn", "Kg", "Rolls", "Delivered To"]
 WIDTHS     = [140, 90, 90, 150, 150, 80, 80, 140]
+SUMMARY_COLS     = ("firm", "month", "entries", "kg", "rolls", "value")
+SUMMARY_HEADINGS = ["Firm", "Month", "Entries", "Kg", "Rolls", "Value"]
+SUMMARY_WIDTHS   = [140, 90, 80, 110, 90, 120]
+COSTING_HEADINGS = ["Batch", "Firm", "First Purchase", "Yarn Kg", "Yarn Cost", "Knitted Kg",
+                    "Knitting Cost", "Dyed Kg", "Dyeing Cost", "Net Cost", "Cost / Kg"]
+COSTING_WIDTHS   = [100, 140, 95, 80, 95, 85, 95, 80, 95, 100, 80]
+STOCK_COLS     = ("fabricator", "yarn", "kg")
+STOCK_HEADINGS = ["Fabricator", "Yarn", "Kg"]
+STOCK_WIDTHS   = [180, 180, 110]
+WIP_COLS     = ("batch", "lot", "firm", "fabricator", "issued", "returned", "status")
+WIP_HEADINGS = ["Batch", "Lot", "Firm", "Fabricator", "Yarn Issued Kg", "Returned Kg", "Status"]
+WIP_WIDTHS   = [90, 110, 140, 150, 110, 100, 80]
+LEAD_COLS     = ("month", "stage", "unit", "lots", "avg", "p50", "p90", "max")
+LEAD_HEADINGS = ["Month", "Stage", "Unit", "Lots", "Avg Days", "Median Days", "90th % Days", "Max Days"]
+LEAD_WIDTHS   = [80, 160, 150, 60, 80, 90, 90, 80]
+ROLL_COLS     = ("batch", "state", "location", "rolls", "kg")
+ROLL_HEADINGS = ["Batch", "State", "Location", "Rolls", "Kg"]
+ROLL_WIDTHS   = [100, 100, 160, 80, 110]
+VIEW_OPTIONS = ["Detail", "Monthly Summary", "Batch Costing", "Stock at FY End", "WIP at FY End", "Lead Times",
+                "Finished Rolls"]
+REPORT_CACHE_SIZE = 4  # FY results kept in memory
+EXPORT_WIDTHS = [24, 12, 14, 20, 20, 10, 10, 20]
+EXPORT_FETCH_SIZE = 2000  # Rows pulled from the cursor per fetchmany()
+EXPORT_POLL_MS = 200  # How often the Reports tab refreshes job progress
+FIRM_FILLS = {
+    db.FIRMS[0]: "D6EAF8",   # blue tint
+    db.FIRMS[1]: "FEF9E7",   # amber tint
+}
+
+class ReportData:
+    """
+    Purchase rows for one FY in columnar form, ordered by firm then date.
+    Each firm's rows are a contiguous slice, so screen, export and totals can
+    partition the single fetch in memory instead of querying per firm.
+    """
+    def __init__(self, cursor):
+        self.firm, self.date, self.batch = [], [], []
+        self.supplier, self.yarn, self.delivered = [], [], []
+        self.kg = array("d")
+        self.rolls = array("q")
+        self.slices = {}   # firm -> (start, stop)
+        self._totals = {}  # firm -> (count, kg, rolls); None key = all firms
+        for row in cursor:
+            firm = row[0]
+            if not self.firm or self.firm[-1] != firm:
+                self.slices[firm] = (len(self.firm), len(self.firm))
+            self.firm.append(firm)
+            self.date.append(row[1])
+            self.batch.append(row[2])
+            self.supplier.append(row[3])
+            self.yarn.append(row[4])
+            self.kg.append(row[5] or 0)
+            self.rolls.append(row[6] or 0)
+            self.delivered.append(row[7])
+            self.slices[firm] = (self.slices[firm][0], len(self.firm))
+        for firm, (start, stop) in self.slices.items():
+            self._totals[firm] = (stop - start, sum(self.kg[start:stop]), sum(self.rolls[start:stop]))
+        self._totals[None] = (len(self.firm), sum(self.kg), sum(self.rolls))
+
+    def __len__(self):
+        return len(self.firm)
+
+    def _range(self, firm=None):
+        if firm is None:
+            return range(len(self.firm))
+        return range(*self.slices.get(firm, (0, 0)))
+
+    def rows(self, firm=None):
+        """Yield (firm, date, batch, supplier, yarn, kg, rolls, delivered) tuples."""
+        for i in self._range(firm):
+            yield (self.firm[i], self.date[i], self.batch[i], self.supplier[i],
+                   self.yarn[i], self.kg[i], self.rolls[i], self.delivered[i])
+
+    def totals(self, firm=None):
+        """Return (record count, total kg, total rolls) for a firm or all firms."""
+        return self._totals.get(firm, (0, 0.0, 0))
+
+_report_cache = {}  # (fy_start, fy_end) -> (data_version, ReportData)
+
+def fetch_report_data(fy_start, fy_end):
+    """Fetch the FY once; reuse it until the database changes."""
+    key = (fy_start, fy_end)
+    version = db.get_data_version()
+    cached = _report_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    with db.get_connection() as conn:
+        db.attach_archives(conn, fy_start, fy_end)
+        cur = conn.execute("""
+            SELECT COALESCE(firm_name, '') AS firm, date, batch_id, supplier, yarn_type,
+                   qty_kg, qty_rolls, delivered_to
+            FROM purchases
+            WHERE date >= ? AND date <= ?
+            ORDER BY firm, date
+        """, (fy_start, fy_end))
+        data = ReportData(cur)
+    _report_cache.pop(key, None)
+    _report_cache[key] = (version, data)
+    while len(_report_cache) > REPORT_CACHE_SIZE:
+        _report_cache.pop(next(iter(_report_cache)))
+    return data
+
+def peek_report_data(fy_start, fy_end):
+    """Return the cached FY result if it is still current, else None."""
+    cached = _report_cache.get((fy_start, fy_end))
+    if cached and cached[0] == db.get_data_version():
+        return cached[1]
+    return None
+
+def stream_report_rows(fy_start, fy_end, firm_name=None):
+    """Yield FY purchase rows (ordered by firm, date) straight from the cursor."""
+    sql = """
+        SELECT COALESCE(firm_name, '') AS firm, date, batch_id, supplier, yarn_type,
+               qty_kg, qty_rolls, delivered_to
+        FROM purchases
+        WHERE date >= ? AND date <= ?
+    """
+    params = (fy_start, fy_end)
+    if firm_name:
+        sql += " AND firm_name = ?"
+        params += (firm_name,)
+    with db.get_connection() as conn:
+        db.attach_archives(conn, fy_start, fy_end)
+        cur = conn.execute(sql + " ORDER BY firm, date", params)
+        while True:
+            chunk = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not chunk:
+                break
+            for row in chunk:
+                yield tuple(row)
+
+def _export_date(d):
+    """YYYY-MM-DD -> DD/MM/YYYY without a strptime per row."""
+    if d and len(d) == 10 and d[4] == "-" and d[7] == "-":
+        return f"{d[8:10]}/{d[5:7]}/{d[0:4]}"
+    return db.db_to_ui_date(d) if d else ""
+
+def _register_export_styles(wb):
+    """Create the named styles once per workbook; returns firm -> row style name."""
+    wb.add_named_style(NamedStyle(
+        name="report_header",
+        font=Font(bold=True, color="FFFFFF"),
+        fill=PatternFill("solid", fgColor="2E4057"),
+        alignment=Alignment(horizontal="center"),
+    ))
+    wb.add_named_style(NamedStyle(name="report_total", font=Font(bold=True)))
+    wb.add_named_style(NamedStyle(name="report_row", fill=PatternFill("solid", fgColor="FFFFFF")))
+    row_styles = {}
+    for i, (firm, colour) in enumerate(FIRM_FILLS.items()):
+        name = f"report_row_{i}"
+        wb.add_named_style(NamedStyle(name=name, fill=PatternFill("solid", fgColor=colour)))
+        row_styles[firm] = name
+    return row_styles
+
+class ExportCancelled(Exception):
+    """Raised inside an export when its job has been cancelled."""
+
+def write_report_workbook(file_path, rows, firms, combined=True, progress=None, cancel=None):
+    """
+    Stream rows into a write-only workbook in one pass: one sheet per firm in
+    firms, plus a Combined sheet. Memory use does not grow with the row count.
+    progress(rows_written, sheets_done) is called every EXPORT_FETCH_SIZE rows;
+    if the cancel event is set the export stops with ExportCancelled.
+    Returns the number of data rows written per sheet.
+    """
+    wb = Workbook(write_only=True)
+    row_styles = _register_export_styles(wb)
+
+    sheets = {}  # sheet key (firm or None for Combined) -> worksheet
+    for firm in firms:
+        sheets[firm] = wb.create_sheet(title=firm[:28])
+    if combined:
+        sheets[None] = wb.create_sheet(title="Combined")
+
+    def styled(ws, value, style):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style
+        return cell
+
+    counts = {}
+    for key, ws in sheets.items():
+        for col, w in zip("ABCDEFGH", EXPORT_WIDTHS):
+            ws.column_dimensions[col].width = w
+        ws.append([styled(ws, h, "report_header") for h in HEADINGS])
+        counts[key] = 0
+
+    written = 0
+    sheets_done = 0
+    current_firm = ""
+    try:
+        for firm, date, batch, supplier, yarn, kg, rolls, delivered in rows:
+            if firm != current_firm:
+                # Rows arrive ordered by firm, so the previous firm's sheet is complete
+                if current_firm and current_firm in sheets:
+                    sheets_done += 1
+                current_firm = firm
+            values = (firm, _export_date(date), batch, supplier, yarn, kg, rolls, delivered)
+            style = row_styles.get(firm, "report_row")
+            for key in (firm, None):
+                ws = sheets.get(key)
+                if ws is None:
+                    continue
+                ws.append([styled(ws, v, style) for v in values])
+                counts[key] += 1
+            written += 1
+            if written % EXPORT_FETCH_SIZE == 0:
+                if cancel is not None and cancel.is_set():
+                    raise ExportCancelled()
+                if progress:
+                    progress(written, sheets_done)
+
+        if cancel is not None and cancel.is_set():
+            raise ExportCancelled()
+    except ExportCancelled:
+        # Finish each sheet's stream so openpyxl can drop its temp files quietly
+        for ws in sheets.values():
+            ws.close()
+        raise
+
+    for key, ws in sheets.items():
+        last = counts[key] + 1
+        ws.append([styled(ws, v, "report_total") for v in
+                   ("", "TOTAL", "", "", "", f"=SUM(F2:F{last})", f"=SUM(G2:G{last})", "")])
+    wb.save(file_path)
+    if progress:
+        progress(written, len(sheets))
+    return counts
+
+# ----------------------------------------------------------------------
+# Background export jobs
+# ----------------------------------------------------------------------
+class ExportJob:
+    """One queued export. The worker thread updates the progress fields; the
+    Tk thread only reads them."""
+    _next_id = 1
+
+    def __init__(self, file_path, fy_start, fy_end, firm_filter, label, data=None):
+        self.id = ExportJob._next_id
+        ExportJob._next_id += 1
+        self.file_path = file_path
+        self.fy_start, self.fy_end = fy_start, fy_end
+        self.firm_filter = firm_filter
+        self.label = label
+        self.data = data  # cached ReportData to reuse, if current when queued
+        self.firms = [firm_filter] if firm_filter else list(db.FIRMS)
+        self.total_sheets = len(self.firms) + (0 if firm_filter else 1)
+        self.total_rows = data.totals(firm_filter)[0] if data else None
+        self.rows_written = 0
+        self.sheets_done = 0
+        self.status = "Queued"  # Queued, Running, Done, Cancelled, Failed
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("Done", "Cancelled", "Failed")
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.status == "Queued":
+            self.status = "Cancelled"
+
+    def _progress(self, rows_written, sheets_done):
+        self.rows_written = rows_written
+        self.sheets_done = sheets_done
+
+    def _count_rows(self):
+        sql = "SELECT COUNT(*) FROM purchases WHERE date >= ? AND date <= ?"
+        params = (self.fy_start, self.fy_end)
+        if self.firm_filter:
+            sql += " AND firm_name = ?"
+            params += (self.firm_filter,)
+        with db.get_connection() as conn:
+            db.attach_archives(conn, self.fy_start, self.fy_end)
+            return conn.execute(sql, params).fetchone()[0]
+
+    def run(self):
+        if self.cancel_event.is_set():
+            self.status = "Cancelled"
+            return
+        self.status = "Running"
+        # Write next to the target and swap in on success, so a cancelled or
+        # failed export never leaves a half-written file behind.
+        tmp_path = self.file_path + ".part"
+        try:
+            if self.total_rows is None:
+                self.total_rows = self._count_rows()
+            if self.data is not None:
+                rows = self.data.rows(self.firm_filter)
+            else:
+                rows = stream_report_rows(self.fy_start, self.fy_end, self.firm_filter)
+            write_report_workbook(tmp_path, rows, self.firms,
+                                  combined=self.firm_filter is None,
+                                  progress=self._progress, cancel=self.cancel_event)
+            os.replace(tmp_path, self.file_path)
+            self.status = "Done"
+        except ExportCancelled:
+            self.status = "Cancelled"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "Failed"
+        finally:
+            self.data = None
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+class ExportQueue:
+    """Runs export jobs one at a time on a daemon worker thread."""
+    def __init__(self):
+        self.jobs = []
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        self.jobs.append(job)
+        self._queue.put(job)
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="report-export", daemon=True)
+                self._worker.start()
+        return job
+
+    def _run(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=5)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+            job.run()
+
+    def active(self):
+        return [j for j in self.jobs if not j.finished]
+
+    def clear_finished(self):
+        self.jobs = [j for j in self.jobs if not j.finished]
+
+export_queue = ExportQueue()
 
 class ReportsFrame(ttk.Frame):
     def __init__(self, parent, controller=None):
@@ -33,14 +385,40 @@ class ReportsFrame(ttk.Frame):
                                     values=firm_options, state="readonly", width=22)
         self.firm_cb.grid(row=0, column=3, padx=4)
 
+        # --- View ---
+        ttk.Label(top, text="View:").grid(row=0, column=4, sticky="w", padx=(12, 4))
+        self._view_var = tk.StringVar(value=VIEW_OPTIONS[0])
+        ttk.Combobox(top, textvariable=self._view_var, values=VIEW_OPTIONS,
+                     state="readonly", width=16).grid(row=0, column=5, padx=4)
+
         # --- Buttons ---
-        ttk.Button(top, text="Apply", command=self.load_report).grid(row=0, column=4, padx=6)
-        ttk.Button(top, text="Export to Excel", command=self.export_report).grid(row=0, column=5, padx=4)
+        ttk.Button(top, text="Apply", command=self.load_report).grid(row=0, column=6, padx=6)
+        ttk.Button(top, text="Export to Excel", command=self.export_report).grid(row=0, column=7, padx=4)
+        ttk.Button(top, text="Rate Cards...", command=self.edit_rate_cards).grid(row=0, column=8, padx=4)
+        self._costing_sort = ("net_cost", True)  # (column, descending)
 
         # --- Summary bar ---
         self._summary_var = tk.StringVar(value="")
         ttk.Label(self, textvariable=self._summary_var, foreground="gray").pack(anchor="w", padx=8)
 
+        # --- Export jobs (packed first so the table takes the remaining space) ---
+        jobs = ttk.LabelFrame(self, text="Export Jobs")
+        jobs.pack(side="bottom", fill="x", padx=6, pady=4)
+        job_cols = ("file", "scope", "status", "progress")
+        self.jobs_tree = ttk.Treeview(jobs, columns=job_cols, show="headings", height=4)
+        for c, h, w in zip(job_cols, ["File", "Scope", "Status", "Progress"], [320, 200, 90, 220]):
+            self.jobs_tree.heading(c, text=h)
+            self.jobs_tree.column(c, width=w)
+        self.jobs_tree.pack(side="left", fill="x", expand=True, padx=4, pady=4)
+        job_btns = ttk.Frame(jobs)
+        job_btns.pack(side="right", fill="y", padx=4, pady=4)
+        self.job_progress = ttk.Progressbar(job_btns, length=160, mode="determinate")
+        self.job_progress.pack(pady=2)
+        ttk.Button(job_btns, text="Cancel", command=self.cancel_export).pack(fill="x", pady=2)
+        ttk.Button(job_btns, text="Clear Finished", command=self.clear_finished_jobs).pack(fill="x", pady=2)
+        self._notified_jobs = set()
+        self._poll_pending = None
+
         # --- Table ---
         frame = ttk.Frame(self)
         frame.pack(fill="both", expand=True, padx=6, pady=4)
@@ -53,9 +431,7 @@ class ReportsFrame(ttk.Frame):
         self.tree.pack(fill="both", expand=True)
         sy.config(command=self.tree.yview)
         sx.config(command=self.tree.xview)
-        for c, h, w in zip(COLS, HEADINGS, WIDTHS):
-            self.tree.heading(c, text=h)
-            self.tree.column(c, width=w)
+        self._set_columns(COLS, HEADINGS, WIDTHS)
 
         # Tag rows by firm for colour coding
         self.tree.tag_configure(db.FIRMS[0], background="#e8f4fd")   # light blue — SP
@@ -74,55 +450,209 @@ class ReportsFrame(ttk.Frame):
         start_year = int(self.fy_start.get())
         return f"{start_year}-04-01", f"{start_year + 1}-03-31"
 
-    def _fetch_rows(self, firm_name=None):
-        """Return purchase rows for the selected FY, optionally filtered by firm."""
+    def _fetch_data(self):
+        """Return the cached columnar purchase rows for the selected FY."""
         fy_start, fy_end = self._fy_dates()
-        with db.get_connection() as conn:
-            cur = conn.cursor()
-            if firm_name:
-                cur.execute("""
-                    SELECT firm_name, date, batch_id, supplier, yarn_type,
-                           qty_kg, qty_rolls, delivered_to
-                    FROM purchases
-                    WHERE date >= ? AND date <= ? AND firm_name = ?
-                    ORDER BY firm_name, date
-                """, (fy_start, fy_end, firm_name))
-            else:
-                cur.execute("""
-                    SELECT firm_name, date, batch_id, supplier, yarn_type,
-                           qty_kg, qty_rolls, delivered_to
-                    FROM purchases
-                    WHERE date >= ? AND date <= ?
-                    ORDER BY firm_name, date
-                """, (fy_start, fy_end))
-            return cur.fetchall()
+        return fetch_report_data(fy_start, fy_end)
 
+    def _set_columns(self, cols, headings, widths, on_sort=None):
+        self.tree["columns"] = cols
+        for c, h, w in zip(cols, headings, widths):
+            command = (lambda col=c: on_sort(col)) if on_sort else ""
+            self.tree.heading(c, text=h, command=command)
+            self.tree.column(c, width=w)
+
+    @timed
     def load_report(self):
         for r in self.tree.get_children():
             self.tree.delete(r)
 
         selected = self._firm_var.get()
         firm_filter = None if selected == "Both (Combined)" else selected
-        rows = self._fetch_rows(firm_filter)
-
-        total_kg = 0
-        total_rolls = 0
-        for row in rows:
-            display_date = db.db_to_ui_date(row["date"])
-            firm = row["firm_name"] or ""
-            kg = row["qty_kg"] or 0
-            rolls = row["qty_rolls"] or 0
-            total_kg += kg
-            total_rolls += rolls
+        if self._view_var.get() == "Monthly Summary":
+            self._load_monthly_summary(firm_filter)
+            return
+        if self._view_var.get() == "Batch Costing":
+            self._load_batch_costing(firm_filter)
+            return
+        if self._view_var.get() == "Stock at FY End":
+            self._load_stock_as_of()
+            return
+        if self._view_var.get() == "WIP at FY End":
+            self._load_wip_as_of(firm_filter)
+            return
+        if self._view_var.get() == "Lead Times":
+            self._load_lead_times(firm_filter)
+            return
+        if self._view_var.get() == "Finished Rolls":
+            self._load_rolls(firm_filter)
+            return
+        self._set_columns(COLS, HEADINGS, WIDTHS)
+        data = self._fetch_data()
+
+        for firm, date, batch, supplier, yarn, kg, rolls, delivered in data.rows(firm_filter):
             self.tree.insert("", "end", values=(
-                firm, display_date, row["batch_id"], row["supplier"],
-                row["yarn_type"], kg, rolls, row["delivered_to"]
+                firm, db.db_to_ui_date(date), batch, supplier, yarn, kg, rolls, delivered
             ), tags=(firm,))
 
+        count, total_kg, total_rolls = data.totals(firm_filter)
+        self._summary_var.set(
+            f"  {count} records  |  Total Kg: {total_kg:,.2f}  |  Total Rolls: {total_rolls:,}"
+        )
+
+    @timed
+    def _load_monthly_summary(self, firm_filter):
+        """Per-firm monthly totals read straight from the purchase rollup."""
+        self._set_columns(SUMMARY_COLS, SUMMARY_HEADINGS, SUMMARY_WIDTHS)
+        fy_start, fy_end = self._fy_dates()
+        rows = db.purchase_totals(fy_start, fy_end, firm_name=firm_filter,
+                                  group_by=("firm_name", "month"))
+        entries = total_kg = total_rolls = total_value = 0
+        for r in rows:
+            self.tree.insert("", "end", values=(
+                r["firm_name"], r["month"], r["entries"], f"{r['qty_kg']:,.2f}",
+                r["qty_rolls"], f"{r['value']:,.2f}"
+            ), tags=(r["firm_name"],))
+            entries += r["entries"]
+            total_kg += r["qty_kg"]
+            total_rolls += r["qty_rolls"]
+            total_value += r["value"]
         self._summary_var.set(
-            f"  {len(rows)} records  |  Total Kg: {total_kg:,.2f}  |  Total Rolls: {total_rolls:,}"
+            f"  {entries} records  |  Total Kg: {total_kg:,.2f}  |  Total Rolls: {total_rolls:,}"
+            f"  |  Value: {total_value:,.2f}"
         )
 
+    @timed
+    def _load_batch_costing(self, firm_filter):
+        """Per-batch costing for batches first purchased in the FY; click a heading to sort."""
+        self._set_columns(costing.COSTING_COLUMNS, COSTING_HEADINGS, COSTING_WIDTHS,
+                          on_sort=self._sort_costing)
+        fy_start, fy_end = self._fy_dates()
+        column, descending = self._costing_sort
+        data = costing.get_costing(fy_start, fy_end).filter(firm_filter, fy_start, fy_end).sorted_by(column, descending)
+        for batch, firm, first_date, *amounts in data.rows():
+            self.tree.insert("", "end", values=(
+                batch, firm, db.db_to_ui_date(first_date), *(f"{a:,.2f}" for a in amounts)
+            ), tags=(firm,))
+        totals = data.totals()
+        per_kg = totals["net_cost"] / totals["yarn_kg"] if totals["yarn_kg"] else 0
+        self._summary_var.set(
+            f"  {len(data)} batches  |  Yarn: {totals['yarn_cost']:,.2f}  |  Knitting: {totals['knit_cost']:,.2f}"
+            f"  |  Dyeing: {totals['dye_cost']:,.2f}  |  Net: {totals['net_cost']:,.2f}"
+            f"  |  Net / yarn kg: {per_kg:,.2f}"
+        )
+
+    def _as_of_date(self):
+        """FY end, or today while the FY is still running."""
+        return min(self._fy_dates()[1], datetime.now().strftime("%Y-%m-%d"))
+
+    @timed
+    def _load_stock_as_of(self):
+        """Yarn stock held at each fabricator at the FY end (stock is not split by firm)."""
+        self._set_columns(STOCK_COLS, STOCK_HEADINGS, STOCK_WIDTHS)
+        as_of = self._as_of_date()
+        rows = db.stock_as_of(as_of)
+        for r in rows:
+            self.tree.insert("", "end", values=(r["fabricator"], r["yarn_type"], f"{r['qty_kg']:,.2f}"))
+        total_kg = sum(r["qty_kg"] for r in rows)
+        self._summary_var.set(
+            f"  Stock as of {db.db_to_ui_date(as_of)}  |  {len(rows)} balances  |  Total Kg: {total_kg:,.2f}"
+        )
+
+    @timed
+    def _load_wip_as_of(self, firm_filter):
+        """Lots knitted or at dyeing but not yet received at the FY end."""
+        self._set_columns(WIP_COLS, WIP_HEADINGS, WIP_WIDTHS)
+        as_of = self._as_of_date()
+        rows = db.wip_as_of(as_of, firm=firm_filter)
+        for r in rows:
+            self.tree.insert("", "end", values=(
+                r["batch_ref"], r["lot_no"], r["firm"], r["fabricator"],
+                f"{r['issued_kg']:,.2f}", f"{r['returned_kg']:,.2f}", r["status"]
+            ), tags=(r["firm"],))
+        issued = sum(r["issued_kg"] for r in rows)
+        returned = sum(r["returned_kg"] for r in rows)
+        self._summary_var.set(
+            f"  WIP as of {db.db_to_ui_date(as_of)}  |  {len(rows)} lots  |  Yarn issued: {issued:,.2f} kg"
+            f"  |  Returned: {returned:,.2f} kg"
+        )
+
+    @timed
+    def _load_lead_times(self, firm_filter):
+        """Days per status stage and unit, by the month each stage ended in the FY."""
+        self._set_columns(LEAD_COLS, LEAD_HEADINGS, LEAD_WIDTHS)
+        fy_start, fy_end = self._fy_dates()
+        rows = db.lead_time_report(fy_start, fy_end, firm=firm_filter)
+        for r in rows:
+            self.tree.insert("", "end", values=(
+                r["month"], r["stage"], r["unit"], r["lots"],
+                *(f"{r[k]:,.1f}" for k in ("avg_days", "p50_days", "p90_days", "max_days"))
+            ))
+        lots = sum(r["lots"] for r in rows)
+        self._summary_var.set(f"  {lots} stage completions  |  {len(rows)} stage/unit/month groups")
+
+    @timed
+    def _load_rolls(self, firm_filter):
+        """Current finished-roll inventory per batch, state and location (not limited to the FY)."""
+        self._set_columns(ROLL_COLS, ROLL_HEADINGS, ROLL_WIDTHS)
+        rows = db.roll_summary(group_by=("firm", "batch_ref", "state", "location"), firm=firm_filter)
+        for r in rows:
+            self.tree.insert("", "end", values=(
+                r["batch_ref"], r["state"], r["location"], r["rolls"], f"{r['weight_kg']:,.2f}"
+            ), tags=(r["firm"],))
+        in_stock = [r for r in rows if r["state"] == "In Stock"]
+        self._summary_var.set(
+            f"  {sum(r['rolls'] for r in rows):,} rolls  |  In stock: {sum(r['rolls'] for r in in_stock):,} rolls,"
+            f" {sum(r['weight_kg'] for r in in_stock):,.2f} kg"
+        )
+
+    def _sort_costing(self, column):
+        current, descending = self._costing_sort
+        self._costing_sort = (column, not descending if column == current else column not in ("batch", "firm", "first_date"))
+        self.load_report()
+
+    def edit_rate_cards(self):
+        """Small editor for per-unit knitting/dyeing rates."""
+        dialog = tk.Toplevel(self)
+        dialog.title("Rate Cards")
+        cols = ("unit", "type", "rate")
+        tree = ttk.Treeview(dialog, columns=cols, show="headings", height=10)
+        for c, h, w in zip(cols, ["Unit", "Type", "Rate / Kg"], [200, 110, 90]):
+            tree.heading(c, text=h)
+            tree.column(c, width=w)
+        tree.grid(row=0, column=0, columnspan=4, padx=6, pady=6)
+
+        def load():
+            for r in tree.get_children():
+                tree.delete(r)
+            for unit_id, (name, utype, rate, custom) in db.get_rate_cards().items():
+                label = "Knitting" if utype == "knitting_unit" else "Dyeing"
+                tree.insert("", "end", iid=name, values=(name, label, f"{rate:g}" + ("" if custom else " (default)")))
+
+        ttk.Label(dialog, text="Rate / Kg:").grid(row=1, column=0, padx=6, sticky="e")
+        rate_e = ttk.Entry(dialog, width=10)
+        rate_e.grid(row=1, column=1, padx=4, sticky="w")
+        tree.bind("<<TreeviewSelect>>", lambda e: (rate_e.delete(0, tk.END), rate_e.insert(
+            0, tree.item(tree.selection()[0])["values"][2].split(" ")[0])) if tree.selection() else None)
+
+        def save(reset=False):
+            sel = tree.selection()
+            if not sel:
+                messagebox.showwarning("Select", "Select a unit first.", parent=dialog)
+                return
+            try:
+                db.set_rate_card(sel[0], None if reset else rate_e.get().strip())
+            except ValueError as e:
+                messagebox.showerror("Invalid Rate", str(e), parent=dialog)
+                return
+            load()
+            if self._view_var.get() == "Batch Costing":
+                self.load_report()
+
+        ttk.Button(dialog, text="Save", command=save).grid(row=1, column=2, padx=4, pady=6)
+        ttk.Button(dialog, text="Use Default", command=lambda: save(reset=True)).grid(row=1, column=3, padx=4, pady=6)
+        load()
+
     def export_report(self):
         selected = self._firm_var.get()
         file_path = filedialog.asksaveasfilename(
@@ -133,64 +663,76 @@ class ReportsFrame(ttk.Frame):
         if not file_path:
             return
 
-        wb = Workbook()
-        wb.remove(wb.active)   # remove default blank sheet
-
-        header = ["Firm", "Date", "Batch", "Supplier", "Yarn", "Kg", "Rolls", "Delivered To"]
-        hdr_font = Font(bold=True, color="FFFFFF")
-        hdr_fill = PatternFill("solid", fgColor="2E4057")
-
-        def make_sheet(ws, rows, title_firm=""):
-            ws.title = title_firm or "Combined"
-            # Header
-            ws.append(header)
-            for cell in ws[1]:
-                cell.font = hdr_font
-                cell.fill = hdr_fill
-                cell.alignment = Alignment(horizontal="center")
-            # Data
-            firm_colours = {
-                db.FIRMS[0]: "D6EAF8",   # blue tint
-                db.FIRMS[1]: "FEF9E7",   # amber tint
-            }
-            for row in rows:
-                display_date = db.db_to_ui_date(row["date"])
-                firm = row["firm_name"] or ""
-                ws.append([firm, display_date, row["batch_id"], row["supplier"],
-                            row["yarn_type"], row["qty_kg"], row["qty_rolls"],
-                            row["delivered_to"]])
-                fill_color = firm_colours.get(firm, "FFFFFF")
-                row_idx = ws.max_row
-                for cell in ws[row_idx]:
-                    cell.fill = PatternFill("solid", fgColor=fill_color)
-            # Totals row
-            last = ws.max_row
-            ws.append(["", "TOTAL", "", "", "",
-                        f"=SUM(F2:F{last})", f"=SUM(G2:G{last})", ""])
-            for cell in ws[ws.max_row]:
-                cell.font = Font(bold=True)
-            # Column widths
-            for col, w in zip("ABCDEFGH", [24, 12, 14, 20, 20, 10, 10, 20]):
-                ws.column_dimensions[col].width = w
-
-        if selected == "Both (Combined)":
-            # Three sheets: SP, RK, Combined
-            for firm in db.FIRMS:
-                rows = self._fetch_rows(firm)
-                short = firm.split()[0]          # "S.P." or "R"
-                ws = wb.create_sheet(title=firm[:28])
-                make_sheet(ws, rows, firm)
-            # Combined sheet
-            all_rows = self._fetch_rows(None)
-            ws_combined = wb.create_sheet(title="Combined")
-            make_sheet(ws_combined, all_rows, "")
+        # Reuse the FY result if the screen already holds a current copy;
+        # otherwise the job streams straight from the cursor.
+        fy_start, fy_end = self._fy_dates()
+        firm_filter = None if selected == "Both (Combined)" else selected
+        label = f"FY {self.fy_start.get()} - {selected}"
+        job = ExportJob(file_path, fy_start, fy_end, firm_filter, label,
+                        data=peek_report_data(fy_start, fy_end))
+        export_queue.submit(job)
+        self._refresh_jobs()
+
+    # ------------------------------------------------------------------
+    def _job_progress_text(self, job):
+        if job.total_rows:
+            return (f"{job.rows_written:,} / {job.total_rows:,} rows, "
+                    f"{job.sheets_done}/{job.total_sheets} sheets")
+        return f"{job.rows_written:,} rows, {job.sheets_done}/{job.total_sheets} sheets"
+
+    def _refresh_jobs(self):
+        """Mirror export_queue into the jobs table and poll while work remains."""
+        if self._poll_pending:
+            self.after_cancel(self._poll_pending)
+        self._poll_pending = None
+        shown = set(self.jobs_tree.get_children())
+        running, unfinished = None, False
+        for job in export_queue.jobs:
+            # Read once: the worker may finish the job while this loop runs
+            finished = job.finished
+            iid = str(job.id)
+            status = job.status if job.status != "Failed" else f"Failed: {job.error}"
+            values = (os.path.basename(job.file_path), job.label, status, self._job_progress_text(job))
+            if iid in shown:
+                self.jobs_tree.item(iid, values=values)
+                shown.discard(iid)
+            else:
+                self.jobs_tree.insert("", "end", iid=iid, values=values)
+            if job.status == "Running":
+                running = job
+            if not finished:
+                unfinished = True
+            elif job.id not in self._notified_jobs:
+                self._notified_jobs.add(job.id)
+                self._notify_finished(job)
+        for iid in shown:
+            self.jobs_tree.delete(iid)
+
+        if running and running.total_rows:
+            self.job_progress.config(maximum=running.total_rows, value=running.rows_written)
         else:
-            rows = self._fetch_rows(selected)
-            ws = wb.create_sheet(title=selected[:28])
-            make_sheet(ws, rows, selected)
+            self.job_progress.config(maximum=1, value=0)
+        # Poll on what this pass saw, so a job finishing after it still gets one more pass
+        if unfinished:
+            self._poll_pending = self.after(EXPORT_POLL_MS, self._refresh_jobs)
+
+    def _notify_finished(self, job):
+        if job.status == "Done":
+            messagebox.showinfo("Export Complete", f"Report saved to:\n{job.file_path}")
+        elif job.status == "Failed":
+            messagebox.showerror("Export Failed", f"{job.label}\n{job.error}")
+
+    def cancel_export(self):
+        sel = self.jobs_tree.selection()
+        targets = [j for j in export_queue.jobs if str(j.id) in sel] if sel else export_queue.active()[:1]
+        for job in targets:
+            if not job.finished:
+                job.cancel()
+        self._refresh_jobs()
 
-        wb.save(file_path)
-        messagebox.showinfo("Export Complete", f"Report saved to:\n{file_path}")
+    def clear_finished_jobs(self):
+        export_queue.clear_finished()
+        self._refresh_jobs()
 
     def reload_data(self):
         self.load_report()
@@ -2,6 +2,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from fabric_tracker_tk.db import Database
+from fabric_tracker_tk.latency import timed
 
 class CustomersUI:
     def __init__(self, master):
@@ -36,6 +37,8 @@ class CustomersUI:
         ttk.Button(self.frame, text="Add", command=self.add_customer).grid(row=4, column=0, pady=5)
         ttk.Button(self.frame, text="Update", command=self.update_customer).grid(row=4, column=1, pady=5)
         ttk.Button(self.frame, text="Delete", command=self.delete_customer).grid(row=4, column=2, pady=5)
+        self.more_btn = ttk.Button(self.frame, text="Load More", command=self.load_more)
+        self.more_btn.grid(row=4, column=3, pady=5, sticky="e")
 
         # Load initial data
         self.load_customers()
@@ -43,20 +46,34 @@ class CustomersUI:
         # Select row binding
         self.tree.bind("<<TreeviewSelect>>", self.on_select)
 
+    @timed
     def load_customers(self):
         for i in self.tree.get_children():
             self.tree.delete(i)
-        rows = self.db.fetch_customers()
+        self._last_key = (None, None)
+        self.load_more()
+
+    @timed
+    def load_more(self):
+        rows = self.db.fetch_customers(after_name=self._last_key[0], after_id=self._last_key[1])
         for row in rows:
             self.tree.insert("", "end", values=row)
+        if rows:
+            self._last_key = (rows[-1][1], rows[-1][0])
+        self.more_btn.config(state="normal" if len(rows) == self.db.page_size else "disabled")
 
+    @timed
     def add_customer(self):
         name = self.name_var.get().strip()
         contact = self.contact_var.get().strip()
         if not name:
             messagebox.showerror("Error", "Customer name is required")
             return
-        self.db.insert_customer(name, contact)
+        try:
+            self.db.insert_customer(name, contact)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         self.load_customers()
         self.clear_form()
 
@@ -72,10 +89,15 @@ class CustomersUI:
         if not name:
             messagebox.showerror("Error", "Customer name is required")
             return
-        self.db.update_customer(customer_id, name, contact)
+        try:
+            self.db.update_customer(customer_id, name, contact)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         self.load_customers()
         self.clear_form()
 
+    @timed
     def delete_customer(self):
         selected = self.tree.selection()
         if not selected:
@@ -85,7 +107,11 @@ class CustomersUI:
         customer_id = item["values"][0]
         confirm = messagebox.askyesno("Confirm", "Are you sure you want to delete this customer?")
         if confirm:
-            self.db.delete_customer(customer_id)
+            try:
+                self.db.delete_customer(customer_id)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.load_customers()
             self.clear_form()
 
@@ -1,8 +1,13 @@
+import base64
 import tkinter as tk
 from tkinter import ttk, messagebox
 from fabric_tracker_tk import db
+from fabric_tracker_tk import charts
+from fabric_tracker_tk.latency import timed
 from datetime import datetime
 
+CHART_POLL_MS = 100  # How often to check for a finished chart render
+
 class DashboardFrame(ttk.Frame):
     def __init__(self, parent, controller=None):
         super().__init__(parent)
@@ -26,8 +31,7 @@ class DashboardFrame(ttk.Frame):
 
         ttk.Label(self.left_frame, text="Status Overview", font=("Helvetica", 14, "bold")).grid(row=0, column=0, pady=5)
         self.status_vars = {}
-        statuses = ["Ordered", "Knitted", "Dyed", "Received"]
-        for i, status in enumerate(statuses, 1):
+        for i, status in enumerate(db.STATUSES, 1):
             frame = ttk.Frame(self.left_frame)
             frame.grid(row=i, column=0, pady=5, sticky="ew")
             ttk.Label(frame, text=f"{status}:", width=10).pack(side="left")
@@ -67,9 +71,21 @@ class DashboardFrame(ttk.Frame):
         self.chart_frame = ttk.Frame(self)
         self.chart_frame.grid(row=1, column=1, sticky="nsew", padx=5, pady=5)
         self.chart_frame.columnconfigure(0, weight=1)
-        ttk.Label(self.chart_frame, text="Status Distribution", font=("Helvetica", 12, "bold")).grid(row=0, column=0, pady=5)
+        self._chart_names = {label: name for name, label in charts.CHARTS.items()}
+        self.chart_var = tk.StringVar(value=charts.CHARTS["status"])
+        chart_cb = ttk.Combobox(self.chart_frame, textvariable=self.chart_var, state="readonly",
+                                values=list(charts.CHARTS.values()), width=26)
+        chart_cb.grid(row=0, column=0, pady=5)
+        chart_cb.bind("<<ComboboxSelected>>", lambda e: self.refresh_chart())
         self.chart_label = ttk.Label(self.chart_frame, text="Chart Placeholder")
         self.chart_label.grid(row=1, column=0)
+        self._chart_image = None   # Keep a reference or Tk drops the image
+        self._chart_key = None     # Render the label is waiting for
+        self._chart_text = ""      # Text fallback if matplotlib is unavailable
+        self._chart_poll = None
+        self._chart_filters = (None, None, None)
+        # Charts are only rendered once the tab is actually shown
+        self.bind("<Map>", lambda e: self.refresh_chart())
 
         # Summary Stats
         self.summary_frame = ttk.Frame(self)
@@ -138,8 +154,7 @@ class DashboardFrame(ttk.Frame):
 
         ttk.Label(dialog, text="Status:").grid(row=3, column=0, padx=5, pady=5, sticky="e")
         status_var = tk.StringVar(value=status)
-        statuses = ["Ordered", "Knitted", "Dyed", "Received"]
-        ttk.OptionMenu(dialog, status_var, status, *statuses).grid(row=3, column=1, padx=5, pady=5, sticky="w")
+        ttk.OptionMenu(dialog, status_var, status, *db.STATUSES).grid(row=3, column=1, padx=5, pady=5, sticky="w")
 
         def save_edit():
             new_batch_ref = batch_e.get().strip()
@@ -159,27 +174,11 @@ class DashboardFrame(ttk.Frame):
                 messagebox.showerror("Invalid Input", "Expected Lots must be a positive integer.")
                 return
 
-            with db.get_connection() as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT 1 FROM fabric_compositions WHERE name=?", (fabric_type_name,))
-                if not cur.fetchone():
-                    messagebox.showerror("Error", f"Fabric type '{fabric_type_name}' not found.")
-                    return
-                cur.execute("""
-                    UPDATE batches
-                    SET batch_ref=?, fabric_type_name=?, expected_lots=?, status=?
-                    WHERE id=?
-                """, (new_batch_ref, fabric_type_name, expected_lots, new_status, batch_id))
-                conn.commit()
-                # Update lots if expected_lots changed
-                cur.execute("SELECT COUNT(*) FROM lots WHERE batch_id=?", (batch_id,))
-                current_lots = cur.fetchone()[0]
-                if expected_lots > current_lots:
-                    for i in range(current_lots + 1, expected_lots + 1):
-                        db.create_lot(batch_id, i)
-                elif expected_lots < current_lots:
-                    cur.execute("DELETE FROM lots WHERE batch_id=? AND lot_index > ?", (batch_id, expected_lots))
-                conn.commit()
+            try:
+                db.update_batch(batch_id, new_batch_ref, fabric_type_name, expected_lots, new_status)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
 
             dialog.destroy()
             self.reload_all()
@@ -187,6 +186,7 @@ class DashboardFrame(ttk.Frame):
         ttk.Button(dialog, text="Save", command=save_edit).grid(row=4, column=0, columnspan=2, pady=10)
         ttk.Button(dialog, text="Cancel", command=dialog.destroy).grid(row=5, column=0, columnspan=2, pady=5)
 
+    @timed
     def delete_batch_confirmed(self, item):
         batch_ref = self.batch_tree.item(item)["values"][0]
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete batch '{batch_ref}'?"):
@@ -201,6 +201,7 @@ class DashboardFrame(ttk.Frame):
         if item:
             self.edit_batch(item)
 
+    @timed
     def reload_all(self):
         # Clear existing status data
         for status in self.status_vars:
@@ -217,24 +218,13 @@ class DashboardFrame(ttk.Frame):
 
         with db.get_connection() as conn:
             cur = conn.cursor()
-            # Status counts
-            sql = """
-                SELECT b.status, COUNT(DISTINCT b.id) AS batch_count, COUNT(DISTINCT l.id) AS lot_count
-                FROM batches b
-                LEFT JOIN lots l ON b.id = l.batch_id
-                LEFT JOIN purchases p ON b.batch_ref = p.batch_id
-            """
-            params = ()
-            if from_db and to_db:
-                sql += " WHERE p.date BETWEEN ? AND ?"
-                params = (from_db, to_db)
-            fabricator = self.fabricator_var.get()
-            if fabricator:
-                sql += " WHERE p.delivered_to = ?" if not params else " AND p.delivered_to = ?"
-                params += (fabricator,)
-            sql += " GROUP BY b.status"
-            cur.execute(sql, params)
-            status_data = {row["status"] or "Ordered": (row["batch_count"], row["lot_count"]) for row in cur.fetchall()}
+            # The date filter applies only when both ends are given
+            if not (from_db and to_db):
+                from_db = to_db = None
+            fabricator = self.fabricator_var.get() or None
+
+            # Status counts: maintained counters, or an EXISTS probe when filtered
+            status_data = db.batch_status_counts(from_db, to_db, fabricator)
 
             total_batches = sum(c[0] for c in status_data.values())
             total_lots = sum(c[1] for c in status_data.values())
@@ -245,17 +235,24 @@ class DashboardFrame(ttk.Frame):
                     progressbar = self.left_frame.winfo_children()[status == "Ordered" and 1 or status == "Knitted" and 2 or status == "Dyed" and 3 or 4].winfo_children()[2]
                     progressbar["value"] = (batch_count / total_batches) * 100 if total_batches else 0
 
-            # Summary stats
-            cur.execute("""
-                SELECT COUNT(DISTINCT p.id) AS purchase_count, SUM(p.qty_kg) AS total_kg, COUNT(DISTINCT p.batch_id) AS batch_count
-                FROM purchases p
-            """, params)
-            row = cur.fetchone()
-            self.total_purchases_label.config(text=f"Total Purchases: {row['purchase_count'] or 0}")
-            self.total_yarn_kg_label.config(text=f"Total Yarn (kg): {row['total_kg'] or 0}")
-            self.total_batches_label.config(text=f"Total Batches: {row['batch_count'] or 0}")
+            # Summary stats (purchase totals come from the monthly rollup)
+            totals = db.purchase_totals(from_db, to_db, delivered_to=fabricator)
+            batch_sql = "SELECT COUNT(DISTINCT batch_id) FROM purchases WHERE 1=1"
+            batch_params = ()
+            if from_db and to_db:
+                batch_sql += " AND date BETWEEN ? AND ?"
+                batch_params = (from_db, to_db)
+            if fabricator:
+                batch_sql += " AND delivered_to = ?"
+                batch_params += (fabricator,)
+            cur.execute(batch_sql, batch_params)
+            batch_count = cur.fetchone()[0]
+            self.total_purchases_label.config(text=f"Total Purchases: {totals['entries']}")
+            self.total_yarn_kg_label.config(text=f"Total Yarn (kg): {totals['qty_kg']:,.2f}")
+            self.total_batches_label.config(text=f"Total Batches: {batch_count or 0}")
 
             # Update chart
+            self._chart_filters = (from_db, to_db, fabricator)
             self.update_chart(status_data, total_batches)
 
             # Load batches into batch table (excluding yarn batches where fabricator_id is NULL)
@@ -275,7 +272,44 @@ class DashboardFrame(ttk.Frame):
             chart_text = "\n".join([f"{s}: {'█' * int((c[0]/total_batches)*20) or '▁'} ({c[0]})" for s, c in status_data.items()])
         else:
             chart_text = "No data available"
-        self.chart_label.config(text=chart_text)
+        self._chart_text = chart_text
+        self.refresh_chart()
+
+    @timed
+    def refresh_chart(self):
+        """Show the selected chart from cache, or queue a background render."""
+        if not self.winfo_ismapped():
+            return
+        chart = self._chart_names.get(self.chart_var.get(), "status")
+        key, png = charts.renderer.request(chart, self._chart_filters)
+        self._chart_key = key
+        if png is not None:
+            self._show_chart(png)
+            return
+        if self._chart_image is None:
+            self.chart_label.config(text="Rendering chart...")
+        if self._chart_poll is None:
+            self._chart_poll = self.after(CHART_POLL_MS, self._poll_chart)
+
+    def _poll_chart(self):
+        self._chart_poll = None
+        waiting = True
+        for key, png, error in charts.renderer.poll():
+            if key != self._chart_key:
+                continue  # Superseded by a newer request
+            waiting = False
+            if png is not None:
+                self._show_chart(png)
+            else:
+                print(f"[Dashboard] Chart render failed: {error}")
+                self._chart_image = None
+                self.chart_label.config(image="", text=self._chart_text)
+        if waiting:
+            self._chart_poll = self.after(CHART_POLL_MS, self._poll_chart)
+
+    def _show_chart(self, png):
+        self._chart_image = tk.PhotoImage(data=base64.b64encode(png))
+        self.chart_label.config(image=self._chart_image, text="")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,240 @@
+import time
+import tkinter as tk
+from datetime import datetime
+from tkinter import ttk, filedialog, messagebox
+from fabric_tracker_tk import db
+from fabric_tracker_tk import latency
+
+class DiagnosticsFrame(ttk.Frame):
+    def __init__(self, parent, controller=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.build_ui()
+        self.refresh()
+
+    def build_ui(self):
+        top = ttk.Frame(self)
+        top.pack(fill="x", padx=6, pady=6)
+        ttk.Label(top, text="Query Cache", font=("Helvetica", 12, "bold")).pack(side="left", padx=4)
+        ttk.Button(top, text="Refresh", command=self.refresh).pack(side="left", padx=6)
+        ttk.Button(top, text="Reset Stats", command=self.reset_stats).pack(side="left", padx=4)
+        ttk.Button(top, text="Clear Cache", command=self.clear_cache).pack(side="left", padx=4)
+
+        self._summary_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self._summary_var, foreground="gray").pack(anchor="w", padx=8)
+
+        frame = ttk.Frame(self)
+        frame.pack(fill="both", expand=True, padx=6, pady=4)
+        sy = ttk.Scrollbar(frame, orient="vertical")
+        sy.pack(side="right", fill="y")
+        cols = ("function", "hits", "misses", "hit_rate")
+        self.cache_tree = ttk.Treeview(frame, columns=cols, show="headings", yscrollcommand=sy.set)
+        self.cache_tree.pack(fill="both", expand=True)
+        sy.config(command=self.cache_tree.yview)
+        for c, h, w in zip(cols, ["Function", "Hits", "Misses", "Hit Rate"], [260, 90, 90, 90]):
+            self.cache_tree.heading(c, text=h)
+            self.cache_tree.column(c, width=w)
+
+        sql = ttk.Frame(self)
+        sql.pack(fill="x", padx=6, pady=(12, 0))
+        ttk.Label(sql, text="SQL Timings", font=("Helvetica", 12, "bold")).pack(side="left", padx=4)
+        ttk.Button(sql, text="Refresh", command=self.refresh).pack(side="left", padx=6)
+        ttk.Button(sql, text="Reset", command=self.reset_timings).pack(side="left", padx=4)
+        self._timing_var = tk.BooleanVar(value=db.QUERY_TIMING)
+        ttk.Checkbutton(sql, text="Time queries", variable=self._timing_var,
+                        command=self.apply_timing_settings).pack(side="left", padx=8)
+        self._trace_var = tk.BooleanVar(value=db.SQL_TRACE)
+        ttk.Checkbutton(sql, text="Trace all SQL to log", variable=self._trace_var,
+                        command=self.apply_timing_settings).pack(side="left", padx=4)
+        ttk.Label(sql, text="Slow over (ms):").pack(side="left", padx=(8, 2))
+        self._slow_var = tk.StringVar(value=f"{db.SLOW_QUERY_MS:g}")
+        slow_e = ttk.Entry(sql, textvariable=self._slow_var, width=7)
+        slow_e.pack(side="left")
+        slow_e.bind("<Return>", lambda e: self.apply_timing_settings())
+        slow_e.bind("<FocusOut>", lambda e: self.apply_timing_settings())
+
+        self._sql_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self._sql_var, foreground="gray").pack(anchor="w", padx=8)
+
+        frame = ttk.Frame(self)
+        frame.pack(fill="both", expand=True, padx=6, pady=4)
+        sy = ttk.Scrollbar(frame, orient="vertical")
+        sy.pack(side="right", fill="y")
+        cols = ("sql", "caller", "calls", "total", "p50", "p95", "max", "slow")
+        self.sql_tree = ttk.Treeview(frame, columns=cols, show="headings", height=10, yscrollcommand=sy.set)
+        self.sql_tree.pack(fill="both", expand=True)
+        sy.config(command=self.sql_tree.yview)
+        for c, h, w in zip(cols, ["Statement", "Last Called From", "Calls", "Total ms", "p50 ms", "p95 ms", "Max ms", "Slow"],
+                           [420, 180, 70, 90, 70, 70, 80, 60]):
+            self.sql_tree.heading(c, text=h)
+            self.sql_tree.column(c, width=w, anchor="w" if c in ("sql", "caller") else "e")
+
+        ui = ttk.Frame(self)
+        ui.pack(fill="x", padx=6, pady=(12, 0))
+        ttk.Label(ui, text="UI Latency", font=("Helvetica", 12, "bold")).pack(side="left", padx=4)
+        ttk.Button(ui, text="Refresh", command=self.refresh_latency).pack(side="left", padx=6)
+        ttk.Button(ui, text="Reset", command=self.reset_latency).pack(side="left", padx=4)
+        ttk.Button(ui, text="Export JSON...", command=self.export_latency).pack(side="left", padx=4)
+
+        self._latency_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self._latency_var, foreground="gray").pack(anchor="w", padx=8)
+
+        frame = ttk.Frame(self)
+        frame.pack(fill="both", expand=True, padx=6, pady=4)
+        sy = ttk.Scrollbar(frame, orient="vertical")
+        sy.pack(side="right", fill="y")
+        cols = ("at", "total", "db", "widget", "paint", "note")
+        self.latency_tree = ttk.Treeview(frame, columns=cols, show="tree headings", height=8, yscrollcommand=sy.set)
+        self.latency_tree.pack(fill="both", expand=True)
+        sy.config(command=self.latency_tree.yview)
+        self.latency_tree.heading("#0", text="Action / Loader / Stall")
+        self.latency_tree.column("#0", width=320)
+        for c, h, w in zip(cols, ["When", "Total ms", "DB ms", "Widget ms", "Paint ms", "Note"],
+                           [100, 80, 80, 80, 80, 360]):
+            self.latency_tree.heading(c, text=h)
+            self.latency_tree.column(c, width=w, anchor="w" if c in ("at", "note") else "e")
+
+        stock = ttk.Frame(self)
+        stock.pack(fill="x", padx=6, pady=(12, 0))
+        ttk.Label(stock, text="Yarn Stock Reconciliation", font=("Helvetica", 12, "bold")).pack(side="left", padx=4)
+        ttk.Button(stock, text="Check", command=self.check_stock).pack(side="left", padx=6)
+        ttk.Button(stock, text="Fix Drift", command=self.fix_stock).pack(side="left", padx=4)
+
+        self._stock_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self._stock_var, foreground="gray").pack(anchor="w", padx=8)
+
+        frame = ttk.Frame(self)
+        frame.pack(fill="both", expand=True, padx=6, pady=4)
+        sy = ttk.Scrollbar(frame, orient="vertical")
+        sy.pack(side="right", fill="y")
+        cols = ("fabricator", "yarn_type", "recorded", "expected", "drift")
+        self.stock_tree = ttk.Treeview(frame, columns=cols, show="headings", height=8, yscrollcommand=sy.set)
+        self.stock_tree.pack(fill="both", expand=True)
+        sy.config(command=self.stock_tree.yview)
+        for c, h, w in zip(cols, ["Fabricator", "Yarn Type", "Recorded Kg", "Expected Kg", "Drift Kg"], [200, 160, 110, 110, 110]):
+            self.stock_tree.heading(c, text=h)
+            self.stock_tree.column(c, width=w, anchor="w" if c in ("fabricator", "yarn_type") else "e")
+
+    def refresh(self):
+        for r in self.cache_tree.get_children():
+            self.cache_tree.delete(r)
+        stats = db.cache_stats()
+        for name, (hits, misses) in sorted(stats["functions"].items(), key=lambda kv: -(kv[1][0] + kv[1][1])):
+            total = hits + misses
+            rate = f"{hits / total:.0%}" if total else "-"
+            self.cache_tree.insert("", "end", values=(name, hits, misses, rate))
+        total = stats["hits"] + stats["misses"]
+        rate = f"{stats['hits'] / total:.0%}" if total else "-"
+        self._summary_var.set(
+            f"  {stats['size']} / {stats['max_size']} entries  |  Hits: {stats['hits']}  |  "
+            f"Misses: {stats['misses']}  |  Hit rate: {rate}"
+        )
+        self.refresh_timings()
+        self.refresh_latency()
+
+    def refresh_timings(self):
+        for r in self.sql_tree.get_children():
+            self.sql_tree.delete(r)
+        timings = db.query_timings()
+        for t in timings[:300]:
+            self.sql_tree.insert("", "end", values=(
+                t["sql"][:300], t["caller"], f"{t['calls']:,}", f"{t['total_ms']:,.1f}", f"{t['p50_ms']:,.2f}",
+                f"{t['p95_ms']:,.2f}", f"{t['max_ms']:,.1f}", t["slow"] or ""))
+        state = "on" if db.QUERY_TIMING else "off"
+        self._sql_var.set(
+            f"  Timing {state}  |  {len(timings)} statement(s), {sum(t['calls'] for t in timings):,} run(s), "
+            f"{sum(t['total_ms'] for t in timings):,.0f} ms  |  Slow queries: {db.SLOW_QUERY_LOG}"
+            + (f"  |  Trace: {db.SQL_TRACE_LOG}" if db.SQL_TRACE else ""))
+
+    def apply_timing_settings(self):
+        try:
+            slow_ms = float(self._slow_var.get())
+        except ValueError:
+            slow_ms = None
+            self._slow_var.set(f"{db.SLOW_QUERY_MS:g}")
+        db.set_query_timing(enabled=self._timing_var.get(), sql_trace=self._trace_var.get(), slow_ms=slow_ms)
+        self.refresh_timings()
+
+    def reset_timings(self):
+        db.reset_query_timings()
+        self.refresh_timings()
+
+    def refresh_latency(self):
+        """Recent actions with their loaders, and event-loop stalls with the innermost frames sampled."""
+        for r in self.latency_tree.get_children():
+            self.latency_tree.delete(r)
+        actions, stalls = latency.recent_actions(), latency.recent_stalls()
+        events = [("action", a) for a in actions] + [("stall", s) for s in stalls]
+        for kind, e in sorted(events, key=lambda ke: ke[1]["at"], reverse=True):
+            at = e["at"][11:23]
+            if kind == "action":
+                note = "includes time in a dialog" if e.get("nested_loop") else ""
+                self._insert_span("", e, at, note)
+                continue
+            iid = self.latency_tree.insert("", "end", text=f"Stall{' in ' + e['action'] if e['action'] else ''}",
+                                           values=(at, f"{e['ms']:,.0f}", "", "", "", f"{len(e['samples'])} stack sample(s)"))
+            for sample in e["samples"]:
+                sid = self.latency_tree.insert(iid, "end", text=f"Sample after {sample['after_ms']:,.0f} ms",
+                                               values=("", "", "", "", "", sample["action"] or ""))
+                for line in reversed(sample["stack"][-8:]):  # Innermost first
+                    self.latency_tree.insert(sid, "end", text="", values=("", "", "", "", "", line.strip().splitlines()[0]))
+        slowest = max((a["total_ms"] for a in actions), default=0)
+        worst = max((s["ms"] for s in stalls), default=0)
+        self._latency_var.set(
+            f"  {len(actions)} action(s), slowest {slowest:,.0f} ms  |  {len(stalls)} stall(s) over "
+            f"{latency.STALL_MS} ms, worst {worst:,.0f} ms" + ("" if db.QUERY_TIMING else "  |  DB time needs query timing on"))
+
+    def _insert_span(self, parent, span, at, note=""):
+        paint = span.get("paint_ms")
+        iid = self.latency_tree.insert(parent, "end", text=span["name"], values=(
+            at, f"{span['total_ms']:,.1f}", f"{span['db_ms']:,.1f}", f"{span['widget_ms']:,.1f}",
+            "" if paint is None else f"{paint:,.1f}", note))
+        for child in span["children"]:
+            self._insert_span(iid, child, "")
+
+    def reset_latency(self):
+        latency.reset()
+        self.refresh_latency()
+
+    def export_latency(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json", filetypes=[("JSON", "*.json"), ("All Files", "*.*")],
+            initialfile=f"fabric_latency_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json")
+        if not path:
+            return
+        try:
+            latency.export_json(path)
+        except Exception as e:
+            messagebox.showerror("Export Failed", str(e))
+            return
+        self._latency_var.set(f"  Exported to {path}")
+
+    def reset_stats(self):
+        db.reset_cache_stats()
+        self.refresh()
+
+    def clear_cache(self):
+        db.clear_query_cache()
+        self.refresh()
+
+    def check_stock(self, fix=False):
+        start = time.perf_counter()
+        drift = db.reconcile_yarn_stock(fix=fix)
+        elapsed = (time.perf_counter() - start) * 1000
+        for r in self.stock_tree.get_children():
+            self.stock_tree.delete(r)
+        for d in drift:
+            self.stock_tree.insert("", "end", values=(
+                d["fabricator"], d["yarn_type"], f"{d['recorded']:,.3f}", f"{d['expected']:,.3f}", f"{d['drift']:+,.3f}"))
+        if not drift:
+            self._stock_var.set(f"  All yarn balances match purchases and dyeing outputs ({elapsed:.0f} ms)")
+        elif fix:
+            self._stock_var.set(f"  Corrected {len(drift)} drifted balance(s) ({elapsed:.0f} ms)")
+        else:
+            self._stock_var.set(f"  {len(drift)} balance(s) differ from purchases and dyeing outputs ({elapsed:.0f} ms)")
+
+    def fix_stock(self):
+        self.check_stock(fix=True)
+
+    def reload_data(self):
+        self.refresh()
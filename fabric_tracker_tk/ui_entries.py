@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 from datetime import datetime
 from fabric_tracker_tk import db
+from fabric_tracker_tk import costing
+from fabric_tracker_tk.latency import timed
 
 # ---------------- Autocomplete Combobox ----------------
 class AutocompleteCombobox(ttk.Combobox):
@@ -57,6 +59,9 @@ class EntriesFrame(ttk.Frame):
         self.selected_purchase_id = None
         self.selected_dyeing_id = None
         self.active_firm = db.FIRMS[0]  # Persists until manually changed
+        self._yarn_types = []
+        self._delivered_names = []
+        self._ranked_for_supplier = None  # Supplier the yarn/delivered lists are ranked for
         self._last_purchase_defaults = {
             "date": datetime.today().strftime("%d/%m/%Y"),
             "batch": "",
@@ -140,6 +145,8 @@ class EntriesFrame(ttk.Frame):
         ttk.Button(frm, text="Reload Lists", command=self.refresh_lists).grid(row=4, column=3, sticky="w")
         ttk.Button(frm, text="Show Net Price", command=self.show_net_price).grid(row=4, column=4, pady=5, sticky="w")
         self.delivered_cb.bind("<Return>", lambda e: self._snap_autocomplete(self.delivered_cb))
+        self.supplier_cb.bind("<<ComboboxSelected>>", self._on_supplier_change, add="+")
+        self.supplier_cb.bind("<FocusOut>", self._on_supplier_change, add="+")
 
     def _snap_autocomplete(self, combo):
         txt = combo.get().strip()
@@ -181,6 +188,7 @@ class EntriesFrame(ttk.Frame):
             menu.add_command(label="Delete Batch", command=lambda: self.delete_batch_confirmed(self.tree.set(item, "batch")))
             menu.post(event.x_root, event.y_root)
 
+    @timed
     def delete_purchase_confirmed(self, purchase_id):
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this purchase?"):
             db.delete_purchase(purchase_id)
@@ -188,6 +196,7 @@ class EntriesFrame(ttk.Frame):
             if self.controller and hasattr(self.controller, "fabricators_frame"):
                 self.controller.fabricators_frame.build_tabs()
 
+    @timed
     def delete_batch_confirmed(self, batch_ref):
         if not batch_ref:
             messagebox.showwarning("Invalid Selection", "No batch selected for deletion.")
@@ -253,22 +262,105 @@ class EntriesFrame(ttk.Frame):
         if item:
             self.dye_tree.selection_set(item)
             menu = tk.Menu(self, tearoff=0)
+            menu.add_command(label="Yarn Layers (FIFO)", command=lambda: self.show_yarn_layers(int(item)))
+            menu.add_command(label="Rolls", command=lambda: self.show_rolls(int(item)))
             menu.add_command(label="Delete", command=lambda: self.delete_dyeing_confirmed(int(item)))
             menu.post(event.x_root, event.y_root)
 
+    @timed
     def delete_dyeing_confirmed(self, dyeing_id):
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this dyeing output?"):
-            db.delete_dyeing_output(dyeing_id)
+            try:
+                db.delete_dyeing_output(dyeing_id)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.reload_dyeing_outputs()
 
+    def show_yarn_layers(self, dyeing_id):
+        """Show which purchases (FIFO cost layers) the yarn for a dyeing return came from."""
+        with db.get_connection() as conn:
+            row = conn.execute("SELECT lot_id FROM dyeing_outputs WHERE id=?", (dyeing_id,)).fetchone()
+        layers = db.fifo_lot_consumption(row["lot_id"]) if row else []
+        rows = [r for r in layers if r["source"] == "dyeing" and r["source_id"] == dyeing_id]
+        if not rows:
+            messagebox.showinfo("Yarn Layers", "No yarn consumption recorded for this dyeing output.")
+            return
+        lines = []
+        for r in rows:
+            if r["purchase_id"] is None:
+                lines.append(f"{r['yarn_type']}: {r['qty_kg']:,.2f} kg not covered by any purchase at {r['fabricator']}")
+            else:
+                lines.append(f"{r['yarn_type']}: {r['qty_kg']:,.2f} kg @ {r['unit_cost']:,.2f} from "
+                             f"{r['supplier']} ({db.db_to_ui_date(r['purchase_date'])})")
+        cost = sum(r["cost"] or 0 for r in rows)
+        messagebox.showinfo("Yarn Layers", "\n".join(lines) + f"\n\nYarn cost (FIFO): {cost:,.2f}")
+
+    def show_rolls(self, dyeing_id):
+        """List the rolls of a dyeing return and move selected rolls to a state or location."""
+        dialog = tk.Toplevel(self)
+        dialog.title("Rolls")
+        dialog.geometry("560x420")
+        dialog.transient(self)
+
+        cols = ("code", "seq", "kg", "state", "location")
+        tree = ttk.Treeview(dialog, columns=cols, show="headings", selectmode="extended")
+        for c, h, w in zip(cols, ["Roll Code", "#", "Kg", "State", "Location"], [110, 50, 80, 100, 160]):
+            tree.heading(c, text=h)
+            tree.column(c, width=w)
+        tree.pack(fill="both", expand=True, padx=6, pady=6)
+
+        bottom = ttk.Frame(dialog)
+        bottom.pack(fill="x", padx=6, pady=6)
+        # Dispatched is set by sales only
+        state_cb = ttk.Combobox(bottom, values=[s for s in db.ROLL_STATES if s != "Dispatched"],
+                                state="readonly", width=12)
+        state_cb.pack(side="left", padx=4)
+        ttk.Label(bottom, text="Location:").pack(side="left", padx=4)
+        location_e = ttk.Entry(bottom, width=18)
+        location_e.pack(side="left", padx=4)
+
+        def load():
+            for r in tree.get_children():
+                tree.delete(r)
+            for roll in db.lot_rolls(dyeing_output_id=dyeing_id):
+                tree.insert("", "end", iid=roll["code"], values=(
+                    roll["code"], roll["seq"], roll["weight_kg"], roll["state"], roll["location"] or ""))
+            generate_btn.config(state="normal" if not tree.get_children() else "disabled")
+
+        def apply():
+            codes = tree.selection()
+            if not codes:
+                return
+            try:
+                db.set_roll_state(codes, state_cb.get() or None, location_e.get() if location_e.get().strip() else None)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=dialog)
+            load()
+
+        def generate():
+            try:
+                db.generate_rolls(dyeing_id)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=dialog)
+            load()
+
+        ttk.Button(bottom, text="Apply to Selected", command=apply).pack(side="left", padx=4)
+        generate_btn = ttk.Button(bottom, text="Generate Rolls", command=generate)
+        generate_btn.pack(side="right", padx=4)
+        load()
+
+    @timed
     def refresh_lists(self):
         suppliers = [r["name"] for r in db.list_suppliers()]
-        yarn_types = db.list_yarn_types()
+        self._yarn_types = db.list_yarn_types()
         dyeing_units = [r["name"] for r in db.list_suppliers("dyeing_unit")]
         knitting_units = [r["name"] for r in db.list_suppliers("knitting_unit")]
-        self.supplier_cb.set_completion_list(suppliers)
-        self.delivered_cb.set_completion_list(knitting_units + dyeing_units)  # Allow delivery to knitting or dyeing
-        self.yarn_cb.set_completion_list(yarn_types)
+        self._delivered_names = knitting_units + dyeing_units  # Allow delivery to knitting or dyeing
+        # Most recently / frequently used names first
+        self.supplier_cb.set_completion_list(db.rank_suggestions("supplier", suppliers))
+        self._ranked_for_supplier = self._last_purchase_defaults["supplier"]
+        self._rank_supplier_dependent_lists(self._ranked_for_supplier)
         self.dyeing_unit_cb.set_completion_list(dyeing_units)
         if self._last_purchase_defaults["supplier"]:
             self.supplier_cb.set(self._last_purchase_defaults["supplier"])
@@ -277,6 +369,17 @@ class EntriesFrame(ttk.Frame):
         if self._last_purchase_defaults["delivered"]:
             self.delivered_cb.set(self._last_purchase_defaults["delivered"])
 
+    def _rank_supplier_dependent_lists(self, supplier):
+        """Put the yarns / delivery units this supplier usually sends first."""
+        self.yarn_cb.set_completion_list(db.rank_suggestions("yarn_type", self._yarn_types, context=supplier))
+        self.delivered_cb.set_completion_list(db.rank_suggestions("delivered_to", self._delivered_names, context=supplier))
+
+    def _on_supplier_change(self, _e=None):
+        supplier = self.supplier_cb.get().strip()
+        if supplier != self._ranked_for_supplier:
+            self._ranked_for_supplier = supplier
+            self._rank_supplier_dependent_lists(supplier)
+
     def _ensure_supplier_exists(self, name, supplier_type=None):
         name = (name or "").strip()
         if not name:
@@ -306,6 +409,7 @@ class EntriesFrame(ttk.Frame):
         # Refresh lists after adding a new yarn type
         self.refresh_lists()
 
+    @timed
     def reload_entries(self):
         for r in self.tree.get_children():
             self.tree.delete(r)
@@ -323,6 +427,22 @@ class EntriesFrame(ttk.Frame):
                     row["qty_kg"], row["qty_rolls"], row["price_per_unit"], row["delivered_to"]
                 ))
 
+    def show_purchase(self, purchase_id):
+        """Select a purchase in the table, switching the active firm if needed."""
+        with db.get_connection() as conn:
+            row = conn.execute("SELECT firm_name FROM purchases WHERE id=?", (purchase_id,)).fetchone()
+        if not row:
+            return
+        self.notebook.select(self.tab_purchases)
+        if row["firm_name"] and row["firm_name"] != self.active_firm:
+            self._firm_var.set(row["firm_name"])
+            self._on_firm_change()
+        iid = str(purchase_id)
+        if self.tree.exists(iid):
+            self.tree.selection_set(iid)
+            self.tree.see(iid)
+
+    @timed
     def save_purchase(self):
         date = self.date_e.get().strip()
         batch = self.batch_e.get().strip()
@@ -524,13 +644,16 @@ class EntriesFrame(ttk.Frame):
                 messagebox.showerror("Invalid Unit", f"Dyeing unit '{dyeing_unit}' not found.")
                 return
 
-            fabric_type_id = db.get_fabric_type_id_by_name(fabric_type)
-            if not fabric_type_id:
+            if fabric_type not in fabric_types:
                 messagebox.showerror("Invalid Fabric", f"Fabric type '{fabric_type}' not found.")
                 return
 
             composition = f"Rib: {has_rib}, Collar: {has_collar}"
-            db.create_batch(batch_num, knitting_id, fabric_type_id, lots_int, composition, dyeing_id)
+            try:
+                db.create_batch(batch_num, knitting_id, fabric_type, lots_int, composition, dyeing_id)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             messagebox.showinfo("Success", f"Batch '{batch_num}' created with {lots_int} lots.")
             dialog.destroy()
             self.refresh_lists()
@@ -540,6 +663,7 @@ class EntriesFrame(ttk.Frame):
         ttk.Button(dialog, text="Save", command=save_batch).grid(row=7, column=0, columnspan=2, pady=10)
         ttk.Button(dialog, text="Cancel", command=dialog.destroy).grid(row=8, column=0, columnspan=2, pady=5)
 
+    @timed
     def reload_dyeing_outputs(self):
         for r in self.dye_tree.get_children():
             self.dye_tree.delete(r)
@@ -558,6 +682,7 @@ class EntriesFrame(ttk.Frame):
                     row["lot_id"], row["unit"], display_date, row["returned_qty_kg"], row["returned_qty_rolls"], row["notes"]
                 ))
 
+    @timed
     def save_dyeing(self):
         lot_no = self.dyeing_lot_e.get().strip()
         unit = self.dyeing_unit_cb.get().strip()
@@ -677,11 +802,32 @@ class EntriesFrame(ttk.Frame):
     def show_net_price(self):
         batch_id = self.batch_e.get().strip()
         if batch_id:
-            price = db.calculate_net_price(batch_id)
-            messagebox.showinfo("Net Price", f"Total Cost: ${price:.2f}")
+            cost = costing.batch_cost(batch_id)
+            if not cost:
+                messagebox.showwarning("Not Found", f"No purchases or batch found for '{batch_id}'.")
+                return
+            messagebox.showinfo("Net Price", (
+                f"Yarn: {cost['yarn_cost']:,.2f}\n"
+                f"Knitting: {cost['knit_cost']:,.2f} ({cost['knit_kg']:,.2f} kg)\n"
+                f"Dyeing: {cost['dye_cost']:,.2f} ({cost['dyed_kg']:,.2f} kg)\n"
+                f"Total Cost: {cost['net_cost']:,.2f}  ({cost['cost_per_kg']:,.2f} / kg)"
+                f"{self._fifo_summary(batch_id)}"
+            ))
         else:
             messagebox.showwarning("Missing", "Enter a Batch ID")
 
+    def _fifo_summary(self, batch_id):
+        rows = db.fifo_lot_consumption(batch_ref=batch_id)
+        if not rows:
+            return ""
+        kg = sum(r["qty_kg"] for r in rows)
+        cost = sum(r["cost"] or 0 for r in rows)
+        uncovered = sum(r["qty_kg"] for r in rows if r["purchase_id"] is None)
+        text = f"\n\nYarn consumed (FIFO): {kg:,.2f} kg costing {cost:,.2f}"
+        if uncovered:
+            text += f"\n{uncovered:,.2f} kg not covered by earlier purchases"
+        return text
+
     def on_purchase_double_click(self, event):
         item = self.tree.selection()
         if not item:
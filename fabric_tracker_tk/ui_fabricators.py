@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from fabric_tracker_tk import db
+from fabric_tracker_tk.latency import timed
 from datetime import datetime
 
 SHORTAGE_THRESHOLD_PERCENT = 5.0  # Highlight threshold for general shortages
@@ -100,12 +101,14 @@ class KnittingTab(ttk.Frame):
     def on_canvas_configure(self, event):
         self.canvas.itemconfig(self.canvas.find_withtag("all"), width=event.width)
 
+    @timed
     def reload_all(self):
         self.load_inward_transactions()
         self.load_outward_transactions()
         self.load_batches()
         self.load_stock_summary()
 
+    @timed
     def load_inward_transactions(self):
         for r in self.tx_tree.get_children():
             self.tx_tree.delete(r)
@@ -120,6 +123,7 @@ class KnittingTab(ttk.Frame):
                 display_date = db.db_to_ui_date(row["date"])
                 self.tx_tree.insert("", "end", values=(display_date, row["supplier"], row["yarn_type"], row["qty_kg"], row["qty_rolls"], row["batch_id"], row["lot_no"]))
 
+    @timed
     def load_outward_transactions(self):
         for r in self.out_tx_tree.get_children():
             self.out_tx_tree.delete(r)
@@ -135,6 +139,7 @@ class KnittingTab(ttk.Frame):
                 display_date = db.db_to_ui_date(row["date"])
                 self.out_tx_tree.insert("", "end", values=(display_date, row["delivered_to"], row["yarn_type"], row["qty_kg"], row["qty_rolls"], row["batch_id"], row["lot_no"]))
 
+    @timed
     def load_batches(self):
         for r in self.batch_tree.get_children():
             self.batch_tree.delete(r)
@@ -167,6 +172,7 @@ class KnittingTab(ttk.Frame):
         if row and self.controller and hasattr(self.controller, "open_dyeing_tab_for_batch"):
             self.controller.open_dyeing_tab_for_batch(row["delivered_to"], batch_ref)
 
+    @timed
     def load_stock_summary(self):
         for r in self.summary_tree.get_children():
             self.summary_tree.delete(r)
@@ -257,10 +263,12 @@ class DyeingTab(ttk.Frame):
     def on_canvas_configure(self, event):
         self.canvas.itemconfig(self.canvas.find_withtag("all"), width=event.width)
 
+    @timed
     def reload_all(self):
         self.load_pending()
         self.load_completed()
 
+    @timed
     def load_pending(self):
         for r in self.pending_tree.get_children():
             self.pending_tree.delete(r)
@@ -297,6 +305,7 @@ class DyeingTab(ttk.Frame):
                     self.pending_tree.insert("", "end", values=(batch_id, lot_no, yarn_type, orig_kg, orig_rolls, rkg, rrolls, round(short_kg, 2), round(short_pct, 2)), tags=(tag,))
             self.pending_tree.tag_configure("short", background="#ffcccc")
 
+    @timed
     def load_completed(self):
         for r in self.completed_tree.get_children():
             self.completed_tree.delete(r)
@@ -352,6 +361,7 @@ class FabricatorsFrame(ttk.Frame):
         self.parent_nb = ttk.Notebook(self)
         self.parent_nb.pack(fill="both", expand=True)
 
+    @timed
     def build_tabs(self):
         # Remove all previous content
         for child in self.parent_nb.winfo_children():
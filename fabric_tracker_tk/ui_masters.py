@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, colorchooser
 from fabric_tracker_tk import db
+from fabric_tracker_tk.latency import timed
 
 MASTER_TYPES = [
     ("Yarn Supplier", "yarn_supplier"),
@@ -152,6 +153,7 @@ class MastersFrame(ttk.Frame):
         luminance = (0.299 * r + 0.587 * g + 0.114 * b) / 255
         return luminance > 0.5
 
+    @timed
     def add_or_update_supplier(self):
         name = self.supplier_name_entry.get().strip()
         if not name:
@@ -175,6 +177,7 @@ class MastersFrame(ttk.Frame):
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save supplier: {str(e)}")
 
+    @timed
     def delete_supplier(self):
         sel = self.supplier_tree.selection()
         if not sel:
@@ -212,6 +215,7 @@ class MastersFrame(ttk.Frame):
             self.supplier_tree.selection_set(selected)
             self.supplier_menu.post(event.x_root, event.y_root)
 
+    @timed
     def add_or_update_yarn_type(self):
         name = self.yarn_name_entry.get().strip()
         if not name:
@@ -227,6 +231,7 @@ class MastersFrame(ttk.Frame):
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save yarn type: {str(e)}")
 
+    @timed
     def delete_yarn_type(self):
         sel = self.yarn_tree.selection()
         if not sel:
@@ -253,6 +258,7 @@ class MastersFrame(ttk.Frame):
             self.yarn_tree.selection_set(selected)
             self.yarn_menu.post(event.x_root, event.y_root)
 
+    @timed
     def add_or_update_fabric(self):
         name = self.fabric_name_entry.get().strip()
         if not name:
@@ -268,6 +274,7 @@ class MastersFrame(ttk.Frame):
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save fabric: {str(e)}")
 
+    @timed
     def delete_fabric(self):
         sel = self.fabric_comp_tree.selection()
         if not sel:
@@ -288,6 +295,7 @@ class MastersFrame(ttk.Frame):
         self.fabric_name_entry.delete(0, tk.END)
         self.fabric_name_entry.insert(0, name)
 
+    @timed
     def add_or_update_composition(self):
         fabric_name = self.fabric_name_entry.get().strip() or self.selected_fabric
         if not fabric_name:
@@ -314,6 +322,7 @@ class MastersFrame(ttk.Frame):
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save composition: {str(e)}")
 
+    @timed
     def delete_composition(self):
         sel = self.fabric_comp_tree.selection()
         if not sel:
@@ -345,6 +354,7 @@ class MastersFrame(ttk.Frame):
             self.fabric_comp_tree.selection_set(selected)
             self.fabric_comp_menu.post(event.x_root, event.y_root)
 
+    @timed
     def load_masters(self):
         # Clear all trees and images
         for tree in [self.supplier_tree, self.yarn_tree, self.fabric_comp_tree]:
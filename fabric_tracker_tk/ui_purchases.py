@@ -2,6 +2,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from fabric_tracker_tk.db import Database
+from fabric_tracker_tk.latency import timed
 
 class PurchasesUI:
     def __init__(self, master):
@@ -15,12 +16,12 @@ class PurchasesUI:
         # Table
         self.tree = ttk.Treeview(
             self.frame,
-            columns=("id", "supplier", "item", "quantity", "price", "date"),
+            columns=("id", "supplier", "item", "quantity", "price", "date", "delivered"),
             show="headings"
         )
         for col, text in zip(
-            ("id", "supplier", "item", "quantity", "price", "date"),
-            ("ID", "Supplier", "Item", "Quantity", "Price", "Date")
+            ("id", "supplier", "item", "quantity", "price", "date", "delivered"),
+            ("ID", "Supplier", "Item", "Quantity", "Price", "Date", "Delivered To")
         ):
             self.tree.heading(col, text=text)
         self.tree.grid(row=1, column=0, columnspan=4, sticky="nsew")
@@ -49,21 +50,37 @@ class PurchasesUI:
         self.date_var = tk.StringVar()
         ttk.Entry(self.frame, textvariable=self.date_var).grid(row=6, column=1, sticky="ew")
 
+        ttk.Label(self.frame, text="Delivered To:").grid(row=7, column=0, sticky="w")
+        self.delivered_var = tk.StringVar()
+        ttk.Entry(self.frame, textvariable=self.delivered_var).grid(row=7, column=1, sticky="ew")
+
         # Buttons
-        ttk.Button(self.frame, text="Add", command=self.add_purchase).grid(row=7, column=0, pady=5)
-        ttk.Button(self.frame, text="Update", command=self.update_purchase).grid(row=7, column=1, pady=5)
-        ttk.Button(self.frame, text="Delete", command=self.delete_purchase).grid(row=7, column=2, pady=5)
+        ttk.Button(self.frame, text="Add", command=self.add_purchase).grid(row=8, column=0, pady=5)
+        ttk.Button(self.frame, text="Update", command=self.update_purchase).grid(row=8, column=1, pady=5)
+        ttk.Button(self.frame, text="Delete", command=self.delete_purchase).grid(row=8, column=2, pady=5)
+        self.more_btn = ttk.Button(self.frame, text="Load More", command=self.load_more)
+        self.more_btn.grid(row=8, column=3, pady=5, sticky="e")
 
         self.load_purchases()
         self.tree.bind("<<TreeviewSelect>>", self.on_select)
 
+    @timed
     def load_purchases(self):
         for i in self.tree.get_children():
             self.tree.delete(i)
-        rows = self.db.fetch_purchases()
+        self._last_id = None
+        self.load_more()
+
+    @timed
+    def load_more(self):
+        rows = self.db.fetch_purchases(before_id=self._last_id)
         for row in rows:
             self.tree.insert("", "end", values=row)
+        if rows:
+            self._last_id = rows[-1][0]
+        self.more_btn.config(state="normal" if len(rows) == self.db.page_size else "disabled")
 
+    @timed
     def add_purchase(self):
         supplier = self.supplier_var.get().strip()
         item = self.item_var.get().strip()
@@ -81,7 +98,11 @@ class PurchasesUI:
             messagebox.showerror("Error", "Quantity and Price must be numeric")
             return
 
-        self.db.insert_purchase(supplier, item, qty, prc, date)
+        try:
+            self.db.insert_purchase(supplier, item, qty, prc, date, self.delivered_var.get().strip())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         self.load_purchases()
         self.clear_form()
 
@@ -107,10 +128,15 @@ class PurchasesUI:
             messagebox.showerror("Error", "Quantity and Price must be numeric")
             return
 
-        self.db.update_purchase(purchase_id, supplier, item, qty, prc, date)
+        try:
+            self.db.update_purchase(purchase_id, supplier, item, qty, prc, date, self.delivered_var.get().strip())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         self.load_purchases()
         self.clear_form()
 
+    @timed
     def delete_purchase(self):
         selected = self.tree.selection()
         if not selected:
@@ -130,6 +156,7 @@ class PurchasesUI:
         self.quantity_var.set("")
         self.price_var.set("")
         self.date_var.set("")
+        self.delivered_var.set("")
 
     def on_select(self, event):
         selected = self.tree.selection()
@@ -141,3 +168,4 @@ class PurchasesUI:
         self.quantity_var.set(values[3])
         self.price_var.set(values[4])
         self.date_var.set(values[5])
+        self.delivered_var.set(values[6])
@@ -2,6 +2,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from fabric_tracker_tk.db import Database
+from fabric_tracker_tk.latency import timed
 
 class SalesUI:
     def __init__(self, master):
@@ -33,7 +34,7 @@ class SalesUI:
         self.customer_var = tk.StringVar()
         ttk.Entry(self.frame, textvariable=self.customer_var).grid(row=2, column=1, sticky="ew")
 
-        ttk.Label(self.frame, text="Item:").grid(row=3, column=0, sticky="w")
+        ttk.Label(self.frame, text="Item (roll codes, lot no. or stock item):").grid(row=3, column=0, sticky="w")
         self.item_var = tk.StringVar()
         ttk.Entry(self.frame, textvariable=self.item_var).grid(row=3, column=1, sticky="ew")
 
@@ -53,17 +54,29 @@ class SalesUI:
         ttk.Button(self.frame, text="Add", command=self.add_sale).grid(row=7, column=0, pady=5)
         ttk.Button(self.frame, text="Update", command=self.update_sale).grid(row=7, column=1, pady=5)
         ttk.Button(self.frame, text="Delete", command=self.delete_sale).grid(row=7, column=2, pady=5)
+        self.more_btn = ttk.Button(self.frame, text="Load More", command=self.load_more)
+        self.more_btn.grid(row=7, column=3, pady=5, sticky="e")
 
         self.load_sales()
         self.tree.bind("<<TreeviewSelect>>", self.on_select)
 
+    @timed
     def load_sales(self):
         for i in self.tree.get_children():
             self.tree.delete(i)
-        rows = self.db.fetch_sales()
+        self._last_id = None
+        self.load_more()
+
+    @timed
+    def load_more(self):
+        rows = self.db.fetch_sales(before_id=self._last_id)
         for row in rows:
             self.tree.insert("", "end", values=row)
+        if rows:
+            self._last_id = rows[-1][0]
+        self.more_btn.config(state="normal" if len(rows) == self.db.page_size else "disabled")
 
+    @timed
     def add_sale(self):
         customer = self.customer_var.get().strip()
         item = self.item_var.get().strip()
@@ -81,7 +94,11 @@ class SalesUI:
             messagebox.showerror("Error", "Quantity and Price must be numeric")
             return
 
-        self.db.insert_sale(customer, item, qty, prc, date)
+        try:
+            self.db.insert_sale(customer, item, qty, prc, date)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         self.load_sales()
         self.clear_form()
 
@@ -105,10 +122,15 @@ class SalesUI:
             messagebox.showerror("Error", "Quantity and Price must be numeric")
             return
 
-        self.db.update_sale(sale_id, customer, item, qty, prc, date)
+        try:
+            self.db.update_sale(sale_id, customer, item, qty, prc, date)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         self.load_sales()
         self.clear_form()
 
+    @timed
     def delete_sale(self):
         selected = self.tree.selection()
         if not selected:
@@ -0,0 +1,96 @@
+import tkinter as tk
+from tkinter import ttk
+from fabric_tracker_tk import db
+from fabric_tracker_tk.latency import timed
+
+KIND_LABELS = {"purchase": "Purchase", "lot": "Lot", "batch": "Batch", "dyeing": "Dyeing Output", "roll": "Roll"}
+SEARCH_DELAY_MS = 150  # Wait for a pause in typing before querying
+
+class SearchFrame(ttk.Frame):
+    def __init__(self, parent, controller=None):
+        super().__init__(parent)
+        self.controller = controller
+        self._pending = None
+        self._results = {}
+        self.build_ui()
+
+    def build_ui(self):
+        top = ttk.Frame(self)
+        top.pack(fill="x", padx=6, pady=6)
+        ttk.Label(top, text="Search:").pack(side="left", padx=4)
+        self.query_var = tk.StringVar()
+        self.query_e = ttk.Entry(top, textvariable=self.query_var, width=50)
+        self.query_e.pack(side="left", padx=4)
+        self.query_e.bind("<KeyRelease>", self._schedule_search)
+        self.query_e.bind("<Return>", lambda e: self.run_search())
+        ttk.Label(top, text="Batch refs, lot numbers, suppliers, yarns, notes", foreground="gray").pack(side="left", padx=8)
+
+        self._summary_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self._summary_var, foreground="gray").pack(anchor="w", padx=8)
+
+        frame = ttk.Frame(self)
+        frame.pack(fill="both", expand=True, padx=6, pady=4)
+        sy = ttk.Scrollbar(frame, orient="vertical")
+        sy.pack(side="right", fill="y")
+        cols = ("kind", "ref", "names", "notes")
+        self.tree = ttk.Treeview(frame, columns=cols, show="headings", yscrollcommand=sy.set)
+        self.tree.pack(fill="both", expand=True)
+        sy.config(command=self.tree.yview)
+        for c, h, w in zip(cols, ["Type", "Reference", "Details", "Notes"], [110, 180, 360, 260]):
+            self.tree.heading(c, text=h)
+            self.tree.column(c, width=w)
+        self.tree.bind("<Double-1>", self.on_result_double_click)
+
+    def _schedule_search(self, _e=None):
+        if self._pending:
+            self.after_cancel(self._pending)
+        self._pending = self.after(SEARCH_DELAY_MS, self.run_search)
+
+    @timed
+    def run_search(self):
+        self._pending = None
+        for r in self.tree.get_children():
+            self.tree.delete(r)
+        self._results = {}
+        text = self.query_var.get().strip()
+        if not text:
+            self._summary_var.set("")
+            return
+        hits = db.global_search(text, limit=200)
+        # A scanned roll code resolves straight to its roll and lot
+        roll = db.find_roll(text) if text.upper().startswith(db.ROLL_CODE_PREFIX) else None
+        if roll:
+            hits.insert(0, {"kind": "roll", "id": roll["id"], "ref": roll["code"],
+                            "names": f"Lot {roll['lot_no']}  ·  {roll['weight_kg'] or 0:,.2f} kg  ·  {roll['state']}",
+                            "notes": roll["location"] or "", "lot_no": roll["lot_no"]})
+        for i, hit in enumerate(hits):
+            iid = str(i)
+            self._results[iid] = hit
+            self.tree.insert("", "end", iid=iid, values=(
+                KIND_LABELS.get(hit["kind"], hit["kind"]), hit["ref"], hit["names"], hit["notes"]
+            ))
+        self._summary_var.set(f"  {len(hits)} matches")
+
+    def on_result_double_click(self, _e):
+        sel = self.tree.selection()
+        if not sel or not self.controller:
+            return
+        hit = self._results.get(sel[0])
+        if not hit:
+            return
+        if hit["kind"] == "purchase" and hasattr(self.controller, "entries_frame"):
+            self.controller.notebook.select(self.controller.entries_frame)
+            self.controller.entries_frame.show_purchase(hit["id"])
+        elif hit["kind"] in ("batch", "lot") and hasattr(self.controller, "show_trace"):
+            self.controller.show_trace(hit["ref"])
+        elif hit["kind"] == "roll" and hasattr(self.controller, "show_trace"):
+            self.controller.show_trace(hit["lot_no"])
+        elif hit["kind"] in ("batch", "lot") and hasattr(self.controller, "dashboard_frame"):
+            self.controller.notebook.select(self.controller.dashboard_frame)
+        elif hit["kind"] == "dyeing" and hasattr(self.controller, "entries_frame"):
+            self.controller.notebook.select(self.controller.entries_frame)
+            self.controller.entries_frame.notebook.select(self.controller.entries_frame.tab_dyeing)
+
+    def reload_data(self):
+        if self.query_var.get().strip():
+            self.run_search()
@@ -2,6 +2,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from fabric_tracker_tk.db import Database
+from fabric_tracker_tk.latency import timed
 
 class StockUI:
     def __init__(self, master):
@@ -49,17 +50,29 @@ class StockUI:
         ttk.Button(self.frame, text="Add", command=self.add_stock).grid(row=6, column=0, pady=5)
         ttk.Button(self.frame, text="Update", command=self.update_stock).grid(row=6, column=1, pady=5)
         ttk.Button(self.frame, text="Delete", command=self.delete_stock).grid(row=6, column=2, pady=5)
+        self.more_btn = ttk.Button(self.frame, text="Load More", command=self.load_more)
+        self.more_btn.grid(row=6, column=3, pady=5, sticky="e")
 
         self.load_stock()
         self.tree.bind("<<TreeviewSelect>>", self.on_select)
 
+    @timed
     def load_stock(self):
         for i in self.tree.get_children():
             self.tree.delete(i)
-        rows = self.db.fetch_stock()
+        self._last_id = None
+        self.load_more()
+
+    @timed
+    def load_more(self):
+        rows = self.db.fetch_stock(before_id=self._last_id)
         for row in rows:
             self.tree.insert("", "end", values=row)
+        if rows:
+            self._last_id = rows[-1][0]
+        self.more_btn.config(state="normal" if len(rows) == self.db.page_size else "disabled")
 
+    @timed
     def add_stock(self):
         item = self.item_var.get().strip()
         quantity = self.quantity_var.get().strip()
@@ -101,6 +114,7 @@ class StockUI:
         self.load_stock()
         self.clear_form()
 
+    @timed
     def delete_stock(self):
         selected = self.tree.selection()
         if not selected:
@@ -110,7 +124,11 @@ class StockUI:
         stock_id = self.tree.item(selected)["values"][0]
         confirm = messagebox.askyesno("Confirm", "Are you sure you want to delete this record?")
         if confirm:
-            self.db.delete_stock(stock_id)
+            try:
+                self.db.delete_stock(stock_id)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.load_stock()
             self.clear_form()
 
@@ -0,0 +1,142 @@
+import tkinter as tk
+from tkinter import ttk, messagebox
+from fabric_tracker_tk import db
+from fabric_tracker_tk.latency import timed
+
+DIRECTIONS = {"Both": "both", "Backward (yarn sources)": "backward", "Forward (dyeing returns)": "forward"}
+VIA_LABELS = {"issued": "Issued", "fifo": "FIFO draw"}
+
+def _kg(value):
+    return f"{value:,.2f}" if value else ""
+
+class TraceFrame(ttk.Frame):
+    """Genealogy of lots and batches: the yarn purchases behind them and the dyeing returns after."""
+    def __init__(self, parent, controller=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.build_ui()
+
+    def build_ui(self):
+        top = ttk.Frame(self)
+        top.pack(fill="x", padx=6, pady=6)
+        ttk.Label(top, text="Lot / Batch:").pack(side="left", padx=4)
+        self.ref_var = tk.StringVar()
+        ref_e = ttk.Entry(top, textvariable=self.ref_var, width=40)
+        ref_e.pack(side="left", padx=4)
+        ref_e.bind("<Return>", lambda e: self.run_trace())
+        ttk.Label(top, text="Direction:").pack(side="left", padx=4)
+        self.direction_var = tk.StringVar(value="Both")
+        ttk.Combobox(top, textvariable=self.direction_var, values=list(DIRECTIONS),
+                     state="readonly", width=24).pack(side="left", padx=4)
+        ttk.Button(top, text="Trace", command=self.run_trace).pack(side="left", padx=4)
+        ttk.Label(top, text="Lot numbers (BATCH/1) or batch refs, comma separated",
+                  foreground="gray").pack(side="left", padx=8)
+
+        self._summary_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self._summary_var, foreground="gray").pack(anchor="w", padx=8)
+
+        frame = ttk.Frame(self)
+        frame.pack(fill="both", expand=True, padx=6, pady=4)
+        sy = ttk.Scrollbar(frame, orient="vertical")
+        sy.pack(side="right", fill="y")
+        cols = ("date", "party", "yarn", "kg", "detail")
+        self.tree = ttk.Treeview(frame, columns=cols, show="tree headings", yscrollcommand=sy.set)
+        self.tree.pack(fill="both", expand=True)
+        sy.config(command=self.tree.yview)
+        self.tree.heading("#0", text="Item")
+        self.tree.column("#0", width=200)
+        for c, h, w in zip(cols, ["Date", "Supplier / Unit", "Yarn / Fabric", "Qty (kg)", "Details"],
+                           [90, 220, 160, 90, 420]):
+            self.tree.heading(c, text=h)
+            self.tree.column(c, width=w, anchor="e" if c == "kg" else "w")
+
+    def trace(self, ref):
+        """Trace one lot or batch reference, e.g. from another tab."""
+        self.ref_var.set(ref)
+        self.run_trace()
+
+    @timed
+    def run_trace(self):
+        for r in self.tree.get_children():
+            self.tree.delete(r)
+        refs = [r.strip() for r in self.ref_var.get().split(",") if r.strip()]
+        if not refs:
+            self._summary_var.set("")
+            return
+        # Anything that is not a lot number is taken as a batch ref
+        lot_nos = [r for r in refs if db.get_lot_id_by_no(r)]
+        batch_refs = [r for r in refs if r not in lot_nos]
+        try:
+            result = db.trace(lot_nos=lot_nos, batch_refs=batch_refs,
+                              direction=DIRECTIONS.get(self.direction_var.get(), "both"))
+        except Exception as e:
+            messagebox.showerror("Error", f"Trace failed: {e}")
+            return
+        self._show(result)
+
+    def _show(self, result):
+        nodes, fifo = result["nodes"], result["fifo"]
+        children = {}
+        for parent, child, via in result["edges"]:
+            children.setdefault(parent, []).append((child, via))
+            children.setdefault(child, []).append((parent, via))
+
+        placed = set()
+        for key in sorted((k for k in nodes if k[0] == "batch"), key=lambda k: nodes[k]["batch_ref"]):
+            batch = nodes[key]
+            iid = self.tree.insert("", "end", text=f"Batch {batch['batch_ref']}", open=True, values=(
+                "", batch["knitter"], batch["fabric_type_name"] or "", "",
+                f"{batch['status']}  ·  {batch['firm_name'] or ''}"))
+            for other, via in children.get(key, []):
+                if other[0] == "purchase" and other in nodes:
+                    self._insert_purchase(iid, nodes[other], [via])
+            for other, _via in sorted(children.get(key, []), key=lambda c: nodes.get(c[0], {}).get("lot_index") or 0):
+                if other[0] == "lot" and other in nodes:
+                    self._insert_lot(iid, other, nodes, children, fifo)
+                    placed.add(other)
+        for key in sorted((k for k in nodes if k[0] == "lot" and k not in placed), key=lambda k: nodes[k]["lot_no"]):
+            self._insert_lot("", key, nodes, children, fifo)
+
+        lots = [nodes[k] for k in nodes if k[0] == "lot"]
+        sent = sum(l["sent_kg"] or 0 for l in lots)
+        returned = sum(l["returned_kg"] or 0 for l in lots)
+        purchases = sum(1 for k in nodes if k[0] == "purchase")
+        summary = f"  {len(lots)} lots  ·  {purchases} purchases  ·  sent {sent:,.2f} kg  ·  returned {returned:,.2f} kg"
+        if returned and sent:
+            summary += f"  ·  shortage {sent - returned:,.2f} kg ({(sent - returned) / sent * 100:.1f}%)"
+        if result["missing"]:
+            summary += f"  ·  not found: {', '.join(result['missing'])}"
+        self._summary_var.set(summary)
+
+    def _insert_lot(self, parent, key, nodes, children, fifo):
+        lot = nodes[key]
+        detail = f"{lot['status']}  ·  sent {_kg(lot['sent_kg']) or '0.00'} kg  ·  returned {_kg(lot['returned_kg']) or '0.00'} kg"
+        if lot["shortage_kg"] is not None:
+            detail += f"  ·  shortage {lot['shortage_kg']:,.2f} kg ({lot['shortage_pct'] or 0:.1f}%)"
+        iid = self.tree.insert(parent, "end", text=f"Lot {lot['lot_no']}", open=True,
+                               values=("", "", "", _kg(lot["issued_kg"]), detail))
+        vias = {}
+        for other, via in children.get(key, []):
+            if other[0] == "purchase" and other in nodes:
+                vias.setdefault(other, []).append(via)
+        for other in sorted(vias, key=lambda k: (nodes[k]["date"] or "", k[1])):
+            self._insert_purchase(iid, nodes[other], vias[other], fifo.get((other[1], key[1])))
+        for other, _via in children.get(key, []):
+            if other[0] == "dyeing" and other in nodes:
+                d = nodes[other]
+                self.tree.insert(iid, "end", text=f"Dyeing #{d['id']}", values=(
+                    d["returned_date"] or "", d["dyeing_unit"], "", _kg(d["returned_qty_kg"]), "Returned"))
+
+    def _insert_purchase(self, parent, p, vias, drawn=None):
+        detail = "  ·  ".join(VIA_LABELS.get(v, v) for v in sorted(vias, key=list(VIA_LABELS).index))
+        if drawn:
+            detail += f" {drawn[0]:,.2f} kg costing {drawn[1]:,.2f}"
+        if p["price_per_unit"]:
+            detail += f"  ·  @ {p['price_per_unit']:,.2f}/kg"
+        self.tree.insert(parent, "end", text=f"Purchase #{p['id']}", values=(
+            p["date"] or "", f"{p['supplier'] or ''} → {p['delivered_to'] or ''}", p["yarn_type"] or "",
+            _kg(p["qty_kg"]), detail))
+
+    def reload_data(self):
+        if self.ref_var.get().strip():
+            self.run_trace()
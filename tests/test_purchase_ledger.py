@@ -0,0 +1,49 @@
+"""Purchase Ledger (db.Database.insert_purchase) against a throwaway database."""
+import os
+import tempfile
+
+# db creates and migrates its database on import, under the user's home
+_home = tempfile.mkdtemp(prefix="fabric_tracker_test_")
+os.environ["HOME"] = os.environ["APPDATA"] = _home
+
+import pytest  # noqa: E402
+from fabric_tracker_tk import db  # noqa: E402
+
+KNITTING_UNIT = "Shiv Fabrics"            # Seeded by init_db
+DYEING_UNIT = "Oswal Finishing Mills"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def masters():
+    db.add_yarn_type("Cotton")
+    db.add_fabric_composition("Jersey", "Cotton", 100)
+
+
+def test_knitting_unit_purchase_gets_its_own_batch_and_lot():
+    ledger = db.Database()
+    first = ledger.insert_purchase("YS", "Cotton", 10, 50, "01/05/2024", KNITTING_UNIT)
+    second = ledger.insert_purchase("YS", "Cotton", 4, 50, "01/05/2024", KNITTING_UNIT)
+    with db.get_connection() as conn:
+        rows = [conn.execute("""
+            SELECT p.batch_id, p.lot_no, b.status, l.weight_kg, l.batch_id = b.id AS same_batch
+            FROM purchases p JOIN batches b ON b.batch_ref = p.batch_id JOIN lots l ON l.lot_no = p.lot_no
+            WHERE p.id = ?
+        """, (pid,)).fetchone() for pid in (first, second)]
+    assert all(r is not None and r["same_batch"] for r in rows)
+    assert rows[0]["batch_id"] != rows[1]["batch_id"]  # Same second, still separate batches
+    assert rows[0]["lot_no"] == rows[0]["batch_id"] + "/1"
+    assert rows[0]["status"] == "Knitted" and rows[0]["weight_kg"] == 10
+
+
+def test_dyeing_unit_purchase_is_refused():
+    with db.get_connection() as conn:
+        before = conn.execute("SELECT COUNT(*) FROM purchases").fetchone()[0]
+    with pytest.raises(ValueError, match="not a knitting unit"):
+        db.Database().insert_purchase("YS", "Cotton", 10, 50, "01/05/2024", DYEING_UNIT)
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM purchases").fetchone()[0] == before
+
+
+def test_unknown_destination_is_refused():
+    with pytest.raises(ValueError, match="not found in Masters"):
+        db.Database().insert_purchase("YS", "Cotton", 10, 50, "01/05/2024", "Nowhere Mills")